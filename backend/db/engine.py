@@ -1,13 +1,35 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from env import DB_USER, DB_PASSWORD, DB_PORT, DB_NAME, DB_HOST
+from db.query_stats import install
+from env import DB_USER, DB_PASSWORD, DB_PORT, DB_NAME, DB_HOST, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, EXPORT_DB_HOST, EXPORT_DB_POOL_SIZE
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+POSTGRES_DSN = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+install(engine)
+# expire_on_commit is disabled so rows returned by the services can still be serialized after the commit
+SessionLocal = sessionmaker(engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
+
+# exports get their own small pool, on a replica when EXPORT_DB_HOST is set
+export_engine = engine
+if(EXPORT_DB_HOST != DB_HOST):
+    export_engine = create_async_engine(
+        f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{EXPORT_DB_HOST}:{DB_PORT}/{DB_NAME}",
+        pool_size=EXPORT_DB_POOL_SIZE,
+        max_overflow=0,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    install(export_engine)
+ExportSessionLocal = sessionmaker(export_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
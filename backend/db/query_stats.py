@@ -0,0 +1,72 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class QueryStats():
+    """Queries sent to the database while tracking is active, also added to the enclosing tracking"""
+    __slots__ = ("parent", "queries", "rows", "time", "statements")
+
+    def __init__(self, parent: "QueryStats | None" = None):
+        self.parent = parent
+        self.queries = 0
+        self.rows = 0
+        self.time = 0.0
+        self.statements: list[str] = []
+
+    def record(self, statement: str, rows: int, elapsed: float):
+        stats: QueryStats | None = self
+        while stats is not None:
+            stats.queries += 1
+            stats.rows += rows
+            stats.time += elapsed
+            stats.statements.append(statement)
+            stats = stats.parent
+
+    def summary(self) -> str:
+        return f"queries={self.queries}; rows={self.rows}; time_ms={self.time * 1000:.2f}"
+
+
+current_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries():
+    stats = QueryStats(current_stats.get())
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+
+
+# assert_max_queries fails when the block sends more than `limit` queries, the statements are listed in the error
+@contextmanager
+def assert_max_queries(limit: int):
+    with track_queries() as stats:
+        yield stats
+    if(stats.queries > limit):
+        statements = "\n".join(stats.statements)
+        raise AssertionError(f"expected at most {limit} queries, {stats.queries} were sent:\n{statements}")
+
+
+def install(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if(current_stats.get() is not None):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_stats.get()
+        if(stats is None or not conn.info.get("query_start")):
+            return
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        # rowcount is only set for writes, asyncpg cursors hold the fetched rows of a select in _rows
+        rows = cursor.rowcount if cursor.rowcount >= 0 else len(getattr(cursor, "_rows", None) or ())
+        stats.record(statement, rows, elapsed)
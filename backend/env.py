@@ -8,3 +8,71 @@ DB_PASSWORD = os.environ.get('DB_PASSWORD')
 DB_PORT = os.environ.get('DB_PORT')
 DB_NAME = os.environ.get('DB_NAME')
 DB_HOST = os.environ.get('DB_HOST')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+GAME_CACHE_SIZE = int(os.environ.get('GAME_CACHE_SIZE', 1024))
+GAME_CACHE_IDLE_SECONDS = float(os.environ.get('GAME_CACHE_IDLE_SECONDS', 0))
+GAME_LOCK_STRIPES = int(os.environ.get('GAME_LOCK_STRIPES', 1024))
+WS_SEND_TIMEOUT = float(os.environ.get('WS_SEND_TIMEOUT', 5))
+# frames queued for a spectator before they are dropped for the latest snapshot
+SPECTATOR_QUEUE_SIZE = int(os.environ.get('SPECTATOR_QUEUE_SIZE', 8))
+# memory keeps turns and events in this process, postgres shares them between workers with LISTEN/NOTIFY
+GAME_BACKEND = os.environ.get('GAME_BACKEND', 'memory')
+# tiles keeps one game_tile row per cell, moves keeps the game_move log plus packed snapshots
+BOARD_STORAGE = os.environ.get('BOARD_STORAGE', 'tiles')
+BOARD_SNAPSHOT_INTERVAL = int(os.environ.get('BOARD_SNAPSHOT_INTERVAL', 16))
+# sync commits every move before answering, behind answers from memory and writes moves in batches,
+# see services.game.writer.MoveWriter for what can be lost, behind needs GAME_BACKEND=memory and a single uvicorn
+# worker on the database, a second worker started with it fails on startup
+MOVE_WRITE_MODE = os.environ.get('MOVE_WRITE_MODE', 'sync')
+MOVE_FLUSH_INTERVAL = float(os.environ.get('MOVE_FLUSH_INTERVAL', 0.01))
+MOVE_FLUSH_BATCH = int(os.environ.get('MOVE_FLUSH_BATCH', 1000))
+AI_WORKERS = int(os.environ.get('AI_WORKERS', 2))
+AI_TIME_BUDGET = float(os.environ.get('AI_TIME_BUDGET', 0.5))
+AI_MAX_DEPTH = int(os.environ.get('AI_MAX_DEPTH', 32))
+AI_QUEUE_SIZE = int(os.environ.get('AI_QUEUE_SIZE', 256))
+AI_SCHEDULER_WORKERS = int(os.environ.get('AI_SCHEDULER_WORKERS', 4))
+# retries of an AI turn that raised, after the first one waits AI_RETRY_DELAY seconds, doubled every retry,
+# once they fail the turn goes back to the human player
+AI_RETRIES = int(os.environ.get('AI_RETRIES', 2))
+AI_RETRY_DELAY = float(os.environ.get('AI_RETRY_DELAY', 0.5))
+LOBBY_PAGE_SIZE = int(os.environ.get('LOBBY_PAGE_SIZE', 50))
+# header adds the X-DB-Queries header to every response, log writes a line per request and websocket message
+QUERY_STATS = os.environ.get('QUERY_STATS', '')
+# admission control of moves and game websockets, see services.game.admission, 0 disables a limit
+MOVE_MAX_IN_FLIGHT = int(os.environ.get('MOVE_MAX_IN_FLIGHT', 32))
+MOVE_MAX_QUEUED = int(os.environ.get('MOVE_MAX_QUEUED', 128))
+MOVE_RATE_LIMIT = float(os.environ.get('MOVE_RATE_LIMIT', 10))
+MOVE_RATE_BURST = float(os.environ.get('MOVE_RATE_BURST', 20))
+WS_MAX_PENDING_ACCEPTS = int(os.environ.get('WS_MAX_PENDING_ACCEPTS', 32))
+WS_MAX_QUEUED_ACCEPTS = int(os.environ.get('WS_MAX_QUEUED_ACCEPTS', 128))
+WS_CONNECT_RATE_LIMIT = float(os.environ.get('WS_CONNECT_RATE_LIMIT', 2))
+WS_CONNECT_RATE_BURST = float(os.environ.get('WS_CONNECT_RATE_BURST', 10))
+# seconds a request waits for a slot before it is rejected, and the Retry-After sent when a limit is full
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.5))
+ADMISSION_RETRY_AFTER = float(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+# boards with more cells only store their tiles and are sent as tile lists, see services.game.engine.SparseBoard
+# packed boards start with their format, games stored with another value are read back with the board they were packed from
+SPARSE_BOARD_CELLS = int(os.environ.get('SPARSE_BOARD_CELLS', 4096))
+# cells a websocket can subscribe to with a viewport
+VIEWPORT_MAX_CELLS = int(os.environ.get('VIEWPORT_MAX_CELLS', 250_000))
+# players kept in the in-memory leaderboard and seconds between reloads from player_stats
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 100))
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 30))
+# seconds before the state kept for a game without activity, or finished, is dropped once it has no websockets
+GAME_IDLE_SECONDS = float(os.environ.get('GAME_IDLE_SECONDS', 3600))
+GAME_FINISHED_SECONDS = float(os.environ.get('GAME_FINISHED_SECONDS', 60))
+# seconds a player has to move before losing the game, 0 disables the turn clocks
+TURN_TIMEOUT_SECONDS = float(os.environ.get('TURN_TIMEOUT_SECONDS', 0))
+# tick of the timer wheel behind the idle timers and turn clocks, see services.game.lifecycle
+TIMER_RESOLUTION = float(os.environ.get('TIMER_RESOLUTION', 0.1))
+# exports read from EXPORT_DB_HOST, point it to a replica to keep their scans off the primary
+EXPORT_DB_HOST = os.environ.get('EXPORT_DB_HOST', DB_HOST)
+EXPORT_DB_POOL_SIZE = int(os.environ.get('EXPORT_DB_POOL_SIZE', 2))
+# games read per transaction and exports streamed at once by a worker, see services.game.export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+EXPORT_MAX_IN_FLIGHT = int(os.environ.get('EXPORT_MAX_IN_FLIGHT', 2))
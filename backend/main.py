@@ -1,14 +1,24 @@
 import json
+import logging
+from contextlib import asynccontextmanager
 from typing import List
 
 from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-
-from db.engine import SessionLocal
-from services.game.exceptions import MoveIntegrityException
-from services.game.schemas import GameTile, Game, PlayerMove, WSEvent
-from services.game.service import create_game, get_current_game_status, get_free_games, get_game, play_move, register_for_game, manager, map_move, turn_game_into_ai
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.background import BackgroundTask
+
+from db.engine import ExportSessionLocal, SessionLocal
+from db.query_stats import QueryStats, track_queries
+from env import EXPORT_BATCH_SIZE, LEADERBOARD_SIZE, LOBBY_PAGE_SIZE, QUERY_STATS
+from services.game.exceptions import AdmissionRejected, GameNotFound, MoveIntegrityException, StaleGameException
+from services.game.metrics import registry
+from services.game.schemas import GameTile, Game, PlayerMove, Viewport, WSEvent
+from services.game.export import ExportFilter, ExportFormatEnum, ExportLayoutEnum, export_batches, format_records
+from services.game.protocol import EncodingEnum, ProtocolEnum
+from services.game.cache import Snapshot
+from services.game.service import game_move_event, create_game, get_free_games, get_leaderboard, get_player_stats, get_snapshot, play_move, register_for_game, manager, map_move, storage, turn_game_into_ai
 from fastapi import (
     Depends,
     FastAPI,
@@ -21,6 +31,7 @@ from fastapi.middleware.cors import CORSMiddleware
 
 
 app = FastAPI()
+logger = logging.getLogger("uvicorn.error")
 
 
 origins = [
@@ -36,12 +47,25 @@ app.add_middleware(
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+if(QUERY_STATS):
+    @app.middleware("http")
+    async def track_request_queries(request: Request, call_next):
+        with track_queries() as stats:
+            response = await call_next(request)
+        if(QUERY_STATS == "header"):
+            response.headers["X-DB-Queries"] = stats.summary()
+        else:
+            log_queries(f"{request.method} {request.url.path}", stats)
+        return response
+
+
+def log_queries(label: str, stats: QueryStats):
+    logger.info("%s %s", label, stats.summary())
+
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 class ConnectionManager:
@@ -79,6 +103,16 @@ async def get_token_http(
     return token
 
 
+@app.on_event("startup")
+async def startup():
+    await manager.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await manager.stop()
+
+
 @app.exception_handler(MoveIntegrityException)
 async def unicorn_exception_handler(request: Request, exc: MoveIntegrityException):
     return JSONResponse(
@@ -87,31 +121,93 @@ async def unicorn_exception_handler(request: Request, exc: MoveIntegrityExceptio
     )
 
 
+@app.exception_handler(GameNotFound)
+async def game_not_found_exception_handler(request: Request, exc: GameNotFound):
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={"message": exc.message, "details": {"game_id": exc.game_id}},
+    )
+
+
+@app.exception_handler(StaleGameException)
+async def stale_game_exception_handler(request: Request, exc: StaleGameException):
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"message": exc.message, "details": {"game_id": exc.game_id}},
+    )
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_exception_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"message": exc.message},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+# admit_move holds one of the move slots of services.game.admission until the response is sent
+async def admit_move(token: str = Depends(get_token_http)):
+    async with manager.admission.admit_move(token):
+        yield
+
+
+# admit_websocket holds an accept slot until the websocket got its first frame, rejected websockets
+# are closed before the handshake completes with 1013 (try again later), the reason carries Retry-After
+@asynccontextmanager
+async def admit_websocket(token: str):
+    try:
+        async with manager.admission.admit_connect(token):
+            yield
+    except AdmissionRejected as e:
+        raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason=f"Retry-After: {e.retry_after}")
+
+
 @app.post("/games")
-async def post_game(game: Game, db: Session = Depends(get_db), token: str = Depends(get_token_http)):
+async def post_game(game: Game, db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http)):
     game.host = token
-    res = create_game(db, game)
-    await manager.register_game(res.game_id, token)
+    res = await create_game(db, game)
+    await manager.register_game(res)
     return res
 
 
 @app.get("/games")
-async def get_games(db: Session = Depends(get_db), token: str = Depends(get_token_http)):
-    return get_free_games(db,token)
+async def get_games(response: Response, after: int = 0, limit: int = Query(default=LOBBY_PAGE_SIZE, gt=0, le=500),
+                    db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http)):
+    games = await get_free_games(db, token, after, limit)
+    if(len(games) == limit):
+        response.headers["X-Next-After"] = str(games[-1].game_id)
+    return games
 
 
 @app.get("/games/{game_id}")
-async def get_game_handler(game_id: int, db: Session = Depends(get_db), token: str = Depends(get_token_http)):
-    return get_game(db, game_id)
+async def get_game_handler(game_id: int, request: Request, db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http)):
+    return snapshot_response(request, await get_snapshot(db, game_id, "info"))
+
+
+# the board, winner and turn of the game, the same bytes as the first frame of a websocket with `protocol`
+@app.get("/games/{game_id}/snapshot")
+async def get_game_snapshot_handler(game_id: int, request: Request, protocol: ProtocolEnum = ProtocolEnum.full,
+                                    db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http)):
+    return snapshot_response(request, await get_snapshot(db, game_id, protocol.value))
+
+
+# snapshot_response answers 304 without a body when If-None-Match has the ETag of the snapshot
+def snapshot_response(request: Request, snapshot: Snapshot) -> Response:
+    headers = {"ETag": snapshot.etag}
+    tags = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if(snapshot.etag in tags or "*" in tags):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(snapshot.body, media_type="application/json", headers=headers)
 
 @app.post("/games/{game_id}/ai")
-async def post_turn_game_ai(game_id: int, db: Session = Depends(get_db), token: str = Depends(get_token_http)):
+async def post_turn_game_ai(game_id: int, db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http)):
     return await turn_game_into_ai(db,game_id,token)  
 
 
 @app.post("/games/{game_id}/membership")
-async def join_game(game_id: int, db: Session = Depends(get_db), token: str = Depends(get_token_http)):
-    row = register_for_game(db, game_id, token)
+async def join_game(game_id: int, db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http)):
+    row = await register_for_game(db, game_id, token)
     if(row is None):
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -124,43 +220,183 @@ async def join_game(game_id: int, db: Session = Depends(get_db), token: str = De
 
 
 @app.post("/games/{game_id}/moves")
-async def move_game(move: PlayerMove, game_id: int, db: Session = Depends(get_db), token: str = Depends(get_token_http)):
-    if(not manager.can_move(token, game_id)):
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content={"message": f"Is not {token}'s turn"},
-        )
-    res = play_move(db, move, game_id, token)
-    if(res is None):
-        return None
-    turn = await manager.set_turn(game_id)
-    new_res = await manager.move_ai(db,game_id)
-    if(new_res is not None):
-      player_wins = res["winner"]
-      res = new_res
-      res["winner"]=player_wins
-    else:
-      res["turn"] = turn
-    event = WSEvent(type="game", payload=res)
-    await manager.broadcast_game_update(event.dict(), game_id)
+async def move_game(move: PlayerMove, game_id: int, db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http),
+                    admitted: None = Depends(admit_move)):
+    async with manager.game_lock(game_id):
+        claimed = await manager.claim_turn(token, game_id)
+        if(claimed is None):
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"message": f"Is not {token}'s turn"},
+            )
+        turn, seq = claimed
+        # the bot's turn is computed by the scheduler and delivered over the websocket
+        ai_turn = await manager.is_agent(turn, game_id)
+        if(ai_turn and not manager.scheduler.reserve()):
+            await manager.release_turn(token, game_id)
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"message": "AI opponents are busy, try again later"},
+            )
+        try:
+            res = await play_move(db, move, game_id, token, seq)
+        except Exception as e:
+            await manager.release_turn(token, game_id)
+            if(ai_turn):
+                manager.scheduler.release()
+            raise e
+    res["turn"] = turn
+    if(ai_turn):
+        if(res["winner"] is None):
+            manager.scheduler.submit(game_id)
+        else:
+            manager.scheduler.release()
+    await manager.broadcast_game_update(game_move_event(res), game_id)
     return res
 
 
 @app.get("/games/{game_id}/valid-moves")
-def get_valid_moves_handler(game_id: int, move: PlayerMove, db: Session = Depends(get_db)):
-    return map_move(db, game_id, move)
+async def get_valid_moves_handler(game_id: int, move: PlayerMove, db: AsyncSession = Depends(get_db)):
+    return await map_move(db, game_id, move)
+
+
+# the aggregates of the player identified by `token`, the same value the other endpoints take as ?token=
+@app.get("/players/{token}/stats")
+async def get_player_stats_handler(token: str, db: AsyncSession = Depends(get_db)):
+    return await get_player_stats(db, token)
+
+
+@app.get("/leaderboard")
+async def get_leaderboard_handler(limit: int = Query(default=10, gt=0, le=LEADERBOARD_SIZE),
+                                  db: AsyncSession = Depends(get_db), token: str = Depends(get_token_http)):
+    return await get_leaderboard(db, limit)
+
+
+# streams the games of game and game_archive in game_id order, one per line, with constant memory
+# a cut export is resumed by calling it again with `after` set to the game_id of the last complete line
+@app.get("/exports/games")
+async def export_games_handler(format: ExportFormatEnum = ExportFormatEnum.jsonl, layout: ExportLayoutEnum = ExportLayoutEnum.tiles,
+                               after: int = 0, until: int | None = None, winner: str | None = None, player: str | None = None,
+                               token: str = Depends(get_token_http)):
+    release = await manager.admission.acquire_export()
+    filters = ExportFilter(after, until, winner, player)
+
+    async def stream():
+        try:
+            header = format == ExportFormatEnum.csv
+            async for records in export_batches(ExportSessionLocal, storage, filters, layout, EXPORT_BATCH_SIZE):
+                yield format_records(records, format, header)
+                header = False
+            if(header):
+                yield format_records([], format, header)
+        finally:
+            release()
+
+    media_type = "text/csv" if format == ExportFormatEnum.csv else "application/x-ndjson"
+    # a client gone before the first chunk leaves the generator unstarted and its finally never runs,
+    # the background task releases the slot once the response is over either way
+    return StreamingResponse(stream(), media_type=media_type, background=BackgroundTask(release))
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # prometheus text format, every uvicorn worker exposes its own values
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.websocket("/ws/lobby")
+async def lobby_websocket_endpoint(websocket: WebSocket, token: str = Depends(get_token_ws)):
+    async with admit_websocket(token):
+        if(not await manager.connect_lobby(websocket)):
+            raise WebSocketException(code=status.WS_1006_ABNORMAL_CLOSURE)
+    try:
+        # the first page of open games, lobby_add and lobby_remove events follow
+        games = [game.dict() for game in manager.lobby.page(0, LOBBY_PAGE_SIZE)]
+        await websocket.send_text(json.dumps({"type": "lobby", "payload": {"games": games}}))
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        manager.disconnect_lobby(websocket)
 
 
 @app.websocket("/ws/{game_id}")
-async def websocket_endpoint(websocket: WebSocket, game_id: int, token: str = Depends(get_token_ws), db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, game_id: int, token: str = Depends(get_token_ws),
+                             protocol: ProtocolEnum = ProtocolEnum.full, encoding: EncodingEnum = EncodingEnum.json,
+                             spectate: bool = False):
+    if(spectate):
+        await spectator_websocket(websocket, game_id, token, protocol, encoding)
+        return
     try:
-        connected = await manager.connect(token, game_id, websocket)
+        async with admit_websocket(token):
+            connected = await manager.connect(token, game_id, websocket, protocol, encoding)
+            if (connected):
+                await websocket.send_text((await get_game_snapshot(game_id, protocol)).body)
         if (connected):
-            current_state = await get_current_game_status(db, game_id)
-            event = WSEvent(type="game", payload=current_state)
-            await websocket.send_text(json.dumps(event.dict()))
-            await websocket.receive_text()
+            # delta clients send {"type": "resync"} when they detect a gap in the sequence numbers
+            # and {"type": "viewport"} to only get the tiles of a part of the board
+            while True:
+                try:
+                    message = json.loads(await websocket.receive_text())
+                except ValueError:
+                    continue
+                if(not isinstance(message, dict)):
+                    continue
+                if(message.get("type") == "resync"):
+                    listener = manager.find_listener(game_id, websocket)
+                    if(listener is not None and listener.viewport is not None):
+                        _, frame = await manager.viewport_snapshot(game_id, listener.viewport)
+                    else:
+                        frame = (await get_game_snapshot(game_id, ProtocolEnum.delta)).body
+                    await websocket.send_text(frame)
+                elif(message.get("type") == "viewport"):
+                    viewport = parse_viewport(message)
+                    if(viewport is not None and manager.set_viewport(game_id, websocket, viewport)):
+                        _, frame = await manager.viewport_snapshot(game_id, viewport)
+                        await websocket.send_text(frame)
         else:
             raise WebSocketException(code=status.WS_1006_ABNORMAL_CLOSURE)
     except WebSocketDisconnect:
         await manager.disconnect(token, game_id, websocket)
+
+
+# spectators get their frames from a queue filled by the broadcasts, see services.game.spectator
+async def spectator_websocket(websocket: WebSocket, game_id: int, token: str, protocol: ProtocolEnum, encoding: EncodingEnum):
+    async with admit_websocket(token):
+        spectator = await manager.connect_spectator(token, game_id, websocket, protocol, encoding)
+    if(spectator is None):
+        raise WebSocketException(code=status.WS_1006_ABNORMAL_CLOSURE)
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                continue
+            if(not isinstance(message, dict)):
+                continue
+            if(message.get("type") == "resync"):
+                spectator.resync()
+            elif(message.get("type") == "viewport"):
+                viewport = parse_viewport(message)
+                if(viewport is not None and manager.set_viewport(game_id, websocket, viewport)):
+                    # the spectator restarts from the tiles of its viewport, sent in order with its queued frames
+                    spectator.resync()
+    except WebSocketDisconnect:
+        await manager.disconnect(token, game_id, websocket)
+
+
+# parse_viewport reads {"type": "viewport", "payload": {"x", "y", "width", "height"}}, invalid viewports are ignored
+def parse_viewport(message: dict) -> Viewport | None:
+    try:
+        return Viewport.parse_obj(message.get("payload"))
+    except ValidationError:
+        return None
+
+
+async def get_game_snapshot(game_id: int, protocol: ProtocolEnum) -> Snapshot:
+    # the session is scoped to the read so an open socket does not pin a pooled connection
+    with track_queries() as stats:
+        async with SessionLocal() as db:
+            snapshot = await get_snapshot(db, game_id, protocol.value)
+    if(QUERY_STATS):
+        log_queries(f"WS snapshot {game_id}", stats)
+    return snapshot
@@ -0,0 +1,38 @@
+"""
+Moves the games finished more than --older-than-days ago from game, game_tile and game_move into the
+monthly partitions of game_archive, one row per game with its final board packed.
+Archived games are still served by the API, read only.
+
+Run from the backend folder after scripts/migrations/003_game_archive.sql, for example from a daily cron:
+    python -m scripts.archive_games [--older-than-days 30] [--batch-size 500]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from db.engine import SessionLocal, engine
+from env import BOARD_SNAPSHOT_INTERVAL, BOARD_STORAGE
+from services.game.archive import archive_games
+from services.game.storage import create_storage
+
+
+async def archive(older_than_days: float, batch_size: int):
+    storage = create_storage(BOARD_STORAGE, BOARD_SNAPSHOT_INTERVAL)
+    before = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    archived = 0
+    while True:
+        async with SessionLocal() as db:
+            count = await archive_games(db, storage, before, batch_size)
+        if(count == 0):
+            break
+        archived += count
+        print(f"archived {archived} games")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move finished games into game_archive")
+    parser.add_argument("--older-than-days", type=float, default=30)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(archive(args.older_than_days, args.batch_size))
@@ -0,0 +1,126 @@
+"""
+Checks the stored winner of every game of game and game_archive against its board.
+Games are read in game_id order by short read-only transactions of --batch-size games, from EXPORT_DB_HOST
+when it points to a replica, their boards are stacked into NumPy arrays and the lines of line_target cells
+are found by vectorized scans of the four directions, see services.game.audit.
+
+Run from the backend folder:
+    python -m scripts.audit_winners [--after 0] [--until N] [--batch-size 2000] [--output mismatches.jsonl] [--compare]
+
+Games with a verdict other than ok and forfeit are written to --output as json lines, stdout by default,
+the summary is printed to stderr. --compare also looks for the lines with utils.check_grid from every
+occupied cell, reports the games where both disagree and times both.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+from db.engine import ExportSessionLocal, engine, export_engine
+from env import BOARD_SNAPSHOT_INTERVAL, BOARD_STORAGE
+from services.game.audit import VERDICTS, AuditGame, VerdictEnum, audit_games, verdicts, winner_code
+from services.game.export import ExportFilter, select_games
+from services.game.storage import create_storage
+from services.game.utils import check_grid
+
+
+async def read_games(storage, filters: ExportFilter, after: int, batch_size: int) -> list[AuditGame]:
+    async with ExportSessionLocal() as db:
+        await db.connection(execution_options={"isolation_level": "REPEATABLE READ", "postgresql_readonly": True})
+        selected = await select_games(db, filters, after, batch_size)
+        live = [game for _, game, archived in selected if not archived]
+        boards = await storage.load_boards(db, live) if len(live) > 0 else {}
+        games = [AuditGame(game, game.moves, packed=game.board) if archived else AuditGame(game, boards[game_id].moves, board=boards[game_id])
+                 for game_id, game, archived in selected]
+        await db.rollback()
+    return games
+
+
+# grid_lines finds whether the host and the enemy have a line with check_grid, started from each of their cells
+def grid_lines(game: AuditGame) -> tuple[list[bool], float]:
+    codes = game.codes().reshape(game.height, game.width)
+    # check_grid compares cell values, the codes are written as strings like the player names it reads
+    grid = [[None if code == 0 else str(code) for code in row] for row in codes.tolist()]
+    cells = [(int(x), int(y), int(codes[x, y])) for x, y in zip(*np.nonzero(codes))]
+    start = time.perf_counter()
+    lines = [False, False]
+    for x, y, value in cells:
+        if(not lines[value - 1] and check_grid(grid, game.line_target, str(value), x, y)[0]):
+            lines[value - 1] = True
+    return lines, time.perf_counter() - start
+
+
+async def audit(args):
+    storage = create_storage(BOARD_STORAGE, BOARD_SNAPSHOT_INTERVAL)
+    filters = ExportFilter(args.after, args.until)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    counts = {verdict.value: 0 for verdict in VerdictEnum}
+    load_time = scan_time = grid_time = 0.0
+    cells = disagreements = 0
+    after = args.after
+    start = time.perf_counter()
+    try:
+        while True:
+            loading = time.perf_counter()
+            games = await read_games(storage, filters, after, args.batch_size)
+            scanning = time.perf_counter()
+            results = audit_games(games, args.max_cells)
+            scan_time += time.perf_counter() - scanning
+            load_time += scanning - loading
+
+            for game, verdict in results:
+                counts[verdict.value] += 1
+                cells += game.width * game.height
+                if(verdict not in (VerdictEnum.ok, VerdictEnum.forfeit)):
+                    out.write(json.dumps({"game_id": game.game_id, "host": game.host, "enemy": game.enemy,
+                                          "winner": game.winner, "moves": game.moves, "verdict": verdict.value}) + "\n")
+                if(args.compare):
+                    lines, seconds = grid_lines(game)
+                    grid_time += seconds
+                    grid_verdict = VERDICTS[verdicts(np.array([lines]), np.array([winner_code(game)]), np.array([game.moves]))[0]]
+                    if(grid_verdict != verdict):
+                        disagreements += 1
+                        print(f"check_grid disagrees on game {game.game_id}: {grid_verdict.value} instead of {verdict.value}", file=sys.stderr)
+            out.flush()
+
+            if(len(games) < args.batch_size):
+                break
+            after = games[-1].game_id
+            print(f"audited {sum(counts.values())} games, last game_id {after}", file=sys.stderr)
+    finally:
+        if(out is not sys.stdout):
+            out.close()
+        await export_engine.dispose()
+        await engine.dispose()
+
+    games_count = sum(counts.values())
+    summary = {
+        "games": games_count,
+        "duration": time.perf_counter() - start,
+        "verdicts": counts,
+        "load_seconds": load_time,
+        "scan_seconds": scan_time,
+        "scan_games_per_second": games_count / scan_time if scan_time else None,
+        "scan_cells_per_second": cells / scan_time if scan_time else None,
+    }
+    if(args.compare):
+        summary["check_grid_seconds"] = grid_time
+        summary["check_grid_games_per_second"] = games_count / grid_time if grid_time else None
+        summary["check_grid_disagreements"] = disagreements
+    summary["config"] = vars(args)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the stored winners against the boards")
+    parser.add_argument("--after", type=int, default=0, help="audit the games with a greater game_id")
+    parser.add_argument("--until", type=int, default=None, help="last game_id to audit")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--max-cells", type=int, default=1 << 24, help="cells scanned at once")
+    parser.add_argument("--output", default="-", help="file for the mismatches, - for stdout")
+    parser.add_argument("--compare", action="store_true", help="also find the lines with utils.check_grid and time it")
+    args = parser.parse_args()
+    asyncio.run(audit(args))
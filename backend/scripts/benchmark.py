@@ -0,0 +1,273 @@
+"""
+Load test for the game API. Plays concurrent games over HTTP and websockets and measures
+move commit latency, websocket delivery latency and, for games against the AI, the time it takes
+the bot to answer a move.
+
+Run from the backend folder with the database of env.py initialized:
+    python -m scripts.benchmark [--games 50] [--mode pvp|ai] [--output bench.json] [--baseline old.json]
+
+uvicorn main:app is started on --port unless --url points to a running server, without the per-token
+rate limits unless MOVE_RATE_LIMIT or WS_CONNECT_RATE_LIMIT are set. The results are written as json, --baseline prints the change of every latency against the results of an older run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+import websockets.client
+
+from services.game.engine import Board
+from services.game.schemas import PlayDirectionEnum
+
+
+class Recorder():
+    """Latency samples in seconds, by metric"""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {"move_commit": [], "ws_delivery": [], "ai_reply": []}
+        self.errors: dict[str, int] = {}
+        self.games = 0
+        self.moves = 0
+
+    def add(self, metric: str, value: float):
+        self.samples[metric].append(value)
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, duration: float):
+        return {
+            "duration": duration,
+            "games": self.games,
+            "moves": self.moves,
+            "moves_per_second": self.moves / duration if duration else 0.0,
+            "errors": self.errors,
+            "latency": {metric: summarize(values) for metric, values in self.samples.items()},
+        }
+
+
+# summarize reports latencies in milliseconds, percentiles use the nearest rank
+def summarize(values: list[float]):
+    if(len(values) == 0):
+        return {"count": 0}
+    values = sorted(values)
+
+    def percentile(p: float):
+        return values[min(len(values) - 1, max(0, int(p / 100 * len(values) + 0.5) - 1))] * 1000
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) * 1000,
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": values[-1] * 1000,
+    }
+
+
+# read_events timestamps every move event on arrival, so delivery is not measured after the http response
+async def read_events(ws, queue: asyncio.Queue | None, sent: dict[int, float], recorder: Recorder):
+    async for frame in ws:
+        received = time.perf_counter()
+        event = json.loads(frame)
+        if(event.get("type") != "move"):
+            continue
+        seq = event["payload"]["seq"]
+        if(seq in sent):
+            recorder.add("ws_delivery", received - sent[seq])
+        if(queue is not None):
+            queue.put_nowait((received, event["payload"]))
+
+
+async def next_move(queue: asyncio.Queue, seq: int, timeout: float):
+    while True:
+        received, payload = await asyncio.wait_for(queue.get(), timeout)
+        if(payload["seq"] == seq):
+            return received, payload
+
+
+async def play_game(client: httpx.AsyncClient, ws_url: str, run_id: str, index: int, args, recorder: Recorder):
+    rng = random.Random(index)
+    host = f"bench-{run_id}-{index}-host"
+    res = await client.post("/games", params={"token": host},
+                            json={"width": args.width, "height": args.height, "line_target": args.line_target})
+    if(res.status_code != 200):
+        recorder.error(f"create_{res.status_code}")
+        return
+    game_id = res.json()["game_id"]
+
+    players = [host]
+    if(args.mode == "ai"):
+        res = await client.post(f"/games/{game_id}/ai", params={"token": host})
+    else:
+        players.append(f"bench-{run_id}-{index}-guest")
+        res = await client.post(f"/games/{game_id}/membership", params={"token": players[1]})
+    if(res.status_code != 200):
+        recorder.error(f"join_{res.status_code}")
+        return
+
+    board = Board(args.width, args.height, args.line_target)
+    sent: dict[int, float] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    sockets = [await websockets.client.connect(f"{ws_url}/ws/{game_id}?token={player}&protocol=delta") for player in players]
+    # the first frame of every socket is the snapshot of the empty board
+    for ws in sockets:
+        await ws.recv()
+    readers = [asyncio.create_task(read_events(ws, queue if i == 0 else None, sent, recorder))
+               for i, ws in enumerate(sockets)]
+
+    try:
+        turn = host
+        while(board.winner is None and board.moves < len(board.cells) and board.moves < args.moves):
+            move = rng.choice(board.valid_moves())
+            seq = board.moves + 1
+            start = time.perf_counter()
+            sent[seq] = start
+            res = await client.post(f"/games/{game_id}/moves", params={"token": turn},
+                                    json={"row": move.row, "direction": move.direction.value})
+            if(res.status_code != 200):
+                recorder.error(f"move_{res.status_code}")
+                return
+            recorder.add("move_commit", time.perf_counter() - start)
+            recorder.moves += 1
+
+            _, payload = await next_move(queue, seq, args.timeout)
+            apply_move(board, payload)
+            turn = payload["turn"]
+            if(args.mode == "ai" and board.winner is None and board.moves < len(board.cells)):
+                received, payload = await next_move(queue, seq + 1, args.timeout)
+                recorder.add("ai_reply", received - start)
+                apply_move(board, payload)
+                turn = payload["turn"]
+            elif(args.mode == "pvp"):
+                turn = players[board.moves % 2]
+        recorder.games += 1
+    except asyncio.TimeoutError:
+        recorder.error("ws_timeout")
+    finally:
+        for reader in readers:
+            reader.cancel()
+        for ws in sockets:
+            await ws.close()
+
+
+def apply_move(board: Board, payload: dict):
+    board.place(payload["row"], PlayDirectionEnum(payload["direction"]), payload["value"])
+    board.winner = payload["winner"]
+
+
+async def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    recorder = Recorder()
+    ws_url = args.url.replace("http", "ws", 1)
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(client: httpx.AsyncClient, index: int):
+        async with semaphore:
+            await play_game(client, ws_url, run_id, index, args, recorder)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(client, i) for i in range(args.games)))
+        duration = time.perf_counter() - start
+    return recorder.summary(duration)
+
+
+def start_server(args):
+    # bench players move as soon as they get an answer, far faster than the per-token limits allow
+    env = {"MOVE_RATE_LIMIT": "0", "WS_CONNECT_RATE_LIMIT": "0", **os.environ}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+                               "--workers", str(args.workers), "--log-level", "warning"], env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if(httpx.get(f"{args.url}/games", params={"token": "bench"}).status_code == 200):
+                return server
+        except httpx.TransportError:
+            pass
+        if(server.poll() is not None):
+            break
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn did not start")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# compare prints the change of every latency and of the throughput against an older result file
+def compare(results: dict, baseline: dict):
+    old = baseline["results"]["moves_per_second"]
+    new = results["results"]["moves_per_second"]
+    print(f"moves_per_second {old:.1f} -> {new:.1f} ({change(old, new)})")
+    for metric, summary in results["results"]["latency"].items():
+        old_summary = baseline["results"]["latency"].get(metric, {})
+        for key in ("p50", "p95", "p99"):
+            if(key in summary and key in old_summary):
+                print(f"{metric}.{key} {old_summary[key]:.2f}ms -> {summary[key]:.2f}ms "
+                      f"({change(old_summary[key], summary[key])})")
+
+
+def change(old: float, new: float):
+    if(old == 0):
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark game creation, moves and websocket delivery")
+    parser.add_argument("--url", help="server to benchmark, uvicorn main:app is started when missing")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the started server")
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50, help="games played at the same time")
+    parser.add_argument("--mode", choices=("pvp", "ai"), default="pvp")
+    parser.add_argument("--moves", type=int, default=30, help="maximum moves of a game")
+    parser.add_argument("--width", type=int, default=7)
+    parser.add_argument("--height", type=int, default=7)
+    parser.add_argument("--line-target", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="results of an older run to compare with")
+    args = parser.parse_args()
+
+    server = None
+    if(args.url is None):
+        args.url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args)
+    try:
+        summary = asyncio.run(run(args))
+    finally:
+        if(server is not None):
+            server.terminate()
+            server.wait()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "env": {key: os.environ[key] for key in ("GAME_BACKEND", "BOARD_STORAGE", "DB_POOL_SIZE") if key in os.environ},
+        "results": summary,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(summary, indent=2))
+
+    if(args.baseline):
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 DROP TABLE IF EXISTS GAME CASCADE;
 DROP TABLE IF EXISTS GAME_TILE CASCADE;
+DROP TABLE IF EXISTS GAME_MOVE CASCADE;
+DROP TABLE IF EXISTS GAME_SESSION CASCADE;
+DROP TABLE IF EXISTS GAME_EVENT CASCADE;
+DROP TABLE IF EXISTS GAME_ARCHIVE CASCADE;
+DROP TABLE IF EXISTS PLAYER_STATS CASCADE;
 
 CREATE TABLE IF NOT EXISTS GAME(
     GAME_ID SERIAL,
@@ -13,6 +18,10 @@ CREATE TABLE IF NOT EXISTS GAME(
     HOST TEXT NOT NULL,
     ENEMY TEXT,
     WINNER TEXT,
+    SNAPSHOT BYTEA,
+    SNAPSHOT_SEQ INT DEFAULT 0 NOT NULL,
+    FINISHED_AT TIMESTAMPTZ,
+    ENEMY_BOT BOOLEAN DEFAULT FALSE NOT NULL,
 	UNIQUE(GAME_ID,WIDTH,HEIGHT),
 	PRIMARY KEY(GAME_ID)
 );
@@ -24,12 +33,194 @@ CREATE TABLE IF NOT EXISTS GAME_TILE(
     X INT NOT NULL,
     Y INT NOT NULL,
 	VALUE TEXT NOT NULL,
+    -- X is the row and Y the column of the tile
     CONSTRAINT GAME_SIZE CHECK(
-        X < GAME_WIDTH AND
+        X < GAME_HEIGHT AND
         X >= 0
-        AND Y < GAME_HEIGHT
+        AND Y < GAME_WIDTH
         AND Y >= 0
     ),
 	FOREIGN KEY (GAME_ID, GAME_WIDTH,GAME_HEIGHT) REFERENCES GAME (GAME_ID, WIDTH,HEIGHT),
 	PRIMARY KEY (GAME_ID,X,Y)
-);
\ No newline at end of file
+);
+
+-- finished_at is set once when the game gets a winner, finished games are archived by scripts/archive_games.py
+CREATE OR REPLACE FUNCTION SET_GAME_FINISHED_AT() RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.WINNER IS NOT NULL AND OLD.WINNER IS NULL THEN
+    NEW.FINISHED_AT := now();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER GAME_FINISHED_AT BEFORE UPDATE OF WINNER ON GAME
+    FOR EACH ROW EXECUTE FUNCTION SET_GAME_FINISHED_AT();
+
+CREATE INDEX IF NOT EXISTS GAME_FINISHED_IDX ON GAME (FINISHED_AT) WHERE FINISHED_AT IS NOT NULL;
+
+-- one row per archived game with its final board packed, partitioned by month of FINISHED_AT
+-- partitions are created by services.game.archive as games are archived
+CREATE TABLE IF NOT EXISTS GAME_ARCHIVE(
+    GAME_ID INT NOT NULL,
+    FINISHED_AT TIMESTAMPTZ NOT NULL,
+    WIDTH INT NOT NULL,
+    HEIGHT INT NOT NULL,
+    LINE_TARGET INT NOT NULL,
+    HOST TEXT NOT NULL,
+    ENEMY TEXT,
+    WINNER TEXT,
+    MOVES INT NOT NULL,
+    BOARD BYTEA NOT NULL,
+	PRIMARY KEY (GAME_ID,FINISHED_AT)
+) PARTITION BY RANGE (FINISHED_AT);
+
+-- per player aggregates kept by the GAME_PLAYER_STATS trigger, see services.game.service.get_player_stats
+-- a game counts once both seats are taken, bots get no row
+CREATE TABLE IF NOT EXISTS PLAYER_STATS(
+    PLAYER TEXT NOT NULL,
+    GAMES INT DEFAULT 0 NOT NULL,
+    WINS INT DEFAULT 0 NOT NULL,
+    LOSSES INT DEFAULT 0 NOT NULL,
+    IN_PROGRESS INT DEFAULT 0 NOT NULL,
+    BOT_GAMES INT DEFAULT 0 NOT NULL,
+	PRIMARY KEY (PLAYER)
+);
+
+CREATE INDEX IF NOT EXISTS PLAYER_STATS_WINS_IDX ON PLAYER_STATS (WINS DESC, PLAYER);
+
+CREATE OR REPLACE FUNCTION UPDATE_PLAYER_STATS() RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.ENEMY IS NOT NULL AND OLD.ENEMY IS NULL THEN
+    INSERT INTO PLAYER_STATS (PLAYER, GAMES, IN_PROGRESS, BOT_GAMES)
+    VALUES (NEW.HOST, 1, 1, CASE WHEN NEW.ENEMY_BOT THEN 1 ELSE 0 END)
+    ON CONFLICT (PLAYER) DO UPDATE SET GAMES = PLAYER_STATS.GAMES + 1, IN_PROGRESS = PLAYER_STATS.IN_PROGRESS + 1,
+      BOT_GAMES = PLAYER_STATS.BOT_GAMES + EXCLUDED.BOT_GAMES;
+    IF NOT NEW.ENEMY_BOT THEN
+      INSERT INTO PLAYER_STATS (PLAYER, GAMES, IN_PROGRESS) VALUES (NEW.ENEMY, 1, 1)
+      ON CONFLICT (PLAYER) DO UPDATE SET GAMES = PLAYER_STATS.GAMES + 1, IN_PROGRESS = PLAYER_STATS.IN_PROGRESS + 1;
+    END IF;
+  END IF;
+  IF NEW.WINNER IS NOT NULL AND OLD.WINNER IS NULL THEN
+    UPDATE PLAYER_STATS SET WINS = WINS + 1, IN_PROGRESS = IN_PROGRESS - 1 WHERE PLAYER = NEW.WINNER;
+    UPDATE PLAYER_STATS SET LOSSES = LOSSES + 1, IN_PROGRESS = IN_PROGRESS - 1
+    WHERE PLAYER = CASE WHEN NEW.WINNER = NEW.HOST THEN NEW.ENEMY ELSE NEW.HOST END;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER GAME_PLAYER_STATS AFTER UPDATE OF ENEMY, WINNER ON GAME
+    FOR EACH ROW EXECUTE FUNCTION UPDATE_PLAYER_STATS();
+
+-- lobby queries, see services.game.service.get_free_games
+CREATE INDEX IF NOT EXISTS GAME_OPEN_IDX ON GAME (GAME_ID) WHERE ENEMY IS NULL;
+CREATE INDEX IF NOT EXISTS GAME_HOST_IDX ON GAME (HOST, GAME_ID);
+CREATE INDEX IF NOT EXISTS GAME_ENEMY_IDX ON GAME (ENEMY, GAME_ID) WHERE ENEMY IS NOT NULL;
+
+-- append-only move log used when BOARD_STORAGE=moves
+CREATE TABLE IF NOT EXISTS GAME_MOVE(
+    GAME_ID INT NOT NULL REFERENCES GAME (GAME_ID),
+    SEQ INT NOT NULL,
+    PLAYER TEXT NOT NULL,
+    ROW INT NOT NULL,
+    DIRECTION TEXT NOT NULL CHECK(DIRECTION IN ('left', 'right')),
+	PRIMARY KEY (GAME_ID,SEQ)
+);
+
+-- turns and agents shared between workers by services.game.backend.PostgresGameBackend
+CREATE TABLE IF NOT EXISTS GAME_SESSION(
+    GAME_ID INT NOT NULL REFERENCES GAME (GAME_ID),
+    HOST TEXT NOT NULL,
+    ENEMY TEXT,
+    TURN TEXT NOT NULL,
+    AGENT TEXT,
+    MOVES INT DEFAULT 0 NOT NULL,
+	PRIMARY KEY (GAME_ID)
+);
+
+-- events too big for a NOTIFY payload, kept for a minute
+CREATE UNLOGGED TABLE IF NOT EXISTS GAME_EVENT(
+    EVENT_ID BIGSERIAL,
+    GAME_ID INT NOT NULL,
+    MESSAGE JSONB NOT NULL,
+    CREATED_AT TIMESTAMPTZ DEFAULT now() NOT NULL,
+	PRIMARY KEY (EVENT_ID)
+);
+
+-- apply_move maps the move to its cell, stores the tile and sets the winner in a single call
+-- nothing is stored and no row is returned when the row is full, the game is over or the mapped
+-- column differs from p_y, callers pass p_y to reject moves computed on a stale board
+CREATE OR REPLACE FUNCTION apply_move(p_game_id INT, p_row INT, p_direction TEXT, p_player TEXT, p_y INT DEFAULT NULL)
+RETURNS TABLE(tile_x INT, tile_y INT, game_winner TEXT) AS $$
+DECLARE
+  g game%ROWTYPE;
+  target_y INT;
+  directions INT[] := ARRAY[[0, 1], [1, 0], [1, 1], [1, -1]];
+  dx INT;
+  dy INT;
+  side INT;
+  step INT;
+  line INT;
+BEGIN
+  -- moves of the same game are serialized on the game row
+  SELECT * INTO g FROM game WHERE game.game_id = p_game_id FOR UPDATE;
+  IF NOT FOUND OR g.winner IS NOT NULL OR p_row < 0 OR p_row >= g.height THEN
+    RETURN;
+  END IF;
+
+  -- the free cells of a row are contiguous, left moves land on the last one and right moves on the first one
+  -- they are found at the edge of the tiles already in the row, so only those tiles are read
+  IF p_direction = 'left' THEN
+    IF NOT EXISTS (SELECT 1 FROM game_tile t WHERE t.game_id = p_game_id AND t.x = p_row AND t.y = g.width - 1) THEN
+      target_y := g.width - 1;
+    ELSE
+      SELECT MAX(t.y) - 1 INTO target_y FROM game_tile t
+      WHERE t.game_id = p_game_id AND t.x = p_row AND NOT EXISTS (
+        SELECT 1 FROM game_tile u WHERE u.game_id = p_game_id AND u.x = p_row AND u.y = t.y - 1
+      );
+    END IF;
+  ELSE
+    IF NOT EXISTS (SELECT 1 FROM game_tile t WHERE t.game_id = p_game_id AND t.x = p_row AND t.y = 0) THEN
+      target_y := 0;
+    ELSE
+      SELECT MIN(t.y) + 1 INTO target_y FROM game_tile t
+      WHERE t.game_id = p_game_id AND t.x = p_row AND NOT EXISTS (
+        SELECT 1 FROM game_tile u WHERE u.game_id = p_game_id AND u.x = p_row AND u.y = t.y + 1
+      );
+    END IF;
+  END IF;
+  IF target_y < 0 OR target_y >= g.width OR target_y <> COALESCE(p_y, target_y) THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO game_tile (game_id, game_width, game_height, x, y, value)
+  VALUES (p_game_id, g.width, g.height, p_row, target_y, p_player);
+
+  -- same walk as services.game.engine.Board.check_win, only the lines crossing the new tile
+  FOR i IN 1..4 LOOP
+    dx := directions[i][1];
+    dy := directions[i][2];
+    line := 1;
+    FOREACH side IN ARRAY ARRAY[1, -1] LOOP
+      step := 1;
+      WHILE line < g.line_target AND EXISTS (
+        SELECT 1 FROM game_tile t
+        WHERE t.game_id = p_game_id AND t.x = p_row + dx * side * step
+          AND t.y = target_y + dy * side * step AND t.value = p_player
+      ) LOOP
+        line := line + 1;
+        step := step + 1;
+      END LOOP;
+    END LOOP;
+
+    IF line >= g.line_target THEN
+      UPDATE game SET winner = p_player WHERE game.game_id = p_game_id;
+      g.winner := p_player;
+      EXIT;
+    END IF;
+  END LOOP;
+
+  RETURN QUERY SELECT p_row, target_y, g.winner;
+END;
+$$ LANGUAGE plpgsql;
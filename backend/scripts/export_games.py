@@ -0,0 +1,88 @@
+"""
+Streams the games of game and game_archive, with their tiles or board, to JSON Lines or CSV.
+Games are read in game_id order by short read-only transactions of --batch-size games, from EXPORT_DB_HOST
+when it points to a replica, so memory stays constant whatever the number of games and tiles.
+
+Run from the backend folder:
+    python -m scripts.export_games --output games.jsonl [--format jsonl|csv] [--layout tiles|board]
+        [--after 0] [--until N] [--winner W] [--player P] [--batch-size 500] [--checkpoint games.checkpoint]
+
+With --checkpoint the game_id and output size reached are saved after every batch, running the same
+command again cuts --output back to that size and resumes after that game_id.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from db.engine import ExportSessionLocal, engine, export_engine
+from env import BOARD_SNAPSHOT_INTERVAL, BOARD_STORAGE, EXPORT_BATCH_SIZE
+from services.game.export import ExportFilter, ExportFormatEnum, ExportLayoutEnum, export_batches, format_records
+from services.game.storage import create_storage
+
+
+def read_checkpoint(path: str | None) -> dict | None:
+    if(path is None or not os.path.exists(path)):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# write_checkpoint replaces the checkpoint at once, a crash leaves the previous one
+def write_checkpoint(path: str, after: int, size: int):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"after": after, "size": size}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+async def export(args):
+    storage = create_storage(BOARD_STORAGE, BOARD_SNAPSHOT_INTERVAL)
+    format = ExportFormatEnum(args.format)
+    checkpoint = read_checkpoint(args.checkpoint)
+    after = args.after if checkpoint is None else checkpoint["after"]
+    filters = ExportFilter(after, args.until, args.winner, args.player)
+
+    if(args.output == "-"):
+        out = sys.stdout
+    elif(checkpoint is not None):
+        # lines written after the last checkpoint are written again
+        out = open(args.output, "r+")
+        out.truncate(checkpoint["size"])
+        out.seek(checkpoint["size"])
+    else:
+        out = open(args.output, "w")
+
+    exported = 0
+    header = format == ExportFormatEnum.csv and checkpoint is None
+    try:
+        async for records in export_batches(ExportSessionLocal, storage, filters, ExportLayoutEnum(args.layout), args.batch_size):
+            out.write(format_records(records, format, header))
+            out.flush()
+            header = False
+            exported += len(records)
+            if(args.checkpoint is not None and out is not sys.stdout):
+                write_checkpoint(args.checkpoint, records[-1]["game_id"], out.tell())
+            print(f"exported {exported} games, last game_id {records[-1]['game_id']}", file=sys.stderr)
+        if(header):
+            out.write(format_records([], format, header))
+    finally:
+        if(out is not sys.stdout):
+            out.close()
+        await export_engine.dispose()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export games with their tiles or board")
+    parser.add_argument("--output", default="-", help="file to write, - for stdout")
+    parser.add_argument("--format", choices=[f.value for f in ExportFormatEnum], default="jsonl")
+    parser.add_argument("--layout", choices=[layout.value for layout in ExportLayoutEnum], default="tiles")
+    parser.add_argument("--after", type=int, default=0, help="export the games with a greater game_id")
+    parser.add_argument("--until", type=int, default=None, help="last game_id to export")
+    parser.add_argument("--winner", default=None)
+    parser.add_argument("--player", default=None, help="host or enemy of the games")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default=None, help="file keeping the progress to resume from")
+    args = parser.parse_args()
+    asyncio.run(export(args))
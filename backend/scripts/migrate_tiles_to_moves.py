@@ -0,0 +1,50 @@
+"""
+Converts the game_tile rows of every game into a packed snapshot on game, so the games can be
+served with BOARD_STORAGE=moves. The order of the original moves is unknown, the log of a migrated
+game starts at the number of tiles it had.
+
+Run from the backend folder after scripts/migrations/001_game_move_log.sql:
+    python -m scripts.migrate_tiles_to_moves [--batch-size 500] [--delete-tiles]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import selectinload
+
+from db.engine import SessionLocal, engine
+from services.game.engine import board_class
+from services.game.models import Game, GameTile
+
+
+async def migrate(batch_size: int, delete_tiles: bool):
+    last_id = 0
+    migrated = 0
+    while True:
+        async with SessionLocal() as db:
+            res = await db.execute(select(Game).options(selectinload(Game.tiles))
+                                   .where(Game.game_id > last_id, Game.snapshot == None)
+                                   .order_by(Game.game_id).limit(batch_size))
+            games = res.scalars().all()
+            if(len(games) == 0):
+                break
+
+            for game in games:
+                board = board_class(game.width, game.height).from_game(game)  # type: ignore
+                await db.execute(update(Game).where(Game.game_id == game.game_id).values(
+                    snapshot=board.pack((game.host, game.enemy)), snapshot_seq=board.moves))
+                if(delete_tiles):
+                    await db.execute(delete(GameTile).where(GameTile.game_id == game.game_id))
+            await db.commit()
+            last_id = games[-1].game_id
+            migrated += len(games)
+            print(f"migrated {migrated} games, last game_id {last_id}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert game_tile rows into packed game snapshots")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--delete-tiles", action="store_true", help="delete the game_tile rows once converted")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.delete_tiles))
@@ -0,0 +1,13 @@
+-- adds the append-only move log and packed board snapshots used by BOARD_STORAGE=moves
+-- existing game_tile rows are converted to snapshots by scripts/migrate_tiles_to_moves.py
+ALTER TABLE GAME ADD COLUMN IF NOT EXISTS SNAPSHOT BYTEA;
+ALTER TABLE GAME ADD COLUMN IF NOT EXISTS SNAPSHOT_SEQ INT DEFAULT 0 NOT NULL;
+
+CREATE TABLE IF NOT EXISTS GAME_MOVE(
+    GAME_ID INT NOT NULL REFERENCES GAME (GAME_ID),
+    SEQ INT NOT NULL,
+    PLAYER TEXT NOT NULL,
+    ROW INT NOT NULL,
+    DIRECTION TEXT NOT NULL CHECK(DIRECTION IN ('left', 'right')),
+	PRIMARY KEY (GAME_ID,SEQ)
+);
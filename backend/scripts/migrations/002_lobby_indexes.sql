@@ -0,0 +1,4 @@
+-- indexes used by the keyset paginated lobby queries
+CREATE INDEX CONCURRENTLY IF NOT EXISTS GAME_OPEN_IDX ON GAME (GAME_ID) WHERE ENEMY IS NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS GAME_HOST_IDX ON GAME (HOST, GAME_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS GAME_ENEMY_IDX ON GAME (ENEMY, GAME_ID) WHERE ENEMY IS NOT NULL;
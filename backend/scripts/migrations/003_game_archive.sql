@@ -0,0 +1,34 @@
+-- adds finished_at to game and the partitioned game_archive table used by scripts/archive_games.py
+-- games that already have a winner are considered finished when the migration runs
+ALTER TABLE GAME ADD COLUMN IF NOT EXISTS FINISHED_AT TIMESTAMPTZ;
+UPDATE GAME SET FINISHED_AT = now() WHERE WINNER IS NOT NULL AND FINISHED_AT IS NULL;
+CREATE OR REPLACE FUNCTION SET_GAME_FINISHED_AT() RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.WINNER IS NOT NULL AND OLD.WINNER IS NULL THEN
+    NEW.FINISHED_AT := now();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS GAME_FINISHED_AT ON GAME;
+CREATE TRIGGER GAME_FINISHED_AT BEFORE UPDATE OF WINNER ON GAME
+    FOR EACH ROW EXECUTE FUNCTION SET_GAME_FINISHED_AT();
+
+CREATE INDEX IF NOT EXISTS GAME_FINISHED_IDX ON GAME (FINISHED_AT) WHERE FINISHED_AT IS NOT NULL;
+
+-- one row per archived game with its final board packed, partitioned by month of FINISHED_AT
+-- partitions are created by services.game.archive as games are archived
+CREATE TABLE IF NOT EXISTS GAME_ARCHIVE(
+    GAME_ID INT NOT NULL,
+    FINISHED_AT TIMESTAMPTZ NOT NULL,
+    WIDTH INT NOT NULL,
+    HEIGHT INT NOT NULL,
+    LINE_TARGET INT NOT NULL,
+    HOST TEXT NOT NULL,
+    ENEMY TEXT,
+    WINNER TEXT,
+    MOVES INT NOT NULL,
+    BOARD BYTEA NOT NULL,
+	PRIMARY KEY (GAME_ID,FINISHED_AT)
+) PARTITION BY RANGE (FINISHED_AT);
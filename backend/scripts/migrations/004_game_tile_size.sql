@@ -0,0 +1,9 @@
+-- game_tile checked the row X against the width and the column Y against the height,
+-- which rejected tiles of boards taller than wide
+ALTER TABLE GAME_TILE DROP CONSTRAINT IF EXISTS GAME_SIZE;
+ALTER TABLE GAME_TILE ADD CONSTRAINT GAME_SIZE CHECK(
+    X < GAME_HEIGHT AND
+    X >= 0
+    AND Y < GAME_WIDTH
+    AND Y >= 0
+);
@@ -0,0 +1,60 @@
+-- adds the player_stats aggregates kept by the game_player_stats trigger
+-- the existing games are counted once, bot games are told apart by the bot_ prefix of the names turn_game_into_ai used
+ALTER TABLE GAME ADD COLUMN IF NOT EXISTS ENEMY_BOT BOOLEAN DEFAULT FALSE NOT NULL;
+UPDATE GAME SET ENEMY_BOT = TRUE WHERE ENEMY LIKE 'bot\_%';
+
+CREATE TABLE IF NOT EXISTS PLAYER_STATS(
+    PLAYER TEXT NOT NULL,
+    GAMES INT DEFAULT 0 NOT NULL,
+    WINS INT DEFAULT 0 NOT NULL,
+    LOSSES INT DEFAULT 0 NOT NULL,
+    IN_PROGRESS INT DEFAULT 0 NOT NULL,
+    BOT_GAMES INT DEFAULT 0 NOT NULL,
+	PRIMARY KEY (PLAYER)
+);
+
+CREATE INDEX IF NOT EXISTS PLAYER_STATS_WINS_IDX ON PLAYER_STATS (WINS DESC, PLAYER);
+
+CREATE OR REPLACE FUNCTION UPDATE_PLAYER_STATS() RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.ENEMY IS NOT NULL AND OLD.ENEMY IS NULL THEN
+    INSERT INTO PLAYER_STATS (PLAYER, GAMES, IN_PROGRESS, BOT_GAMES)
+    VALUES (NEW.HOST, 1, 1, CASE WHEN NEW.ENEMY_BOT THEN 1 ELSE 0 END)
+    ON CONFLICT (PLAYER) DO UPDATE SET GAMES = PLAYER_STATS.GAMES + 1, IN_PROGRESS = PLAYER_STATS.IN_PROGRESS + 1,
+      BOT_GAMES = PLAYER_STATS.BOT_GAMES + EXCLUDED.BOT_GAMES;
+    IF NOT NEW.ENEMY_BOT THEN
+      INSERT INTO PLAYER_STATS (PLAYER, GAMES, IN_PROGRESS) VALUES (NEW.ENEMY, 1, 1)
+      ON CONFLICT (PLAYER) DO UPDATE SET GAMES = PLAYER_STATS.GAMES + 1, IN_PROGRESS = PLAYER_STATS.IN_PROGRESS + 1;
+    END IF;
+  END IF;
+  IF NEW.WINNER IS NOT NULL AND OLD.WINNER IS NULL THEN
+    UPDATE PLAYER_STATS SET WINS = WINS + 1, IN_PROGRESS = IN_PROGRESS - 1 WHERE PLAYER = NEW.WINNER;
+    UPDATE PLAYER_STATS SET LOSSES = LOSSES + 1, IN_PROGRESS = IN_PROGRESS - 1
+    WHERE PLAYER = CASE WHEN NEW.WINNER = NEW.HOST THEN NEW.ENEMY ELSE NEW.HOST END;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS GAME_PLAYER_STATS ON GAME;
+
+-- the backfill and the trigger are installed together so no seat or winner is counted twice or missed
+BEGIN;
+LOCK TABLE GAME IN SHARE ROW EXCLUSIVE MODE;
+INSERT INTO PLAYER_STATS (PLAYER, GAMES, WINS, LOSSES, IN_PROGRESS, BOT_GAMES)
+SELECT PLAYER, COUNT(*), COUNT(*) FILTER (WHERE WINNER = PLAYER), COUNT(*) FILTER (WHERE WINNER IS NOT NULL AND WINNER <> PLAYER),
+       COUNT(*) FILTER (WHERE WINNER IS NULL), COUNT(*) FILTER (WHERE BOT_OPPONENT)
+FROM (
+    SELECT HOST AS PLAYER, WINNER, ENEMY LIKE 'bot\_%' AS BOT_OPPONENT FROM GAME WHERE ENEMY IS NOT NULL
+    UNION ALL
+    SELECT ENEMY, WINNER, FALSE FROM GAME WHERE ENEMY IS NOT NULL AND ENEMY NOT LIKE 'bot\_%'
+    UNION ALL
+    SELECT HOST, WINNER, ENEMY LIKE 'bot\_%' FROM GAME_ARCHIVE WHERE ENEMY IS NOT NULL
+    UNION ALL
+    SELECT ENEMY, WINNER, FALSE FROM GAME_ARCHIVE WHERE ENEMY IS NOT NULL AND ENEMY NOT LIKE 'bot\_%'
+) SEATS
+GROUP BY PLAYER
+ON CONFLICT (PLAYER) DO NOTHING;
+CREATE TRIGGER GAME_PLAYER_STATS AFTER UPDATE OF ENEMY, WINNER ON GAME
+    FOR EACH ROW EXECUTE FUNCTION UPDATE_PLAYER_STATS();
+COMMIT;
@@ -0,0 +1,78 @@
+-- installs apply_move, used by BOARD_STORAGE=tiles to apply a move with a single call, see services.game.storage.TileStorage
+-- it used to be installed by every worker at startup, which needed the rights to create functions
+-- apply_move maps the move to its cell, stores the tile and sets the winner in a single call
+-- nothing is stored and no row is returned when the row is full, the game is over or the mapped
+-- column differs from p_y, callers pass p_y to reject moves computed on a stale board
+CREATE OR REPLACE FUNCTION apply_move(p_game_id INT, p_row INT, p_direction TEXT, p_player TEXT, p_y INT DEFAULT NULL)
+RETURNS TABLE(tile_x INT, tile_y INT, game_winner TEXT) AS $$
+DECLARE
+  g game%ROWTYPE;
+  target_y INT;
+  directions INT[] := ARRAY[[0, 1], [1, 0], [1, 1], [1, -1]];
+  dx INT;
+  dy INT;
+  side INT;
+  step INT;
+  line INT;
+BEGIN
+  -- moves of the same game are serialized on the game row
+  SELECT * INTO g FROM game WHERE game.game_id = p_game_id FOR UPDATE;
+  IF NOT FOUND OR g.winner IS NOT NULL OR p_row < 0 OR p_row >= g.height THEN
+    RETURN;
+  END IF;
+
+  -- the free cells of a row are contiguous, left moves land on the last one and right moves on the first one
+  -- they are found at the edge of the tiles already in the row, so only those tiles are read
+  IF p_direction = 'left' THEN
+    IF NOT EXISTS (SELECT 1 FROM game_tile t WHERE t.game_id = p_game_id AND t.x = p_row AND t.y = g.width - 1) THEN
+      target_y := g.width - 1;
+    ELSE
+      SELECT MAX(t.y) - 1 INTO target_y FROM game_tile t
+      WHERE t.game_id = p_game_id AND t.x = p_row AND NOT EXISTS (
+        SELECT 1 FROM game_tile u WHERE u.game_id = p_game_id AND u.x = p_row AND u.y = t.y - 1
+      );
+    END IF;
+  ELSE
+    IF NOT EXISTS (SELECT 1 FROM game_tile t WHERE t.game_id = p_game_id AND t.x = p_row AND t.y = 0) THEN
+      target_y := 0;
+    ELSE
+      SELECT MIN(t.y) + 1 INTO target_y FROM game_tile t
+      WHERE t.game_id = p_game_id AND t.x = p_row AND NOT EXISTS (
+        SELECT 1 FROM game_tile u WHERE u.game_id = p_game_id AND u.x = p_row AND u.y = t.y + 1
+      );
+    END IF;
+  END IF;
+  IF target_y < 0 OR target_y >= g.width OR target_y <> COALESCE(p_y, target_y) THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO game_tile (game_id, game_width, game_height, x, y, value)
+  VALUES (p_game_id, g.width, g.height, p_row, target_y, p_player);
+
+  -- same walk as services.game.engine.Board.check_win, only the lines crossing the new tile
+  FOR i IN 1..4 LOOP
+    dx := directions[i][1];
+    dy := directions[i][2];
+    line := 1;
+    FOREACH side IN ARRAY ARRAY[1, -1] LOOP
+      step := 1;
+      WHILE line < g.line_target AND EXISTS (
+        SELECT 1 FROM game_tile t
+        WHERE t.game_id = p_game_id AND t.x = p_row + dx * side * step
+          AND t.y = target_y + dy * side * step AND t.value = p_player
+      ) LOOP
+        line := line + 1;
+        step := step + 1;
+      END LOOP;
+    END LOOP;
+
+    IF line >= g.line_target THEN
+      UPDATE game SET winner = p_player WHERE game.game_id = p_game_id;
+      g.winner := p_player;
+      EXIT;
+    END IF;
+  END LOOP;
+
+  RETURN QUERY SELECT p_row, target_y, g.winner;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,17 @@
+-- adds the tables of GAME_BACKEND=postgres, turns and agents shared between workers and the events too big for a NOTIFY payload
+CREATE TABLE IF NOT EXISTS GAME_SESSION(
+    GAME_ID INT NOT NULL REFERENCES GAME (GAME_ID),
+    HOST TEXT NOT NULL,
+    ENEMY TEXT,
+    TURN TEXT NOT NULL,
+    AGENT TEXT,
+	PRIMARY KEY (GAME_ID)
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS GAME_EVENT(
+    EVENT_ID BIGSERIAL,
+    GAME_ID INT NOT NULL,
+    MESSAGE JSONB NOT NULL,
+    CREATED_AT TIMESTAMPTZ DEFAULT now() NOT NULL,
+	PRIMARY KEY (EVENT_ID)
+);
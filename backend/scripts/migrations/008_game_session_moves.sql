@@ -0,0 +1,6 @@
+-- counts the moves of every session so a worker can tell when the board it cached is behind the one another worker moved on
+ALTER TABLE GAME_SESSION ADD COLUMN IF NOT EXISTS MOVES INT DEFAULT 0 NOT NULL;
+UPDATE GAME_SESSION SET MOVES = GREATEST(
+    (SELECT COUNT(*) FROM GAME_TILE WHERE GAME_TILE.GAME_ID = GAME_SESSION.GAME_ID),
+    (SELECT COUNT(*) FROM GAME_MOVE WHERE GAME_MOVE.GAME_ID = GAME_SESSION.GAME_ID)
+);
@@ -0,0 +1,13 @@
+-- prefixes packed boards with the format byte of services.game.engine.Board.pack, 0 dense and 1 sparse,
+-- boards were picked with SPARSE_BOARD_CELLS, change 4096 below if the workers ran with another value
+-- run with the workers stopped, the length checks skip the boards that already have their format byte
+BEGIN;
+UPDATE GAME SET SNAPSHOT = DECODE('00', 'hex') || SNAPSHOT
+WHERE SNAPSHOT IS NOT NULL AND WIDTH * HEIGHT <= 4096 AND LENGTH(SNAPSHOT) = (WIDTH * HEIGHT + 3) / 4;
+UPDATE GAME SET SNAPSHOT = DECODE('01', 'hex') || SNAPSHOT
+WHERE SNAPSHOT IS NOT NULL AND WIDTH * HEIGHT > 4096 AND LENGTH(SNAPSHOT) % 8 = 0;
+UPDATE GAME_ARCHIVE SET BOARD = DECODE('00', 'hex') || BOARD
+WHERE WIDTH * HEIGHT <= 4096 AND LENGTH(BOARD) = (WIDTH * HEIGHT + 3) / 4;
+UPDATE GAME_ARCHIVE SET BOARD = DECODE('01', 'hex') || BOARD
+WHERE WIDTH * HEIGHT > 4096 AND LENGTH(BOARD) % 8 = 0;
+COMMIT;
@@ -0,0 +1,167 @@
+"""
+Plays games between bots in-process, without HTTP or the database, spread over a process pool.
+Moves follow Board (the rules of map_move and of the moves played through the API), wins are checked with
+Board.check_win and, with --check-grid, also with utils.check_grid to compare both and time them.
+
+Run from the backend folder:
+    python -m scripts.simulate [--games 1000] [--bots random,search] [--width 7 --height 7 --line-target 4]
+
+Bots: random plays any valid move, center the valid move closest to the center, search the AI of
+services.game.ai with --time-budget and --max-depth. Bots swap seats every game.
+"""
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+from services.game.ai import choose_move
+from services.game.engine import Board
+from services.game.schemas import PlayDirectionEnum
+from services.game.utils import check_grid
+
+BOTS = ("random", "center", "search")
+
+
+class Bot():
+    def __init__(self, name: str, player: int, rng: random.Random, time_budget: float, max_depth: int):
+        self.name = name
+        self.player = player
+        self.rng = rng
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+
+    def choose(self, board: Board) -> tuple[int, PlayDirectionEnum]:
+        if(self.name == "search"):
+            cells = bytes(0 if value is None else 1 if value == self.player else 2 for value in board.cells)
+            row, direction = choose_move(board.width, board.height, board.line_target, cells, self.time_budget, self.max_depth)  # type: ignore
+            return row, PlayDirectionEnum(direction)
+
+        moves = [(move.row, move.direction) for move in board.valid_moves()]
+        if(self.name == "center"):
+            center_x = (board.height - 1) / 2
+            center_y = (board.width - 1) / 2
+
+            def distance(move):
+                x, y = board.map_move(*move)  # type: ignore
+                return abs(x - center_x) + abs(y - center_y) + self.rng.random() / 2
+
+            return min(moves, key=distance)
+        return self.rng.choice(moves)
+
+
+# play_games runs in the worker processes, game `index` decides which bot moves first
+def play_games(first_index: int, count: int, args: dict) -> dict:
+    rng = random.Random(args["seed"] + first_index)
+    names = args["bots"]
+    results: dict[str, Any] = {"lengths": [], "winners": [], "check_win_time": 0.0, "check_grid_time": 0.0, "checks": 0, "mismatches": 0}
+    for index in range(first_index, first_index + count):
+        # seats 1 and 2, seat 1 moves first
+        seats = names if index % 2 == 0 else names[::-1]
+        bots = {seat: Bot(seats[seat - 1], seat, rng, args["time_budget"], args["max_depth"]) for seat in (1, 2)}
+        board = Board(args["width"], args["height"], args["line_target"])
+        player = 1
+        winner = None
+        while board.moves < len(board.cells):
+            row, direction = bots[player].choose(board)
+            x, y = board.place(row, direction, player)  # type: ignore
+
+            start = time.perf_counter()
+            wins, count_win = board.check_win(x, y)
+            results["check_win_time"] += time.perf_counter() - start
+            if(args["check_grid"]):
+                grid = board.to_list()
+                start = time.perf_counter()
+                grid_wins, count_grid = check_grid(grid, board.line_target, player, x, y)  # type: ignore
+                results["check_grid_time"] += time.perf_counter() - start
+                if(grid_wins != wins or min(count_grid, board.line_target) != min(count_win, board.line_target)):
+                    results["mismatches"] += 1
+            results["checks"] += 1
+
+            if(wins):
+                winner = bots[player].name
+                break
+            player = 3 - player
+        results["lengths"].append(board.moves)
+        results["winners"].append((winner, seats[0]))
+    return results
+
+
+def percentile(values: list[int], p: float):
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def summarize(results: list[dict], duration: float, args: dict) -> dict:
+    lengths = sorted(length for result in results for length in result["lengths"])
+    winners = [winner for result in results for winner in result["winners"]]
+    checks = sum(result["checks"] for result in results)
+    wins = {name: 0 for name in set(args["bots"])}
+    first_seat_wins = 0
+    for winner, first in winners:
+        if(winner is not None):
+            wins[winner] += 1
+            first_seat_wins += winner == first
+    games = len(winners)
+    draws = sum(1 for winner, _ in winners if winner is None)
+
+    histogram: dict[int, int] = {}
+    for length in lengths:
+        histogram[length] = histogram.get(length, 0) + 1
+
+    summary = {
+        "games": games,
+        "duration": duration,
+        "games_per_second": games / duration,
+        "moves_per_second": sum(lengths) / duration,
+        "length": {"min": lengths[0], "mean": sum(lengths) / games, "p50": percentile(lengths, 50),
+                   "p90": percentile(lengths, 90), "max": lengths[-1], "histogram": histogram},
+        "win_rate": {name: count / games for name, count in wins.items()},
+        "first_seat_win_rate": first_seat_wins / games,
+        "draw_rate": draws / games,
+        "check_win_us": sum(result["check_win_time"] for result in results) / checks * 1e6,
+    }
+    if(args["check_grid"]):
+        summary["check_grid_us"] = sum(result["check_grid_time"] for result in results) / checks * 1e6
+        summary["check_mismatches"] = sum(result["mismatches"] for result in results)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play bot against bot games without HTTP or database")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None, help="processes, defaults to the number of cpus")
+    parser.add_argument("--chunk-size", type=int, default=50, help="games sent to a worker at once")
+    parser.add_argument("--bots", default="random,random", help=f"two of {', '.join(BOTS)}")
+    parser.add_argument("--width", type=int, default=7)
+    parser.add_argument("--height", type=int, default=7)
+    parser.add_argument("--line-target", type=int, default=4)
+    parser.add_argument("--time-budget", type=float, default=0.05, help="seconds per move of the search bot")
+    parser.add_argument("--max-depth", type=int, default=4, help="search depth of the search bot")
+    parser.add_argument("--check-grid", action="store_true", help="also check wins with utils.check_grid")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the summary as json")
+    args = parser.parse_args()
+
+    bots = args.bots.split(",")
+    if(len(bots) != 2 or any(bot not in BOTS for bot in bots)):
+        parser.error(f"--bots takes two of {', '.join(BOTS)}")
+    options = {"bots": bots, "width": args.width, "height": args.height, "line_target": args.line_target,
+               "time_budget": args.time_budget, "max_depth": args.max_depth, "check_grid": args.check_grid, "seed": args.seed}
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(play_games, first, min(args.chunk_size, args.games - first), options)
+                   for first in range(0, args.games, args.chunk_size)]
+        results = [future.result() for future in futures]
+    summary = summarize(results, time.perf_counter() - start, options)
+    summary["config"] = vars(args)
+
+    print(json.dumps(summary, indent=2))
+    if(args.output):
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable
+
+from services.game.exceptions import AdmissionRejected
+from services.game.metrics import Registry
+
+
+class AdmissionGate():
+    """
+    Bounds the requests running at once to `limit`.
+    Up to `max_queued` requests wait `queue_timeout` seconds for a slot, anything beyond is rejected
+    right away so a spike fails fast instead of piling up behind the game locks and the DB pool.
+    Slots are handed to the waiters in arrival order. A limit of 0 disables the gate.
+    """
+
+    def __init__(self, limit: int, max_queued: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    async def acquire(self) -> bool:
+        if(self.limit <= 0 or (self.in_flight < self.limit and len(self.waiters) == 0)):
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if(len(self.waiters) >= self.max_queued or self.queue_timeout <= 0):
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            # the slot may have been handed over right before the request was cancelled
+            if(waiter.done() and not waiter.cancelled()):
+                self.release()
+            raise
+        finally:
+            if(not waiter.done() or waiter.cancelled()):
+                self.__discard(waiter)
+        self.admitted += 1
+        return True
+
+    def release(self):
+        # the slot goes to the oldest waiter still waiting, in_flight stays the same
+        while len(self.waiters) > 0:
+            waiter = self.waiters.popleft()
+            if(not waiter.done()):
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def __discard(self, waiter: asyncio.Future):
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class RateLimiter():
+    """
+    Token bucket per key: `rate` requests per second on average, bursts of up to `burst`.
+    Only the `max_keys` most recently seen keys are tracked, a rate of 0 disables the limiter.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        # key -> (tokens, time of the last refill)
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.limited = 0
+
+    # check takes a token for `key` and returns 0, or the seconds to wait when the bucket is empty
+    def check(self, key: str) -> float:
+        if(self.rate <= 0):
+            return 0
+        now = time.monotonic()
+        tokens, last = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        retry_after = 0.0
+        if(tokens >= 1):
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+            self.limited += 1
+        self.buckets[key] = (tokens, now)
+        if(len(self.buckets) > self.max_keys):
+            self.buckets.popitem(last=False)
+        return retry_after
+
+
+class Admission():
+    """
+    Admission control of the move endpoint, the game websockets and the exports.
+    Moves are limited per token then bounded in flight, websockets are limited per token then bounded
+    while they are accepted and sent their first frame, exports are bounded while they stream.
+    Rate limited requests get a 429, requests rejected by a full gate a 503, both with the seconds
+    to wait before retrying.
+    """
+
+    def __init__(self, move_gate: AdmissionGate, move_rate: RateLimiter, accept_gate: AdmissionGate,
+                 connect_rate: RateLimiter, export_gate: AdmissionGate, retry_after: float):
+        self.move_gate = move_gate
+        self.move_rate = move_rate
+        self.accept_gate = accept_gate
+        self.connect_rate = connect_rate
+        self.export_gate = export_gate
+        self.retry_after = retry_after
+
+    @asynccontextmanager
+    async def admit_move(self, token: str):
+        async with self.__admit(self.move_gate, self.move_rate, token, "moves"):
+            yield
+
+    @asynccontextmanager
+    async def admit_connect(self, token: str):
+        async with self.__admit(self.accept_gate, self.connect_rate, token, "connections"):
+            yield
+
+    # acquire_export takes an export slot and returns the function that gives it back, only its first call releases
+    # the slot so it can be called both when the stream ends and once the response is done
+    async def acquire_export(self) -> Callable[[], None]:
+        if(not await self.export_gate.acquire()):
+            raise AdmissionRejected(503, math.ceil(self.retry_after), "Too many exports in progress, try again later")
+        released = False
+
+        def release():
+            nonlocal released
+            if(not released):
+                released = True
+                self.export_gate.release()
+        return release
+
+    @asynccontextmanager
+    async def __admit(self, gate: AdmissionGate, rate: RateLimiter, token: str, name: str):
+        wait = rate.check(token)
+        if(wait > 0):
+            raise AdmissionRejected(429, math.ceil(wait), f"Too many {name}, slow down")
+        if(not await gate.acquire()):
+            raise AdmissionRejected(503, math.ceil(self.retry_after), f"Too many {name} in progress, try again later")
+        try:
+            yield
+        finally:
+            gate.release()
+
+    def register_metrics(self, registry: Registry):
+        self.__register_gate(registry, "moves", self.move_gate, self.move_rate)
+        self.__register_gate(registry, "accepts", self.accept_gate, self.connect_rate)
+        registry.gauge("game_admission_exports_in_flight", "Exports streaming", lambda: self.export_gate.in_flight)
+        registry.counter("game_admission_exports_rejected_total", "Exports rejected with a 503", lambda: self.export_gate.rejected)
+
+    def __register_gate(self, registry: Registry, name: str, gate: AdmissionGate, rate: RateLimiter):
+        registry.gauge(f"game_admission_{name}_in_flight", f"Admitted {name} running", lambda: gate.in_flight)
+        registry.gauge(f"game_admission_{name}_waiting", f"{name.capitalize()} waiting for a slot", lambda: len(gate.waiters))
+        registry.counter(f"game_admission_{name}_admitted_total", f"Admitted {name}", lambda: gate.admitted)
+        registry.counter(f"game_admission_{name}_queued_total", f"{name.capitalize()} that waited for a slot", lambda: gate.queued)
+        registry.counter(f"game_admission_{name}_rejected_total", f"{name.capitalize()} rejected with a 503", lambda: gate.rejected)
+        registry.counter(f"game_admission_{name}_rate_limited_total", f"{name.capitalize()} rejected with a 429", lambda: rate.limited)
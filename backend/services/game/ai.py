@@ -0,0 +1,264 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from services.game.engine import Board
+from services.game.schemas import PlayDirectionEnum, PlayerMove
+
+WIN_SCORE = 1_000_000
+INFINITY = WIN_SCORE + 1
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+# boards whose winning windows hold more cells than this are searched without the positional evaluation,
+# it bounds the time of a single evaluate and so how far past its deadline a search can run
+MAX_EVAL_CELLS = 100_000
+MAX_TABLE_SIZE = 1 << 20
+# units of work between two reads of the clock, a unit is about a cell read or a move mapped
+CHECK_INTERVAL = 4096
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+@lru_cache(maxsize=16)
+def zobrist_keys(cells: int) -> tuple[int, ...]:
+    rng = random.Random(cells)
+    return tuple(rng.getrandbits(64) for _ in range(cells * 2))
+
+
+@lru_cache(maxsize=16)
+def winning_windows(width: int, height: int, line_target: int) -> tuple[tuple[int, ...], ...]:
+    windows = []
+    for dx, dy in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        for x in range(height):
+            for y in range(width):
+                end_x = x + dx * (line_target - 1)
+                end_y = y + dy * (line_target - 1)
+                if(end_x >= height or end_y < 0 or end_y >= width):
+                    continue
+                windows.append(tuple((x + dx * i) * width + y + dy * i for i in range(line_target)))
+                if(len(windows) * line_target > MAX_EVAL_CELLS):
+                    return ()
+    return tuple(windows)
+
+
+class Search():
+    """
+    Negamax search with alpha-beta pruning, a Zobrist hashed transposition table and iterative deepening.
+    Cells hold 0 when empty, 1 for the searching player and 2 for the opponent.
+    """
+
+    def __init__(self, board: Board, deadline: float):
+        self.board = board
+        self.deadline = deadline
+        self.nodes = 0
+        self.work = 0
+        self.next_check = 0
+        self.table: dict[int, tuple[int, int, int, tuple[int, PlayDirectionEnum] | None]] = {}
+        self.keys = zobrist_keys(len(board.cells))
+        self.windows = winning_windows(board.width, board.height, board.line_target)
+        self.weights = [0] + [4 ** i for i in range(board.line_target)]
+        self.hash = 0
+        # the cells hold the player codes of choose_move
+        for i, value in enumerate(board.cells):
+            if(value):
+                self.hash ^= self.keys[i * 2 + int(value) - 1]
+
+    def run(self, max_depth: int) -> tuple[int, PlayDirectionEnum] | None:
+        moves = self.moves()
+        if(len(moves) == 0):
+            return None
+
+        # the move played if not even the first depth completes in time
+        best_move = self.ordered_moves(None)[0]
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self.root(depth, best_move)
+            except SearchTimeout:
+                break
+            if(move is not None):
+                best_move = move
+            if(abs(score) >= WIN_SCORE - max_depth or depth >= len(self.board.cells) - self.board.moves):
+                break
+        return best_move
+
+    def root(self, depth: int, first: tuple[int, PlayDirectionEnum]):
+        alpha = -INFINITY
+        best_move = None
+        for move in self.ordered_moves(first):
+            score = self.play(move, 1, depth, -INFINITY, -alpha, 1)
+            if(score > alpha):
+                alpha = score
+                best_move = move
+        return alpha, best_move
+
+    def play(self, move: tuple[int, PlayDirectionEnum], player: int, depth: int, alpha: int, beta: int, ply: int):
+        row, direction = move
+        board = self.board
+        # check_win reads up to line_target cells on each side of the tile, in every direction
+        self.tick(board.line_target)
+        x, y = board.place(row, direction, player)  # type: ignore
+        key = self.keys[(x * board.width + y) * 2 + player - 1]
+        self.hash ^= key
+        try:
+            if(board.check_win(x, y)[0]):
+                return WIN_SCORE - ply
+            return -self.negamax(depth - 1, alpha, beta, 3 - player, ply + 1)
+        finally:
+            self.hash ^= key
+            board.undo(row, direction)
+
+    def negamax(self, depth: int, alpha: int, beta: int, player: int, ply: int) -> int:
+        self.nodes += 1
+        self.tick(1)
+
+        alpha_start = alpha
+        table_move = None
+        entry = self.table.get(self.hash)
+        if(entry is not None):
+            entry_depth, entry_score, entry_flag, table_move = entry
+            if(entry_depth >= depth):
+                if(entry_flag == EXACT):
+                    return entry_score
+                if(entry_flag == LOWER_BOUND):
+                    alpha = max(alpha, entry_score)
+                else:
+                    beta = min(beta, entry_score)
+                if(alpha >= beta):
+                    return entry_score
+
+        if(self.board.moves == len(self.board.cells)):
+            return 0
+        if(depth <= 0):
+            return self.evaluate(player)
+
+        moves = self.ordered_moves(table_move)
+
+        best_score = -INFINITY
+        best_move = None
+        for move in moves:
+            score = self.play(move, player, depth, -beta, -alpha, ply)
+            if(score > best_score):
+                best_score = score
+                best_move = move
+            if(score > alpha):
+                alpha = score
+            if(alpha >= beta):
+                break
+
+        if(best_score <= alpha_start):
+            flag = UPPER_BOUND
+        elif(best_score >= beta):
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        if(len(self.table) >= MAX_TABLE_SIZE):
+            self.table.clear()
+        self.table[self.hash] = (depth, best_score, flag, best_move)
+        return best_score
+
+    # tick counts `cost` units of work and raises SearchTimeout once the deadline passed, the clock is only
+    # read every CHECK_INTERVAL units, so a search stops at most one evaluate after its deadline
+    def tick(self, cost: int):
+        self.work += cost
+        if(self.work >= self.next_check):
+            self.next_check = self.work + CHECK_INTERVAL
+            if(time.monotonic() > self.deadline):
+                raise SearchTimeout()
+
+    def moves(self) -> list[tuple[int, PlayDirectionEnum]]:
+        board = self.board
+        moves = []
+        for row in range(board.height):
+            free = board.width - board.left_fill[row] - board.right_fill[row]
+            if(free <= 0):
+                continue
+            moves.append((row, PlayDirectionEnum.left))
+            # with a single free cell both directions land on the same cell
+            if(free > 1):
+                moves.append((row, PlayDirectionEnum.right))
+        return moves
+
+    # ordered_moves puts `first` ahead of the moves landing closest to the center of the board
+    def ordered_moves(self, first: tuple[int, PlayDirectionEnum] | None):
+        board = self.board
+        center_x = (board.height - 1) / 2
+        center_y = (board.width - 1) / 2
+
+        def distance(move):
+            if(move == first):
+                return -1
+            x, y = board.map_move(*move)  # type: ignore
+            return abs(x - center_x) + abs(y - center_y)
+
+        moves = self.moves()
+        self.tick(len(moves))
+        return sorted(moves, key=distance)
+
+    # evaluate scores the windows that can still be completed by only one of the players
+    def evaluate(self, player: int) -> int:
+        self.tick(len(self.windows) * self.board.line_target)
+        cells = self.board.cells
+        weights = self.weights
+        score = 0
+        for window in self.windows:
+            mine = 0
+            theirs = 0
+            for i in window:
+                value = cells[i]
+                if(value == 1):
+                    mine += 1
+                elif(value == 2):
+                    theirs += 1
+            if(mine and not theirs):
+                score += weights[mine]
+            elif(theirs and not mine):
+                score -= weights[theirs]
+        return score if player == 1 else -score
+
+
+# choose_move runs in the worker processes, cells are encoded as in Search
+def choose_move(width: int, height: int, line_target: int, cells: bytes, time_budget: float, max_depth: int):
+    deadline = time.monotonic() + time_budget
+    board = Board(width, height, line_target)
+    board.cells = [value or None for value in cells]  # type: ignore
+    board.recount()
+    move = Search(board, deadline).run(max_depth)
+    if(move is None):
+        return None
+    return move[0], move[1].value
+
+
+class SearchAI():
+    """Picks AI moves with Search in a process pool, so a search never blocks the event loop"""
+
+    def __init__(self, workers: int, time_budget: float, max_depth: int):
+        self.workers = workers
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.pool: ProcessPoolExecutor | None = None
+
+    async def choose_move(self, board: Board, player_id: str) -> PlayerMove | None:
+        if(self.pool is None):
+            self.pool = ProcessPoolExecutor(self.workers)
+
+        cells = bytes(0 if value is None else 1 if value == player_id else 2 for value in board.cells)
+        loop = asyncio.get_running_loop()
+        try:
+            move = await loop.run_in_executor(self.pool, choose_move, board.width, board.height, board.line_target,
+                                              cells, self.time_budget, self.max_depth)
+        except BrokenProcessPool:
+            # a worker process died, the next move starts a new pool
+            self.shutdown()
+            raise
+        if(move is None):
+            return None
+        return PlayerMove(row=move[0], direction=move[1])
+
+    def shutdown(self):
+        if(self.pool is not None):
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
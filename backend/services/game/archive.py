@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.game.engine import Board, unpack_board
+from services.game.models import Game, GameArchive, GameMove, GameTile
+
+# key of the advisory lock taken while archive partitions are created
+PARTITION_LOCK = 7_316_002
+
+
+# archive_games moves up to batch_size games finished before `before` from the hot tables into game_archive
+# in one transaction and returns how many were moved, games locked by another archiver are skipped
+async def archive_games(db: AsyncSession, storage, before: datetime, batch_size: int) -> int:
+    res = await db.execute(select(Game).where(Game.finished_at < before).order_by(Game.game_id)
+                           .limit(batch_size).with_for_update(skip_locked=True))
+    games = res.scalars().all()
+    if(len(games) == 0):
+        return 0
+
+    boards = await storage.load_boards(db, games)
+    await ensure_partitions(db, {month_start(game.finished_at) for game in games})  # type: ignore
+    await db.execute(insert(GameArchive).values([{
+        "game_id": game.game_id, "finished_at": game.finished_at, "width": game.width, "height": game.height,
+        "line_target": game.line_target, "host": game.host, "enemy": game.enemy, "winner": game.winner,
+        "moves": boards[game.game_id].moves, "board": boards[game.game_id].pack((game.host, game.enemy))  # type: ignore
+    } for game in games]).on_conflict_do_nothing())
+
+    game_ids = [game.game_id for game in games]
+    await db.execute(delete(GameTile).where(GameTile.game_id.in_(game_ids)))
+    await db.execute(delete(GameMove).where(GameMove.game_id.in_(game_ids)))
+    await db.execute(text("DELETE FROM game_session WHERE game_id = ANY(:game_ids)"), {"game_ids": game_ids})
+    await db.execute(delete(Game).where(Game.game_id.in_(game_ids)))
+    await db.commit()
+    return len(games)
+
+
+def month_start(moment: datetime) -> datetime:
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+# ensure_partitions creates the monthly partitions of game_archive starting at `months`
+async def ensure_partitions(db: AsyncSession, months: set[datetime]):
+    await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK})
+    for start in sorted(months):
+        end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=timezone.utc)
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS game_archive_{start:%Y_%m} PARTITION OF game_archive "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"))
+
+
+# load_archived returns an archived game and its final board, the game has the attributes read from Game
+async def load_archived(db: AsyncSession, game_id: int) -> tuple[GameArchive, Board] | None:
+    res = await db.execute(select(GameArchive).where(GameArchive.game_id == game_id))
+    game = res.scalars().first()
+    if(game is None):
+        return None
+    board = unpack_board(game.board, game.width, game.height, game.line_target,  # type: ignore
+                         (game.host, game.enemy), game.moves, game.winner)  # type: ignore
+    return game, board
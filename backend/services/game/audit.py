@@ -0,0 +1,153 @@
+from enum import Enum
+
+import numpy as np
+
+from services.game.engine import DENSE_FORMAT, SPARSE_FORMAT, WIN_DIRECTIONS, Board, SparseCells
+
+
+class VerdictEnum(str, Enum):
+    ok = 'ok'
+    # the winner has no line, but the loser had the turn, as when a turn clock ran out
+    forfeit = 'forfeit'
+    # a player has a line and the game has no winner
+    missed_win = 'missed_win'
+    # only the other player has a line, or the winner is not a player of the game
+    wrong_winner = 'wrong_winner'
+    # the winner has no line and it was their turn
+    no_line = 'no_line'
+    # both players have a line
+    both_lines = 'both_lines'
+
+
+VERDICTS = list(VerdictEnum)
+
+
+class AuditGame():
+    """A stored game to audit, with its board or, for archived games, the packed board of game_archive"""
+    __slots__ = ("game_id", "width", "height", "line_target", "host", "enemy", "winner", "moves", "board", "packed")
+
+    def __init__(self, game, moves: int, board: Board | None = None, packed: bytes | None = None):
+        self.game_id = game.game_id
+        self.width = game.width
+        self.height = game.height
+        self.line_target = game.line_target
+        self.host = game.host
+        self.enemy = game.enemy
+        self.winner = game.winner
+        self.moves = moves
+        self.board = board
+        self.packed = packed
+
+    # codes has a byte per cell, 0 for empty, 1 for the host and 2 for the enemy
+    def codes(self) -> np.ndarray:
+        if(self.board is not None):
+            return board_codes(self.board, (self.host, self.enemy))
+        return packed_codes(self.packed, self.width, self.height)  # type: ignore
+
+
+# board_codes encodes a board as AuditGame.codes
+def board_codes(board: Board, players: tuple[str, str | None]) -> np.ndarray:
+    if(isinstance(board.cells, SparseCells)):
+        codes = np.zeros(board.width * board.height, dtype=np.uint8)
+        if(len(board.cells) > 0):
+            cells = np.fromiter(board.cells.keys(), dtype=np.int64, count=len(board.cells))
+            values = np.fromiter((1 if value == players[0] else 2 for value in board.cells.values()),
+                                 dtype=np.uint8, count=len(board.cells))
+            codes[cells] = values
+        return codes
+    cells = np.array(board.cells, dtype=object)
+    codes = (cells == players[0]).astype(np.uint8)
+    if(players[1] is not None):
+        codes += (cells == players[1]).astype(np.uint8) * 2
+    return codes
+
+
+# packed_codes decodes a board packed by Board.pack or SparseBoard.pack without building the board
+def packed_codes(data: bytes, width: int, height: int) -> np.ndarray:
+    cells = width * height
+    if(data[0] == SPARSE_FORMAT):
+        codes = np.zeros(cells, dtype=np.uint8)
+        tiles = np.frombuffer(data, dtype="<u8", offset=1)
+        codes[(tiles >> 2).astype(np.int64)] = (tiles & 3).astype(np.uint8)
+        return codes
+    if(data[0] != DENSE_FORMAT):
+        raise ValueError(f"unknown packed board format {data[:1]!r}")
+    packed = np.frombuffer(data, dtype=np.uint8, offset=1)
+    return ((packed[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3).reshape(-1)[:cells]
+
+
+# has_line tells which of the (n, height, width) boolean boards have `target` true cells in a row in any direction,
+# each direction ANDs the board with itself shifted 1 to target - 1 cells, so a scan is target passes over n boards
+def has_line(mask: np.ndarray, target: int) -> np.ndarray:
+    n, height, width = mask.shape
+    found = np.zeros(n, dtype=bool)
+    for dx, dy in WIN_DIRECTIONS:
+        rows = height - (target - 1) * dx
+        columns = width - (target - 1) * abs(dy)
+        if(rows <= 0 or columns <= 0):
+            continue
+        # windows start at (x, y) and cover (x + i * dx, y + i * dy), anti-diagonals start at column target - 1
+        y0 = target - 1 if dy < 0 else 0
+        run = mask[:, 0:rows, y0:y0 + columns].copy()
+        for i in range(1, target):
+            y = y0 + i * dy
+            run &= mask[:, i * dx:i * dx + rows, y:y + columns]
+        found |= run.reshape(n, -1).any(axis=1)
+    return found
+
+
+# line_owners returns, for (n, height, width) codes, whether the host and the enemy have a line, as (n, 2)
+def line_owners(codes: np.ndarray, target: int) -> np.ndarray:
+    return np.stack([has_line(codes == 1, target), has_line(codes == 2, target)], axis=1)
+
+
+# verdicts compares the stored winners (0 none, 1 host, 2 enemy, 3 anybody else) with the lines found on the boards
+def verdicts(lines: np.ndarray, winners: np.ndarray, moves: np.ndarray) -> np.ndarray:
+    host_line, enemy_line = lines[:, 0], lines[:, 1]
+    winner_line = np.where(winners == 1, host_line, enemy_line)
+    other_line = np.where(winners == 1, enemy_line, host_line)
+    # the host moves first, so after an even number of moves it is the host's turn
+    loser_on_turn = np.where(winners == 1, moves % 2 == 1, moves % 2 == 0)
+    conditions = [
+        host_line & enemy_line,
+        winners == 0,
+        winners == 3,
+        winner_line,
+        other_line,
+        loser_on_turn,
+    ]
+    choices: list[int | np.ndarray] = [VERDICTS.index(VerdictEnum.both_lines),
+               np.where(host_line | enemy_line, VERDICTS.index(VerdictEnum.missed_win), VERDICTS.index(VerdictEnum.ok)),
+               VERDICTS.index(VerdictEnum.wrong_winner),
+               VERDICTS.index(VerdictEnum.ok),
+               VERDICTS.index(VerdictEnum.wrong_winner),
+               VERDICTS.index(VerdictEnum.forfeit)]
+    return np.select(conditions, choices, default=VERDICTS.index(VerdictEnum.no_line))
+
+
+def winner_code(game: AuditGame) -> int:
+    if(game.winner is None):
+        return 0
+    if(game.winner == game.host):
+        return 1
+    return 2 if game.winner == game.enemy else 3
+
+
+# audit_games returns the verdicts of games in their order, they are scanned stacked by board size and line target
+# and a stack holds up to `max_cells` cells, so large boards are scanned a few at a time
+def audit_games(games: list[AuditGame], max_cells: int = 1 << 24) -> list[tuple[AuditGame, VerdictEnum]]:
+    groups: dict[tuple[int, int, int], list[int]] = {}
+    for i, game in enumerate(games):
+        groups.setdefault((game.height, game.width, game.line_target), []).append(i)
+
+    results: list = [None] * len(games)
+    for (height, width, target), group in groups.items():
+        step = max(1, max_cells // (height * width))
+        for start in range(0, len(group), step):
+            stack = [games[i] for i in group[start:start + step]]
+            codes = np.stack([game.codes() for game in stack]).reshape(len(stack), height, width)
+            winners = np.array([winner_code(game) for game in stack], dtype=np.int8)
+            moves = np.array([game.moves for game in stack], dtype=np.int64)
+            for i, verdict in zip(group[start:start + step], verdicts(line_owners(codes, target), winners, moves)):
+                results[i] = (games[i], VERDICTS[verdict])
+    return results
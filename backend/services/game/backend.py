@@ -0,0 +1,351 @@
+import asyncio
+import json
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# on_message(game_id, message, local) is called once per published event on every worker,
+# local is True when the event was published by this worker
+MessageHandler = Callable[[int, dict, bool], Awaitable[None]]
+# on_gap() is called once events published by other workers may have been missed
+GapHandler = Callable[[], Awaitable[None]]
+
+# NOTIFY payloads must be shorter than 8000 bytes, bigger events are stored in game_event
+MAX_NOTIFY_PAYLOAD = 7900
+EVENTS_CHANNEL = "game_events"
+
+
+class GameSession():
+    """Seats, turn and AI agent of a game, shared by every worker, on a shared backend `moves` counts the claimed moves"""
+    __slots__ = ("game_id", "host", "enemy", "turn", "agent", "moves")
+
+    def __init__(self, game_id: int, host: str, enemy: str | None = None, turn: str | None = None, agent: str | None = None,
+                 moves: int = 0):
+        self.game_id = game_id
+        self.host = host
+        self.enemy = enemy
+        self.turn = turn if turn is not None else host
+        self.agent = agent
+        self.moves = moves
+
+    def can_join(self, player_id: str):
+        return player_id == self.host or player_id == self.enemy
+
+
+class GameBackend(ABC):
+    """
+    Shared state and event fan-out used by GameManager.
+    Every method is a coroutine so implementations are free to keep the state out of process.
+    """
+
+    @abstractmethod
+    async def start(self, on_message: MessageHandler, on_gap: GapHandler | None = None):
+        ...
+
+    @abstractmethod
+    async def stop(self):
+        ...
+
+    @abstractmethod
+    async def register_game(self, game_id: int, host: str):
+        ...
+
+    @abstractmethod
+    async def get_session(self, game_id: int) -> GameSession | None:
+        ...
+
+    # set_enemy fills the enemy seat, returns False if it was taken or player_id is the host
+    @abstractmethod
+    async def set_enemy(self, game_id: int, player_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def register_agent(self, game_id: int, player_id: str):
+        ...
+
+    # advance_turn passes the turn to the other player if it is player_id's turn and counts their move,
+    # returns the new turn and the moves played before that move, so the board it is played on can be checked,
+    # the count is None when the backend is not shared, the boards cached by its only worker are never behind
+    @abstractmethod
+    async def advance_turn(self, game_id: int, player_id: str) -> tuple[str, int | None] | None:
+        ...
+
+    # release_turn gives the turn back to player_id after advance_turn, when their move could not be applied
+    @abstractmethod
+    async def release_turn(self, game_id: int, player_id: str):
+        ...
+
+    # set_turn gives the turn to player_id without counting a move
+    @abstractmethod
+    async def set_turn(self, game_id: int, player_id: str):
+        ...
+
+    @abstractmethod
+    async def active_games(self, game_ids: list[int]) -> set[int]:
+        ...
+
+    # forget drops the session of a finished game once this worker no longer needs it
+    @abstractmethod
+    async def forget(self, game_id: int):
+        ...
+
+    @abstractmethod
+    async def publish(self, game_id: int, message: dict):
+        ...
+
+
+class InMemoryGameBackend(GameBackend):
+    """Single process backend, events are delivered straight to the local listeners"""
+
+    def __init__(self):
+        self.sessions: dict[int, GameSession] = {}
+        self.on_message: MessageHandler | None = None
+
+    async def start(self, on_message: MessageHandler, on_gap: GapHandler | None = None):
+        # events never leave the process, none can be missed
+        self.on_message = on_message
+
+    async def stop(self):
+        self.on_message = None
+
+    async def register_game(self, game_id: int, host: str):
+        if(game_id in self.sessions):
+            return
+        self.sessions[game_id] = GameSession(game_id, host)
+
+    async def get_session(self, game_id: int) -> GameSession | None:
+        return self.sessions.get(game_id)
+
+    async def set_enemy(self, game_id: int, player_id: str) -> bool:
+        session = self.sessions.get(game_id)
+        if(session is None or session.host == player_id or session.enemy is not None):
+            return False
+        session.enemy = player_id
+        return True
+
+    async def register_agent(self, game_id: int, player_id: str):
+        session = self.sessions.get(game_id)
+        if(session is None or session.agent is not None):
+            return
+        session.agent = player_id
+
+    async def advance_turn(self, game_id: int, player_id: str) -> tuple[str, int | None] | None:
+        session = self.sessions.get(game_id)
+        if(session is None or session.turn != player_id or session.enemy is None):
+            return None
+        session.turn = session.host if session.turn == session.enemy else session.enemy
+        return session.turn, None
+
+    async def release_turn(self, game_id: int, player_id: str):
+        await self.set_turn(game_id, player_id)
+
+    async def set_turn(self, game_id: int, player_id: str):
+        session = self.sessions.get(game_id)
+        if(session is not None):
+            session.turn = player_id
+
+    async def active_games(self, game_ids: list[int]) -> set[int]:
+        return {game_id for game_id in game_ids if game_id in self.sessions}
+
+    async def forget(self, game_id: int):
+        self.sessions.pop(game_id, None)
+
+    # publish runs after the change it announces was committed, a failing listener is logged instead of failing the request
+    async def publish(self, game_id: int, message: dict):
+        if(self.on_message is None):
+            return
+        try:
+            await self.on_message(game_id, message, True)
+        except Exception:
+            logger.exception("delivering %s of game %s failed", message.get("type"), game_id)
+
+
+class PostgresGameBackend(GameBackend):
+    """
+    Keeps sessions in the game_session table and fans events out with LISTEN/NOTIFY,
+    so a move handled by one worker reaches the sockets held by any other worker.
+    Events of the same game are delivered in order, events of different games concurrently.
+    """
+
+    def __init__(self, dsn: str, pool_size: int = 5, listen_check_interval: float = 5, max_reconnect_delay: float = 30):
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.listen_check_interval = listen_check_interval
+        self.max_reconnect_delay = max_reconnect_delay
+        self.worker_id = uuid.uuid4().hex
+        self.pool: asyncpg.Pool | None = None
+        self.listener: asyncpg.Connection | None = None
+        self.watchdog: asyncio.Task | None = None
+        self.listener_lost = asyncio.Event()
+        self.on_message: MessageHandler | None = None
+        self.on_gap: GapHandler | None = None
+        self.deliveries: dict[int, asyncio.Task] = {}
+        self.reconnects = 0
+
+    async def start(self, on_message: MessageHandler, on_gap: GapHandler | None = None):
+        self.on_message = on_message
+        self.on_gap = on_gap
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        await self.__listen()
+        self.watchdog = asyncio.create_task(self.__watch())
+
+    async def stop(self):
+        if(self.watchdog is not None):
+            self.watchdog.cancel()
+            await asyncio.gather(self.watchdog, return_exceptions=True)
+            self.watchdog = None
+        if(self.listener is not None):
+            self.listener.remove_termination_listener(self.__on_terminate)
+            await self.listener.close()
+            self.listener = None
+        if(self.pool is not None):
+            await self.pool.close()
+            self.pool = None
+        self.on_message = None
+        self.on_gap = None
+
+    async def register_game(self, game_id: int, host: str):
+        await self.__pool().execute(
+            "INSERT INTO game_session (game_id, host, turn) VALUES ($1, $2, $2) ON CONFLICT DO NOTHING", game_id, host)
+
+    async def get_session(self, game_id: int) -> GameSession | None:
+        row = await self.__pool().fetchrow(
+            "SELECT game_id, host, enemy, turn, agent, moves FROM game_session WHERE game_id = $1", game_id)
+        if(row is None):
+            return None
+        return GameSession(row["game_id"], row["host"], row["enemy"], row["turn"], row["agent"], row["moves"])
+
+    async def set_enemy(self, game_id: int, player_id: str) -> bool:
+        res = await self.__pool().fetchval(
+            "UPDATE game_session SET enemy = $2 WHERE game_id = $1 AND enemy IS NULL AND host <> $2 RETURNING game_id", game_id, player_id)
+        return res is not None
+
+    async def register_agent(self, game_id: int, player_id: str):
+        await self.__pool().execute(
+            "UPDATE game_session SET agent = $2 WHERE game_id = $1 AND agent IS NULL", game_id, player_id)
+
+    async def advance_turn(self, game_id: int, player_id: str) -> tuple[str, int | None] | None:
+        row = await self.__pool().fetchrow(
+            """UPDATE game_session SET turn = CASE WHEN turn = enemy THEN host ELSE enemy END, moves = moves + 1
+            WHERE game_id = $1 AND turn = $2 AND enemy IS NOT NULL RETURNING turn, moves""", game_id, player_id)
+        if(row is None):
+            return None
+        return row["turn"], row["moves"] - 1
+
+    async def release_turn(self, game_id: int, player_id: str):
+        await self.__pool().execute(
+            "UPDATE game_session SET turn = $2, moves = moves - 1 WHERE game_id = $1", game_id, player_id)
+
+    async def set_turn(self, game_id: int, player_id: str):
+        await self.__pool().execute("UPDATE game_session SET turn = $2 WHERE game_id = $1", game_id, player_id)
+
+    async def active_games(self, game_ids: list[int]) -> set[int]:
+        rows = await self.__pool().fetch(
+            "SELECT game_id FROM game_session WHERE game_id = ANY($1::int[])", game_ids)
+        return {row["game_id"] for row in rows}
+
+    async def forget(self, game_id: int):
+        # the rows are shared by every worker, they are deleted when the game is archived
+        pass
+
+    async def publish(self, game_id: int, message: dict):
+        payload = json.dumps({"origin": self.worker_id, "game_id": game_id, "message": message})
+        if(len(payload.encode()) > MAX_NOTIFY_PAYLOAD):
+            async with self.__pool().acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("DELETE FROM game_event WHERE created_at < now() - interval '1 minute'")
+                    event_id = await conn.fetchval(
+                        "INSERT INTO game_event (game_id, message) VALUES ($1, $2) RETURNING event_id", game_id, json.dumps(message))
+            payload = json.dumps({"origin": self.worker_id, "game_id": game_id, "event_id": event_id})
+        await self.__pool().execute("SELECT pg_notify($1, $2)", EVENTS_CHANNEL, payload)
+
+    def __pool(self) -> asyncpg.Pool:
+        if(self.pool is None):
+            raise Exception("PostgresGameBackend was not started")
+        return self.pool
+
+    async def __listen(self):
+        self.listener_lost.clear()
+        listener = await asyncpg.connect(self.dsn)
+        try:
+            await listener.add_listener(EVENTS_CHANNEL, self.__on_notify)
+        except BaseException:
+            listener.terminate()
+            raise
+        listener.add_termination_listener(self.__on_terminate)
+        self.listener = listener
+
+    def __on_terminate(self, connection):
+        self.listener_lost.set()
+
+    # __watch replaces the LISTEN connection when it drops or stops answering,
+    # notifications sent while it was down are lost so on_gap lets the manager drop what they would have updated
+    async def __watch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.listener_lost.wait(), self.listen_check_interval)
+            except asyncio.TimeoutError:
+                try:
+                    await asyncio.wait_for(self.listener.execute("SELECT 1"), self.listen_check_interval)
+                    continue
+                except (asyncio.TimeoutError, OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                    pass
+
+            logger.warning("LISTEN connection lost, reconnecting")
+            self.listener.remove_termination_listener(self.__on_terminate)
+            self.listener.terminate()
+            delay = 0.1
+            while True:
+                try:
+                    await self.__listen()
+                    break
+                except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                    logger.exception("LISTEN reconnect failed, retrying in %.1fs", delay)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+            self.reconnects += 1
+            if(self.on_gap is not None):
+                try:
+                    await self.on_gap()
+                except Exception:
+                    logger.exception("on_gap failed after LISTEN reconnect")
+
+    def __on_notify(self, connection, pid, channel, payload: str):
+        envelope = json.loads(payload)
+        game_id = envelope["game_id"]
+        previous = self.deliveries.get(game_id)
+        task = asyncio.create_task(self.__deliver(previous, envelope))
+        self.deliveries[game_id] = task
+        task.add_done_callback(lambda t: self.__forget(game_id, t))
+
+    def __forget(self, game_id: int, task: asyncio.Task):
+        if(self.deliveries.get(game_id) is task):
+            del self.deliveries[game_id]
+
+    async def __deliver(self, previous: asyncio.Task | None, envelope: dict):
+        if(previous is not None):
+            await asyncio.wait([previous])
+        if(self.on_message is None):
+            return
+
+        message = envelope.get("message")
+        if(message is None):
+            raw = await self.__pool().fetchval("SELECT message FROM game_event WHERE event_id = $1", envelope["event_id"])
+            if(raw is None):
+                return
+            message = json.loads(raw)
+        try:
+            await self.on_message(envelope["game_id"], message, envelope["origin"] == self.worker_id)
+        except Exception:
+            logger.exception("delivering %s of game %s failed", message.get("type"), envelope["game_id"])
+
+
+def create_backend(name: str, dsn: str) -> GameBackend:
+    if(name == "postgres"):
+        return PostgresGameBackend(dsn)
+    return InMemoryGameBackend()
@@ -0,0 +1,97 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from services.game.engine import Board
+from services.game.schemas import GameInfo
+
+
+class Snapshot():
+    """A serialized view of a game, shared as is by every read until the game changes, `etag` identifies its body"""
+    __slots__ = ("seq", "body", "etag")
+
+    def __init__(self, seq: int, body: str):
+        self.seq = seq
+        self.body = body
+        self.etag = f'"{hashlib.blake2b(body.encode(), digest_size=12).hexdigest()}"'
+
+
+class GameState():
+    """
+    Cached metadata and board of a single game, `version` is bumped every time the state changes.
+    `snapshots` holds the serialized views of the current version, they are dropped by touch.
+    """
+    __slots__ = ("info", "board", "version", "last_access", "snapshots")
+
+    def __init__(self, info: GameInfo, board: Board):
+        self.info = info
+        self.board = board
+        self.version = 0
+        self.last_access = time.monotonic()
+        self.snapshots: dict[str, Snapshot] = {}
+
+    def touch(self):
+        self.version += 1
+        self.snapshots = {}
+
+
+class GameStateCache():
+    """
+    Bounded LRU cache of GameState keyed by game_id.
+    Entries not read for `idle_ttl` seconds are dropped on access, a ttl of 0 disables idle eviction.
+    """
+
+    def __init__(self, max_size: int = 1024, idle_ttl: float = 0):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.entries: OrderedDict[int, GameState] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.snapshot_hits = 0
+        self.snapshot_builds = 0
+
+    def get(self, game_id: int) -> GameState | None:
+        state = self.entries.get(game_id)
+        now = time.monotonic()
+        if(state is not None and self.idle_ttl and now - state.last_access > self.idle_ttl):
+            del self.entries[game_id]
+            self.evictions += 1
+            state = None
+
+        if(state is None):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        state.last_access = now
+        self.entries.move_to_end(game_id)
+        return state
+
+    # peek reads an entry without counting it as a hit or miss nor refreshing its position
+    def peek(self, game_id: int) -> GameState | None:
+        return self.entries.get(game_id)
+
+    def put(self, game_id: int, state: GameState):
+        self.entries[game_id] = state
+        self.entries.move_to_end(game_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, game_id: int):
+        self.entries.pop(game_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "snapshot_hits": self.snapshot_hits,
+            "snapshot_builds": self.snapshot_builds,
+        }
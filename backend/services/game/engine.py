@@ -0,0 +1,289 @@
+import struct
+from typing import Iterable
+
+from env import SPARSE_BOARD_CELLS
+from services.game.schemas import PlayDirectionEnum, PlayerMove
+
+# (dx, dy) pairs walked from the last placed tile, the opposite side is walked with (-dx, -dy)
+WIN_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+class SparseCells(dict[int, str | None]):
+    """Cell index -> value of the occupied cells, reading an empty cell returns None without storing it"""
+
+    def __missing__(self, key: int) -> None:
+        return None
+
+
+class Board():
+    """
+    Flat array backed board. Row `x` occupies cells[x * width:(x + 1) * width].
+
+    Tiles played from the left slide until they hit the right edge (or another tile),
+    tiles played from the right slide until they hit the left edge, so every row is
+    described by two fill counters and a move is mapped to its cell in O(1).
+    """
+    __slots__ = ("width", "height", "line_target", "winner", "moves", "cells", "left_fill", "right_fill")
+    # the methods reading cells as a list are overridden by SparseBoard
+    cells: list[str | None] | SparseCells
+
+    def __init__(self, width: int, height: int, line_target: int, winner: str | None = None):
+        self.width = width
+        self.height = height
+        self.line_target = line_target
+        self.winner = winner
+        self.moves = 0
+        self.cells = [None] * (width * height)
+        self.left_fill = [0] * height
+        self.right_fill = [0] * height
+
+    @classmethod
+    def from_tiles(cls, width: int, height: int, line_target: int, tiles: Iterable[tuple[int, int, str]], winner: str | None = None):
+        board = cls(width, height, line_target, winner)
+        for x, y, value in tiles:
+            board.cells[x * width + y] = value
+        board.recount()
+        return board
+
+    @classmethod
+    def from_game(cls, game):
+        return cls.from_tiles(game.width, game.height, game.line_target,
+                              ((tile.x, tile.y, tile.value) for tile in game.tiles), game.winner)
+
+    # unpack reverses pack, `moves` is the number of moves the snapshot was taken at
+    @classmethod
+    def unpack(cls, data: bytes, width: int, height: int, line_target: int, players: tuple[str, str | None], moves: int, winner: str | None = None):
+        board = cls(width, height, line_target, winner)
+        for i in range(width * height):
+            code = (data[(i >> 2) + 1] >> ((i & 3) << 1)) & 3
+            if(code):
+                board.cells[i] = players[code - 1]
+        board.recount()
+        board.moves = moves
+        return board
+
+    # pack writes DENSE_FORMAT then every cell in 2 bits, 0 for empty, 1 for players[0] and 2 for players[1]
+    def pack(self, players: tuple[str, str | None]) -> bytes:
+        data = bytearray(1 + ((len(self.cells) + 3) >> 2))
+        data[0] = DENSE_FORMAT
+        for i, value in enumerate(self.cells):
+            if(value is None):
+                continue
+            code = 1 if value == players[0] else 2
+            data[(i >> 2) + 1] |= code << ((i & 3) << 1)
+        return bytes(data)
+
+    # recount rebuilds the fill counters and move count from the cells
+    def recount(self):
+        width = self.width
+        self.moves = 0
+        for x in range(self.height):
+            offset = x * width
+            right = 0
+            while right < width and self.cells[offset + right] is not None:
+                right += 1
+            left = 0
+            if(right < width):
+                while left < width and self.cells[offset + width - 1 - left] is not None:
+                    left += 1
+            self.right_fill[x] = right
+            self.left_fill[x] = left
+            self.moves += right + left
+
+    def is_row_full(self, row: int):
+        return self.left_fill[row] + self.right_fill[row] >= self.width
+
+    def map_move(self, row: int, direction: PlayDirectionEnum) -> tuple[int, int] | None:
+        if(row < 0 or row >= self.height or self.is_row_full(row)):
+            return None
+
+        if(direction == PlayDirectionEnum.left):
+            return row, self.width - 1 - self.left_fill[row]
+        return row, self.right_fill[row]
+
+    def place(self, row: int, direction: PlayDirectionEnum, value: str) -> tuple[int, int] | None:
+        coordinate = self.map_move(row, direction)
+        if(coordinate is None):
+            return None
+
+        x, y = coordinate
+        self.cells[x * self.width + y] = value
+        if(direction == PlayDirectionEnum.left):
+            self.left_fill[row] += 1
+        else:
+            self.right_fill[row] += 1
+        self.moves += 1
+        return coordinate
+
+    # undo reverts the last tile placed on `row` from `direction`, used when persisting a move fails
+    def undo(self, row: int, direction: PlayDirectionEnum):
+        if(direction == PlayDirectionEnum.left):
+            self.left_fill[row] -= 1
+            y = self.width - 1 - self.left_fill[row]
+        else:
+            self.right_fill[row] -= 1
+            y = self.right_fill[row]
+        self.cells[row * self.width + y] = None
+        self.moves -= 1
+
+    def get(self, x: int, y: int):
+        return self.cells[x * self.width + y]
+
+    # row_tiles yields the columns of row x between y0 and y1 that hold a tile, read from the fill counters
+    def row_tiles(self, x: int, y0: int = 0, y1: int | None = None) -> Iterable[int]:
+        y1 = self.width if y1 is None else min(y1, self.width)
+        yield from range(max(y0, 0), min(self.right_fill[x], y1))
+        yield from range(max(y0, self.width - self.left_fill[x], self.right_fill[x]), y1)
+
+    # tiles returns the (x, y, value) of every tile in rows [x0, x1) and columns [y0, y1), all of them by default
+    def tiles(self, x0: int = 0, x1: int | None = None, y0: int = 0, y1: int | None = None) -> list[tuple[int, int, str]]:
+        x1 = self.height if x1 is None else min(x1, self.height)
+        return [(x, y, self.get(x, y)) for x in range(max(x0, 0), x1) for y in self.row_tiles(x, y0, y1)]
+
+    # valid_move_cells maps every valid move to its cell, as {"x", "type", "y"} like the old valid moves query
+    def valid_move_cells(self) -> list[dict]:
+        moves = []
+        for row in range(self.height):
+            if(self.is_row_full(row)):
+                continue
+            moves.append({"x": row, "type": PlayDirectionEnum.left.value, "y": self.width - 1 - self.left_fill[row]})
+            moves.append({"x": row, "type": PlayDirectionEnum.right.value, "y": self.right_fill[row]})
+        return moves
+
+    def valid_moves(self) -> list[PlayerMove]:
+        moves = []
+        for row in range(self.height):
+            if(self.is_row_full(row)):
+                continue
+            moves.append(PlayerMove(row=row, direction=PlayDirectionEnum.left))
+            moves.append(PlayerMove(row=row, direction=PlayDirectionEnum.right))
+        return moves
+
+    # check_win only looks at the lines crossing (x, y), same result shape as utils.check_grid
+    def check_win(self, x: int, y: int):
+        value = self.cells[x * self.width + y]
+        if(value is None):
+            return False, 0
+
+        max_count = 1
+        for dx, dy in WIN_DIRECTIONS:
+            count = 1 + self.__count(value, x, y, dx, dy) + self.__count(value, x, y, -dx, -dy)
+            if(count > max_count):
+                max_count = count
+            if(max_count >= self.line_target):
+                break
+
+        return max_count >= self.line_target, max_count
+
+    def __count(self, value: str, x: int, y: int, dx: int, dy: int):
+        count = 0
+        next_x = x + dx
+        next_y = y + dy
+        while (count < self.line_target - 1 and 0 <= next_x < self.height and 0 <= next_y < self.width
+               and self.cells[next_x * self.width + next_y] == value):
+            count += 1
+            next_x += dx
+            next_y += dy
+        return count
+
+    def to_list(self) -> list[list[str | None]]:
+        cells = self.cells
+        if(isinstance(cells, SparseCells)):
+            raise TypeError("SparseBoard overrides to_list")
+        return [cells[x * self.width:(x + 1) * self.width] for x in range(self.height)]
+
+
+class SparseBoard(Board):
+    """
+    Board for large grids, only the occupied cells are stored, see board_class.
+    Moves, win checks and reads go through the per-row fill counters, so nothing scans the grid,
+    to_list is the only dense read and is not used for these boards.
+    """
+    __slots__ = ()
+    cells: SparseCells
+
+    def __init__(self, width: int, height: int, line_target: int, winner: str | None = None):
+        self.width = width
+        self.height = height
+        self.line_target = line_target
+        self.winner = winner
+        self.moves = 0
+        self.cells = SparseCells()
+        self.left_fill = [0] * height
+        self.right_fill = [0] * height
+
+    # unpack reverses pack, `moves` is the number of moves the snapshot was taken at
+    @classmethod
+    def unpack(cls, data: bytes, width: int, height: int, line_target: int, players: tuple[str, str | None], moves: int, winner: str | None = None):
+        board = cls(width, height, line_target, winner)
+        for packed, in SPARSE_TILE.iter_unpack(data[1:]):
+            board.cells[packed >> 2] = players[(packed & 3) - 1]
+        board.recount()
+        board.moves = moves
+        return board
+
+    # pack writes SPARSE_FORMAT then every tile as its cell index shifted by 2 bits, or'ed with 1 for players[0] and 2 for players[1]
+    def pack(self, players: tuple[str, str | None]) -> bytes:
+        return bytes((SPARSE_FORMAT,)) + b"".join(SPARSE_TILE.pack(i << 2 | (1 if value == players[0] else 2))
+                                                  for i, value in sorted(self.cells.items()))
+
+    def recount(self):
+        width = self.width
+        rows: dict[int, set[int]] = {}
+        for i in self.cells:
+            rows.setdefault(i // width, set()).add(i % width)
+        self.left_fill = [0] * self.height
+        self.right_fill = [0] * self.height
+        self.moves = 0
+        for x, columns in rows.items():
+            right = 0
+            while right < width and right in columns:
+                right += 1
+            left = 0
+            if(right < width):
+                while left < width and width - 1 - left in columns:
+                    left += 1
+            self.right_fill[x] = right
+            self.left_fill[x] = left
+            self.moves += right + left
+
+    def undo(self, row: int, direction: PlayDirectionEnum):
+        super().undo(row, direction)
+        self.cells.pop(row * self.width + (self.right_fill[row] if direction == PlayDirectionEnum.right
+                                            else self.width - 1 - self.left_fill[row]), None)
+
+    def to_list(self) -> list[list[str | None]]:
+        grid: list[list[str | None]] = [[None] * self.width for _ in range(self.height)]
+        for x, y, value in self.tiles():
+            grid[x][y] = value
+        return grid
+
+
+# a tile of SparseBoard.pack
+SPARSE_TILE = struct.Struct("<Q")
+
+# first byte of a packed board, the board is read back by its format even after SPARSE_BOARD_CELLS changed
+DENSE_FORMAT = 0
+SPARSE_FORMAT = 1
+PACKED_FORMATS: dict[int, type[Board]] = {DENSE_FORMAT: Board, SPARSE_FORMAT: SparseBoard}
+
+
+# board_class picks the board of a game, grids above SPARSE_BOARD_CELLS cells only store their tiles
+def board_class(width: int, height: int) -> type[Board]:
+    return SparseBoard if width * height > SPARSE_BOARD_CELLS else Board
+
+
+def create_board(width: int, height: int, line_target: int, winner: str | None = None) -> Board:
+    return board_class(width, height)(width, height, line_target, winner)
+
+
+# unpack_board reads a board packed by Board.pack or SparseBoard.pack with the board its format byte names
+def unpack_board(data: bytes, width: int, height: int, line_target: int, players: tuple[str, str | None], moves: int, winner: str | None = None) -> Board:
+    board_type = PACKED_FORMATS.get(data[0]) if len(data) > 0 else None
+    if(board_type is None):
+        raise ValueError(f"unknown packed board format {data[:1]!r}")
+    return board_type.unpack(data, width, height, line_target, players, moves, winner)
+
+
+def is_sparse(board: Board) -> bool:
+    return isinstance(board, SparseBoard)
@@ -12,8 +12,22 @@ class GameNotFound(Exception):
         self.message = f"Provide game was not found"
         super().__init__(self.message)
 
+class StaleGameException(Exception):
+    def __init__(self, game_id: int):
+        self.game_id = game_id
+        self.message = f"Provide game was changed by another move, try again"
+        super().__init__(self.message)
+
 class GameFullException(Exception):
     def __init__(self, game_id: int):
         self.game_id = game_id
         self.message = f"Provide game is already full"
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, retry_after: int, message: str):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+from enum import Enum
+from typing import Any, AsyncIterator, Callable
+
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.game.engine import Board, is_sparse, unpack_board
+from services.game.models import Game, GameArchive
+
+
+class ExportFormatEnum(str, Enum):
+    # one json object per line
+    jsonl = 'jsonl'
+    # one row per game with a header, the board and tiles columns hold json
+    csv = 'csv'
+
+
+class ExportLayoutEnum(str, Enum):
+    # the occupied cells as [x, y, player]
+    tiles = 'tiles'
+    # the dense board as in the `game` event, sparse boards are sent as tiles like board_status does
+    board = 'board'
+
+
+CSV_COLUMNS = ("game_id", "width", "height", "line_target", "host", "enemy", "winner", "finished_at",
+               "moves", "archived", "board", "tiles")
+
+
+class ExportFilter():
+    """Games to export: ids in (`after`, `until`], won by `winner`, played by `player` as host or enemy"""
+    __slots__ = ("after", "until", "winner", "player")
+
+    def __init__(self, after: int = 0, until: int | None = None, winner: str | None = None, player: str | None = None):
+        self.after = after
+        self.until = until
+        self.winner = winner
+        self.player = player
+
+    # where lists the conditions on `model`, Game or GameArchive, for the games after the `after` checkpoint
+    def where(self, model, after: int) -> list:
+        conditions = [model.game_id > after]
+        if(self.until is not None):
+            conditions.append(model.game_id <= self.until)
+        if(self.winner is not None):
+            conditions.append(model.winner == self.winner)
+        if(self.player is not None):
+            conditions.append(or_(model.host == self.player, model.enemy == self.player))
+        return conditions
+
+
+# export_batches yields the records of the games matching `filters` in game_id order, `batch_size` games at a time
+# every batch is read by its own short read-only transaction of `sessions` from game, with the boards of `storage`,
+# and from game_archive, the game_id of the last record of a batch is the checkpoint to resume after it
+async def export_batches(sessions: Callable[[], AsyncSession], storage, filters: ExportFilter, layout: ExportLayoutEnum,
+                         batch_size: int) -> AsyncIterator[list[dict]]:
+    after = filters.after
+    while True:
+        async with sessions() as db:
+            # both tables and the tiles are read from the same snapshot, a game archived meanwhile is seen once
+            await db.connection(execution_options={"isolation_level": "REPEATABLE READ", "postgresql_readonly": True})
+            records = await read_batch(db, storage, filters, layout, after, batch_size)
+            await db.rollback()
+        if(len(records) > 0):
+            yield records
+        if(len(records) < batch_size):
+            return
+        after = records[-1]["game_id"]
+
+
+# select_games returns the first batch_size games after `after` of game and game_archive, as (game_id, row, archived)
+async def select_games(db: AsyncSession, filters: ExportFilter, after: int, batch_size: int) -> list[tuple[int, Any, bool]]:
+    res = await db.execute(select(Game).where(*filters.where(Game, after)).order_by(Game.game_id).limit(batch_size))
+    games = res.scalars().all()
+    res = await db.execute(select(GameArchive).where(*filters.where(GameArchive, after))
+                           .order_by(GameArchive.game_id).limit(batch_size))
+    archived = res.scalars().all()
+    return sorted([(game.game_id, game, False) for game in games] + [(game.game_id, game, True) for game in archived],
+                  key=lambda item: item[0])[:batch_size]
+
+
+async def read_batch(db: AsyncSession, storage, filters: ExportFilter, layout: ExportLayoutEnum, after: int, batch_size: int) -> list[dict]:
+    selected = await select_games(db, filters, after, batch_size)
+    live = [game for _, game, is_archived in selected if not is_archived]
+    boards = await storage.load_boards(db, live) if len(live) > 0 else {}
+
+    records = []
+    for game_id, game, is_archived in selected:
+        if(is_archived):
+            board = unpack_board(game.board, game.width, game.height, game.line_target,
+                                 (game.host, game.enemy), game.moves, game.winner)
+        else:
+            board = boards[game_id]
+        records.append(game_record(game, board, is_archived, layout))
+    return records
+
+
+def game_record(game, board: Board, archived: bool, layout: ExportLayoutEnum) -> dict:
+    record = {
+        "game_id": game.game_id,
+        "width": game.width,
+        "height": game.height,
+        "line_target": game.line_target,
+        "host": game.host,
+        "enemy": game.enemy,
+        "winner": game.winner,
+        "finished_at": None if game.finished_at is None else game.finished_at.isoformat(),
+        "moves": board.moves,
+        "archived": archived,
+    }
+    if(layout == ExportLayoutEnum.board and not is_sparse(board)):
+        record["board"] = board.to_list()
+    else:
+        if(layout == ExportLayoutEnum.board):
+            record["board"] = None
+        record["tiles"] = [list(tile) for tile in board.tiles()]
+    return record
+
+
+# format_records serializes a batch of records, the csv header is only written when `header` is set
+def format_records(records: list[dict], format: ExportFormatEnum, header: bool = False) -> str:
+    if(format == ExportFormatEnum.jsonl):
+        return "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    if(header):
+        writer.writerow(CSV_COLUMNS)
+    for record in records:
+        writer.writerow([json.dumps(record[column], separators=(",", ":")) if column in ("board", "tiles") and column in record
+                         else "" if record.get(column) is None else record[column] for column in CSV_COLUMNS])
+    return out.getvalue()
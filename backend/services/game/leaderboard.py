@@ -0,0 +1,60 @@
+import asyncio
+import time
+from bisect import bisect_left, insort
+
+from services.game.schemas import PlayerStats
+
+
+class Leaderboard():
+    """
+    The `size` players with the most wins, sorted by wins then player, loaded from player_stats.
+    Wins and losses of the games finished since are applied to the players on the board, their other counts
+    and players climbing from outside of it are read when it is reloaded, every `refresh_interval` seconds.
+    A load also has the games finished up to `recent_window` seconds before it, their results can be delivered
+    after the load already counted them and are skipped.
+    """
+
+    def __init__(self, size: int, refresh_interval: float, recent_window: float = 60):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.recent_window = recent_window
+        self.players: dict[str, PlayerStats] = {}
+        # (-wins, player) of every player on the board
+        self.order: list[tuple[int, str]] = []
+        # game_id of the recent games counted by the load
+        self.counted: set[int] = set()
+        self.loaded_at: float | None = None
+        self.lock = asyncio.Lock()
+        self.reloads = 0
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_interval
+
+    # replace loads the board, `counted` has the games finished recently that are included in `players`
+    def replace(self, players: list[PlayerStats], counted: set[int]):
+        self.players = {stats.player: stats for stats in players}
+        self.counted = counted
+        self.order = sorted((-stats.wins, stats.player) for stats in players)
+        self.loaded_at = time.monotonic()
+        self.reloads += 1
+
+    def record_result(self, game_id: int, winner: str, loser: str | None):
+        if(game_id in self.counted):
+            return
+        stats = self.players.get(winner)
+        if(stats is not None):
+            del self.order[bisect_left(self.order, (-stats.wins, winner))]
+            stats.wins += 1
+            insort(self.order, (-stats.wins, winner))
+        elif(len(self.order) < self.size):
+            # a board with room left holds every player, the winner is new and it is reloaded on the next read
+            self.loaded_at = None
+        stats = None if loser is None else self.players.get(loser)
+        if(stats is not None):
+            stats.losses += 1
+
+    def top(self, limit: int) -> list[PlayerStats]:
+        return [self.players[player] for _, player in self.order[:limit]]
+
+    def __len__(self):
+        return len(self.order)
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+# kinds of the timers a game has on the wheel
+IDLE = 0
+TURN = 1
+
+
+class TimerWheel():
+    """
+    Hierarchical timing wheel of keyed timers, ticked every `resolution` seconds.
+    Level 0 has a slot per tick, each next level has a slot per full turn of the one below it, so
+    `levels` levels of `2 ** bits` slots cover 2 ** (bits * levels) ticks and timers further away wait
+    in the last level. Scheduling, rescheduling and cancelling are O(1), a tick only visits the timers
+    of its slot, timers of the upper levels move down a level when the slots below them come around.
+    """
+
+    def __init__(self, resolution: float, bits: int = 6, levels: int = 4):
+        self.resolution = resolution
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.slots: list[list[set]] = [[set() for _ in range(1 << bits)] for _ in range(levels)]
+        # key -> (deadline tick, level, slot)
+        self.timers: dict[Hashable, tuple[int, int, int]] = {}
+        self.origin = time.monotonic()
+        self.tick = 0
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key: Hashable):
+        return key in self.timers
+
+    # schedule (re)arms the timer of `key` to expire in `delay` seconds
+    def schedule(self, key: Hashable, delay: float):
+        self.cancel(key)
+        self.__place(key, self.tick + max(1, math.ceil(delay / self.resolution)))
+
+    def cancel(self, key: Hashable):
+        timer = self.timers.pop(key, None)
+        if(timer is not None):
+            self.slots[timer[1]][timer[2]].discard(key)
+
+    # advance moves the wheel up to `now` and returns the keys of the timers that expired, in order
+    def advance(self, now: float) -> list:
+        target = int((now - self.origin) / self.resolution)
+        expired: list = []
+        if(len(self.timers) == 0):
+            self.tick = max(self.tick, target)
+            return expired
+        while self.tick < target:
+            self.tick += 1
+            # upper levels first, their timers can land in the lower slots reached by this same tick
+            for level in range(self.levels - 1, 0, -1):
+                if(self.tick & ((1 << (self.bits * level)) - 1) == 0):
+                    self.__cascade(level, (self.tick >> (self.bits * level)) & self.mask, expired)
+            bucket = self.slots[0][self.tick & self.mask]
+            if(len(bucket) > 0):
+                self.slots[0][self.tick & self.mask] = set()
+                for key in bucket:
+                    del self.timers[key]
+                expired.extend(bucket)
+        return expired
+
+    def __cascade(self, level: int, slot: int, expired: list):
+        bucket = self.slots[level][slot]
+        if(len(bucket) == 0):
+            return
+        self.slots[level][slot] = set()
+        for key in bucket:
+            deadline = self.timers.pop(key)[0]
+            if(deadline <= self.tick):
+                expired.append(key)
+            else:
+                self.__place(key, deadline)
+
+    def __place(self, key: Hashable, deadline: int):
+        delta = deadline - self.tick
+        level = 0
+        while level < self.levels - 1 and delta >> (self.bits * (level + 1)) > 0:
+            level += 1
+        # beyond the range of the wheel, the timer waits in the farthest slot and is placed again from there
+        slot_tick = min(deadline, self.tick + (1 << (self.bits * self.levels)) - 1)
+        slot = (slot_tick >> (self.bits * level)) & self.mask
+        self.slots[level][slot].add(key)
+        self.timers[key] = (deadline, level, slot)
+
+
+class GameLifecycle():
+    """
+    Lifetime of the per-game state a worker keeps, on a single TimerWheel ticked by one task.
+    Every game seen by the worker has an idle timer, re-armed by each of its events: once a game had no
+    activity for `idle_ttl` seconds, or `finished_ttl` once it has a winner, `evict(game_id, finished)` drops
+    its state and returns False when sockets are still connected, the timer is then re-armed.
+    With a `turn_timeout`, the player on turn has that many seconds to move, `expire_turn(game_id, player_id, seq)`
+    runs when they did not, a ttl or timeout of 0 disables it.
+    """
+
+    def __init__(self, idle_ttl: float, finished_ttl: float, turn_timeout: float, resolution: float,
+                 evict: Callable[[int, bool], Awaitable[bool]], expire_turn: Callable[[int, str, int], Awaitable[None]]):
+        self.idle_ttl = idle_ttl
+        self.finished_ttl = finished_ttl
+        self.turn_timeout = turn_timeout
+        self.wheel = TimerWheel(resolution)
+        self.evict = evict
+        self.expire_turn = expire_turn
+        self.finished: set[int] = set()
+        # game_id -> (player on turn, moves played when the turn started)
+        self.turns: dict[int, tuple[str, int]] = {}
+        self.task: asyncio.Task | None = None
+        self.expiring: set[asyncio.Task] = set()
+        self.evictions = 0
+        self.expired_turns = 0
+
+    def start(self):
+        if(self.task is None):
+            self.wheel.advance(time.monotonic())
+            self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if(self.task is not None):
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    # touch re-arms the idle timer of a game after any activity
+    def touch(self, game_id: int):
+        ttl = self.finished_ttl if game_id in self.finished else self.idle_ttl
+        if(ttl > 0):
+            self.wheel.schedule((IDLE, game_id), ttl)
+
+    # start_turn runs the clock of `player_id`, who has to move from `seq` moves played
+    def start_turn(self, game_id: int, player_id: str, seq: int):
+        if(self.turn_timeout <= 0):
+            return
+        self.turns[game_id] = (player_id, seq)
+        self.wheel.schedule((TURN, game_id), self.turn_timeout)
+
+    def finish(self, game_id: int):
+        if(self.finished_ttl > 0):
+            self.finished.add(game_id)
+        self.__stop_turn(game_id)
+        self.touch(game_id)
+
+    def __stop_turn(self, game_id: int):
+        if(self.turns.pop(game_id, None) is not None):
+            self.wheel.cancel((TURN, game_id))
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.wheel.resolution)
+            for kind, game_id in self.wheel.advance(time.monotonic()):
+                if(kind == IDLE):
+                    await self.__expire_idle(game_id)
+                else:
+                    player_id, seq = self.turns.pop(game_id)
+                    self.expired_turns += 1
+                    # run apart so a slow database does not hold the clocks of the other games
+                    task = asyncio.create_task(self.__expire_turn(game_id, player_id, seq))
+                    self.expiring.add(task)
+                    task.add_done_callback(self.expiring.discard)
+
+    async def __expire_idle(self, game_id: int):
+        if(not await self.evict(game_id, game_id in self.finished)):
+            self.touch(game_id)
+            return
+        self.evictions += 1
+        self.finished.discard(game_id)
+
+    async def __expire_turn(self, game_id: int, player_id: str, seq: int):
+        try:
+            await self.expire_turn(game_id, player_id, seq)
+        except Exception:
+            logger.exception("expiring the turn of %s in game %s failed", player_id, game_id)
@@ -0,0 +1,33 @@
+from bisect import bisect_left, bisect_right, insort
+
+from services.game.schemas import GameInfo
+
+
+class LobbyIndex():
+    """Open games, the ones still waiting for an enemy, kept sorted by game_id for keyset pagination"""
+
+    def __init__(self):
+        self.games: dict[int, GameInfo] = {}
+        self.ids: list[int] = []
+
+    def add(self, game: GameInfo) -> bool:
+        if(game.game_id in self.games or game.enemy is not None or game.winner is not None):
+            return False
+        self.games[game.game_id] = game
+        insort(self.ids, game.game_id)
+        return True
+
+    def remove(self, game_id: int) -> GameInfo | None:
+        game = self.games.pop(game_id, None)
+        if(game is None):
+            return None
+        del self.ids[bisect_left(self.ids, game_id)]
+        return game
+
+    # page returns up to `limit` open games with a game_id greater than `after`
+    def page(self, after: int, limit: int) -> list[GameInfo]:
+        start = bisect_right(self.ids, after)
+        return [self.games[game_id] for game_id in self.ids[start:start + limit]]
+
+    def __len__(self):
+        return len(self.ids)
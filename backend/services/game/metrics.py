@@ -0,0 +1,127 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Callable
+
+# seconds, from a tenth of a millisecond to ten seconds
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram():
+    """Cumulative bucket counts of a value, optionally split by the value of a single label"""
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = TIME_BUCKETS, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        # label value -> [count per bucket plus +Inf, sum]
+        self.series: dict[str | None, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, label: str | None = None):
+        series = self.series.get(label)
+        if(series is None):
+            series = self.series[label] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    # time observes the seconds spent in the with block
+    def time(self, label: str | None = None):
+        return Timer(self, label)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label, (counts, total) in self.series.items():
+            labels = "" if label is None else f'{self.label}="{label}",'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {cumulative}')
+            suffix = "" if label is None else "{" + labels[:-1] + "}"
+            lines.append(f"{self.name}_sum{suffix} {total[0]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Timer():
+    __slots__ = ("histogram", "label", "start")
+
+    def __init__(self, histogram: Histogram, label: str | None):
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.label)
+
+
+class Sampled():
+    """Gauge or counter read from `value` when the metrics are scraped, so it costs nothing in between"""
+
+    def __init__(self, name: str, help: str, kind: str, value: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.value = value
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.value()}"]
+
+
+class Registry():
+    def __init__(self):
+        self.metrics: dict[str, Histogram | Sampled] = {}
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...] = TIME_BUCKETS, label: str | None = None) -> Histogram:
+        histogram = Histogram(name, help, buckets, label)
+        self.metrics[name] = histogram
+        return histogram
+
+    def gauge(self, name: str, help: str, value: Callable[[], float]):
+        self.metrics[name] = Sampled(name, help, "gauge", value)
+
+    def counter(self, name: str, help: str, value: Callable[[], float]):
+        self.metrics[name] = Sampled(name, help, "counter", value)
+
+    # render returns the metrics in the prometheus text exposition format
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class TimedLock():
+    """Wraps an asyncio.Lock to observe how long it is waited for and held"""
+    __slots__ = ("lock", "acquired")
+
+    def __init__(self, lock: asyncio.Lock):
+        self.lock = lock
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        await self.lock.acquire()
+        self.acquired = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(self.acquired - start)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.lock.release()
+        LOCK_HOLD_SECONDS.observe(time.perf_counter() - self.acquired)
+
+
+registry = Registry()
+
+MOVE_STAGE_SECONDS = registry.histogram("game_move_stage_seconds", "Time spent in each stage of applying a move", label="stage")
+LOCK_WAIT_SECONDS = registry.histogram("game_lock_wait_seconds", "Time spent waiting for a game lock")
+LOCK_HOLD_SECONDS = registry.histogram("game_lock_hold_seconds", "Time a game lock is held")
+BROADCAST_SECONDS = registry.histogram("game_broadcast_seconds", "Time spent sending an event to the websockets of a game")
+BROADCAST_RECIPIENTS = registry.histogram("game_broadcast_recipients", "Websockets an event is sent to", SIZE_BUCKETS)
+BROADCAST_BYTES = registry.histogram("game_broadcast_bytes", "Bytes serialized for an event, once per frame format", BYTE_BUCKETS)
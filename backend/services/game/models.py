@@ -1,5 +1,5 @@
-from sqlalchemy import CheckConstraint, Column, ForeignKeyConstraint, Integer, Text, UniqueConstraint, text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, CheckConstraint, Column, DateTime, ForeignKey, ForeignKeyConstraint, Integer, LargeBinary, Text, UniqueConstraint, text
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -18,6 +18,12 @@ class Game(Base):
     host = Column(Text, nullable=False)
     enemy = Column(Text, nullable=True)
     winner = Column(Text, nullable=True)
+    snapshot = deferred(Column(LargeBinary, nullable=True))
+    snapshot_seq = Column(Integer, nullable=False, server_default=text("0"))
+    # set by the game_finished_at trigger when the winner is set
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # the enemy seat was taken by an AI agent, see turn_game_into_ai
+    enemy_bot = Column(Boolean, nullable=False, server_default=text("false"))
 
     tiles = relationship('GameTile', back_populates='game')
 
@@ -26,7 +32,7 @@ class GameTile(Base):
     __tablename__ = 'game_tile'
     __table_args__ = (
         CheckConstraint(
-            '(x < game_width) AND (x >= 0) AND (y < game_height) AND (y >= 0)'),
+            '(x < game_height) AND (x >= 0) AND (y < game_width) AND (y >= 0)'),
         ForeignKeyConstraint(['game_id', 'game_width', 'game_height'], [
                              'game.game_id', 'game.width', 'game.height'])
     )
@@ -40,3 +46,44 @@ class GameTile(Base):
     value = Column(Text, nullable=False)
 
     game = relationship('Game', back_populates='tiles')
+
+
+class GameMove(Base):
+    __tablename__ = 'game_move'
+    __table_args__ = (
+        CheckConstraint("direction IN ('left', 'right')"),
+    )
+
+    game_id = Column(Integer, ForeignKey('game.game_id'), primary_key=True, nullable=False)
+    seq = Column(Integer, primary_key=True, nullable=False)
+    player = Column(Text, nullable=False)
+    row = Column(Integer, nullable=False)
+    direction = Column(Text, nullable=False)
+
+
+class GameArchive(Base):
+    """A finished game moved out of game by services.game.archive, the final board is packed as in Board.pack"""
+    __tablename__ = 'game_archive'
+
+    game_id = Column(Integer, primary_key=True, nullable=False)
+    finished_at = Column(DateTime(timezone=True), primary_key=True, nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    line_target = Column(Integer, nullable=False)
+    host = Column(Text, nullable=False)
+    enemy = Column(Text, nullable=True)
+    winner = Column(Text, nullable=True)
+    moves = Column(Integer, nullable=False)
+    board = Column(LargeBinary, nullable=False)
+
+
+class PlayerStats(Base):
+    """Aggregates of a player, kept by the game_player_stats trigger as seats are taken and winners set"""
+    __tablename__ = 'player_stats'
+
+    player = Column(Text, primary_key=True, nullable=False)
+    games = Column(Integer, nullable=False, server_default=text("0"))
+    wins = Column(Integer, nullable=False, server_default=text("0"))
+    losses = Column(Integer, nullable=False, server_default=text("0"))
+    in_progress = Column(Integer, nullable=False, server_default=text("0"))
+    bot_games = Column(Integer, nullable=False, server_default=text("0"))
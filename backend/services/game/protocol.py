@@ -0,0 +1,103 @@
+import asyncio
+import struct
+from enum import Enum
+
+from fastapi import WebSocket
+
+from services.game.schemas import Viewport
+
+
+class ProtocolEnum(str, Enum):
+    # full sends the whole board on every move, as the original `game` event, moves of sparse boards are sent as with delta
+    full = 'full'
+    # delta sends `move` events with the placed tile and a per-game sequence number
+    delta = 'delta'
+
+
+class EncodingEnum(str, Enum):
+    json = 'json'
+    # binary sends `move` events as MOVE_FRAME, every other event is still sent as json
+    binary = 'binary'
+
+
+# frame type, seq, x, y, player, winner, turn
+# players are encoded as 0 for nobody, 1 for the host and 2 for the enemy
+MOVE_FRAME = struct.Struct("!BIIIBBB")
+MOVE_FRAME_TYPE = 1
+
+
+class Listener():
+    __slots__ = ("player_id", "ws", "protocol", "encoding", "viewport")
+
+    def __init__(self, player_id: str, ws: WebSocket, protocol: ProtocolEnum = ProtocolEnum.full, encoding: EncodingEnum = EncodingEnum.json):
+        self.player_id = player_id
+        self.ws = ws
+        self.protocol = protocol
+        self.encoding = encoding
+        # listeners with a viewport get the moves inside it, and a `turn` event for the moves outside it
+        self.viewport: Viewport | None = None
+
+    def sees(self, x: int, y: int):
+        return self.viewport is None or self.viewport.contains(x, y)
+
+
+async def send_frame(ws: WebSocket, frame: str | bytes, timeout: float):
+    try:
+        if(isinstance(frame, bytes)):
+            await asyncio.wait_for(ws.send_bytes(frame), timeout)
+        else:
+            await asyncio.wait_for(ws.send_text(frame), timeout)
+        return True
+    except Exception:
+        return False
+
+
+def move_event(seq: int, row: int, direction: str, x: int, y: int, value: str, winner: str | None, turn: str | None) -> dict:
+    return {
+        "type": "move",
+        "payload": {
+            "seq": seq,
+            "row": row,
+            "direction": direction,
+            "x": x,
+            "y": y,
+            "value": value,
+            "winner": winner,
+            "turn": turn,
+        }
+    }
+
+
+def snapshot_event(status: dict) -> dict:
+    return {"type": "snapshot", "payload": status}
+
+
+# turn_event replaces a move outside the viewport of a listener, the sequence number still advances
+def turn_event(payload: dict) -> dict:
+    return {"type": "turn", "payload": {"seq": payload["seq"], "winner": payload["winner"], "turn": payload["turn"]}}
+
+
+# timeout_event ends a game whose player on turn let their clock run out, `winner` is the other player
+def timeout_event(seq: int, player_id: str, winner: str) -> dict:
+    return {"type": "timeout", "payload": {"seq": seq, "player": player_id, "winner": winner, "turn": None}}
+
+
+# ai_error_event tells the players the bot could not play its turn after `seq` moves, the turn is given back to `turn`
+def ai_error_event(seq: int, player_id: str, turn: str) -> dict:
+    return {"type": "ai_error", "payload": {"seq": seq, "player": player_id, "winner": None, "turn": turn,
+                                            "message": "The AI opponent could not play its turn, it is your turn again"}}
+
+
+# viewport_event has the tiles inside a viewport, moves up to `seq` are already included
+def viewport_event(viewport: Viewport, tiles: list[tuple[int, int, str]], seq: int, winner: str | None, turn: str | None) -> dict:
+    return {"type": "viewport", "payload": {**viewport.dict(), "tiles": tiles, "seq": seq, "winner": winner, "turn": turn}}
+
+
+def encode_move_frame(payload: dict, players: tuple[str, str | None]) -> bytes:
+    def code(player_id: str | None):
+        if(player_id is None):
+            return 0
+        return 1 if player_id == players[0] else 2
+
+    return MOVE_FRAME.pack(MOVE_FRAME_TYPE, payload["seq"], payload["x"], payload["y"],
+                           code(payload["value"]), code(payload["winner"]), code(payload["turn"]))
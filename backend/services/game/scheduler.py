@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class AIMoveScheduler():
+    """
+    Runs AI turns on a fixed number of worker tasks, off the request that made the human move.
+    A slot must be reserved before the human move is applied, so a full scheduler rejects the move
+    instead of leaving the game waiting for a bot turn that was never queued.
+    Games only have one AI turn pending at a time, which keeps the turns of a game in order.
+    A turn that raises is queued again after `retry_delay` seconds, doubled on every attempt, and keeps its slot,
+    after `retries` retries `give_up(game_id)` runs so the game does not wait on its bot forever.
+    """
+
+    def __init__(self, max_pending: int, workers: int, job: Callable[[int], Awaitable[None]],
+                 give_up: Callable[[int], Awaitable[None]], retries: int = 2, retry_delay: float = 0.5):
+        self.max_pending = max_pending
+        self.workers = workers
+        self.job = job
+        self.give_up = give_up
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue: asyncio.Queue[int] = asyncio.Queue()
+        self.tasks: list[asyncio.Task] = []
+        # game_id -> attempts that failed, for the turns waiting for a retry
+        self.attempts: dict[int, int] = {}
+        self.reserved = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.think_time_total = 0.0
+        self.think_time_max = 0.0
+        self.queue_time_total = 0.0
+        self.enqueued_at: dict[int, float] = {}
+
+    def start(self):
+        if(len(self.tasks) > 0):
+            return
+        self.tasks = [asyncio.create_task(self.__work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def reserve(self) -> bool:
+        if(self.reserved >= self.max_pending):
+            self.rejected += 1
+            return False
+        self.reserved += 1
+        return True
+
+    def release(self):
+        self.reserved -= 1
+
+    # submit queues the AI turn of game_id on a slot taken with reserve
+    def submit(self, game_id: int):
+        self.enqueued_at[game_id] = time.monotonic()
+        self.queue.put_nowait(game_id)
+
+    async def __work(self):
+        while True:
+            game_id = await self.queue.get()
+            start = time.monotonic()
+            self.queue_time_total += start - self.enqueued_at.pop(game_id, start)
+            retry = False
+            try:
+                await self.job(game_id)
+            except Exception:
+                retry = self.__retry(game_id)
+                if(not retry):
+                    await self.__give_up(game_id)
+            finally:
+                elapsed = time.monotonic() - start
+                self.processed += 1
+                self.think_time_total += elapsed
+                self.think_time_max = max(self.think_time_max, elapsed)
+                if(not retry):
+                    self.attempts.pop(game_id, None)
+                    self.reserved -= 1
+                self.queue.task_done()
+
+    # __retry queues a failed turn again after its backoff, returns False once it ran out of retries
+    def __retry(self, game_id: int) -> bool:
+        attempt = self.attempts.get(game_id, 0) + 1
+        if(attempt > self.retries):
+            self.failed += 1
+            logger.exception("AI turn of game %s failed, giving up after %s attempts", game_id, attempt)
+            return False
+        self.attempts[game_id] = attempt
+        self.retried += 1
+        delay = self.retry_delay * 2 ** (attempt - 1)
+        logger.warning("AI turn of game %s failed, retrying in %ss", game_id, delay, exc_info=True)
+        asyncio.get_running_loop().call_later(delay, self.submit, game_id)
+        return True
+
+    async def __give_up(self, game_id: int):
+        try:
+            await self.give_up(game_id)
+        except Exception:
+            logger.exception("giving up the AI turn of game %s failed", game_id)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "pending": self.reserved,
+            "max_pending": self.max_pending,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected,
+            "think_time_avg": self.think_time_total / self.processed if self.processed else 0.0,
+            "think_time_max": self.think_time_max,
+            "queue_time_avg": self.queue_time_total / self.processed if self.processed else 0.0,
+        }
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from enum import Enum
 
 
@@ -30,6 +30,31 @@ class Game(BaseModel):
         orm_mode = True
 
 
+class GameInfo(BaseModel):
+    game_id: int
+    width: int
+    height: int
+    line_target: int
+    host: str
+    enemy: str | None
+    winner: str | None
+
+    class Config:
+        orm_mode = True
+
+
+class PlayerStats(BaseModel):
+    player: str
+    games: int = 0
+    wins: int = 0
+    losses: int = 0
+    in_progress: int = 0
+    bot_games: int = 0
+
+    class Config:
+        orm_mode = True
+
+
 class Coordinate(BaseModel):
     x: int
     y: int
@@ -40,6 +65,17 @@ class PlayDirectionEnum(str, Enum):
     right = 'right'
 
 
+class Viewport(BaseModel):
+    """Rows [x, x + height) and columns [y, y + width) of a board"""
+    x: int = Field(ge=0)
+    y: int = Field(ge=0)
+    width: int = Field(gt=0)
+    height: int = Field(gt=0)
+
+    def contains(self, x: int, y: int):
+        return self.x <= x < self.x + self.height and self.y <= y < self.y + self.width
+
+
 class PlayerMove(BaseModel):
     row: int
     direction: PlayDirectionEnum
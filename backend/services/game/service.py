@@ -1,269 +1,811 @@
-from sqlalchemy.orm import Session
-from services.game.exceptions import GameFullException, GameNotFound, MoveIntegrityException
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.game.exceptions import GameFullException, GameNotFound, MoveIntegrityException, StaleGameException
 
-from services.game.models import Game, GameTile
-from services.game.schemas import GameTile as GTSchema, Game as GameSchema, PlayerMove, PlayDirectionEnum, WSEvent
+from services.game.models import Game, GameTile, PlayerStats
+from services.game.schemas import GameInfo, GameTile as GTSchema, Game as GameSchema, PlayerMove, PlayDirectionEnum, PlayerStats as PlayerStatsSchema, Viewport, WSEvent
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import update
-
-from services.game.utils import check_grid
+from sqlalchemy import func, select, update
+
+from services.game.admission import Admission, AdmissionGate, RateLimiter
+from services.game.ai import SearchAI
+from services.game.archive import load_archived
+from services.game.backend import GameBackend, create_backend
+from services.game.leaderboard import Leaderboard
+from services.game.lifecycle import GameLifecycle
+from services.game.lobby import LobbyIndex
+from services.game.metrics import BROADCAST_BYTES, BROADCAST_RECIPIENTS, BROADCAST_SECONDS, MOVE_STAGE_SECONDS, TimedLock, registry
+from services.game.protocol import EncodingEnum, Listener, ProtocolEnum, ai_error_event, encode_move_frame, move_event, send_frame, snapshot_event, timeout_event, turn_event, viewport_event
+from services.game.scheduler import AIMoveScheduler
+from services.game.spectator import Spectator
+from services.game.cache import GameState, GameStateCache, Snapshot
+from services.game.engine import Board, is_sparse
+from services.game.storage import create_storage
+from services.game.writer import MoveWriter, PendingMove
 import json
 from fastapi import WebSocket, status
 import asyncio
-from sqlalchemy.sql import text
-from db.utils import get_raw_sql_query
 import time
-import random
+from datetime import timedelta
 from fastapi.responses import JSONResponse
+from env import ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER, AI_MAX_DEPTH, AI_QUEUE_SIZE, AI_RETRIES, AI_RETRY_DELAY, AI_SCHEDULER_WORKERS, AI_TIME_BUDGET, AI_WORKERS, BOARD_STORAGE, BOARD_SNAPSHOT_INTERVAL, EXPORT_MAX_IN_FLIGHT, GAME_BACKEND, GAME_CACHE_SIZE, GAME_CACHE_IDLE_SECONDS, GAME_FINISHED_SECONDS, GAME_IDLE_SECONDS, GAME_LOCK_STRIPES, LEADERBOARD_REFRESH_SECONDS, LEADERBOARD_SIZE, LOBBY_PAGE_SIZE, MOVE_FLUSH_BATCH, MOVE_FLUSH_INTERVAL, MOVE_MAX_IN_FLIGHT, MOVE_MAX_QUEUED, MOVE_RATE_BURST, MOVE_RATE_LIMIT, MOVE_WRITE_MODE, SPECTATOR_QUEUE_SIZE, TIMER_RESOLUTION, TURN_TIMEOUT_SECONDS, VIEWPORT_MAX_CELLS, WS_CONNECT_RATE_BURST, WS_CONNECT_RATE_LIMIT, WS_MAX_PENDING_ACCEPTS, WS_MAX_QUEUED_ACCEPTS, WS_SEND_TIMEOUT
+from db.engine import POSTGRES_DSN, SessionLocal
 
 
 class GameContext():
+    """
+    Websockets connected to this worker for a single game.
+    Players are sent every event before the broadcast returns, spectators only get the frames queued.
+    Listeners and spectators are keyed by their websocket, in connection order.
+    """
+    __slots__ = ("host", "enemy", "websockets", "spectators", "full_spectators")
+
     def __init__(self, host: str, enemy: str | None = None):
         self.host = host
         self.enemy = enemy
-        self.turn = host
-        self.websockets: list[tuple[str, WebSocket]] = []
+        self.websockets: dict[WebSocket, Listener] = {}
+        self.spectators: dict[WebSocket, Spectator] = {}
+        self.full_spectators = 0
 
-    def add_listener(self, player_id: str, ws: WebSocket):
+    def add_listener(self, player_id: str, ws: WebSocket, protocol: ProtocolEnum = ProtocolEnum.full, encoding: EncodingEnum = EncodingEnum.json):
         if(player_id != self.host and player_id != self.enemy):
             return
 
-        self.websockets.append((player_id, ws))
+        self.websockets[ws] = Listener(player_id, ws, protocol, encoding)
 
     def can_join(self, player_id: str):
         return player_id == self.host or player_id == self.enemy
 
-    async def broadcast_message(self, message: dict):
-        str_message = json.dumps(message)
-        for (_, ws) in self.websockets:
-            await ws.send_text(str_message)
+    def add_spectator(self, spectator: Spectator):
+        self.spectators[spectator.listener.ws] = spectator
+        if(spectator.listener.protocol == ProtocolEnum.full):
+            self.full_spectators += 1
+        spectator.start(self.remove_spectator)
+
+    def remove_spectator(self, spectator: Spectator):
+        if(self.spectators.get(spectator.listener.ws) is not spectator):
+            return
+        del self.spectators[spectator.listener.ws]
+        if(spectator.listener.protocol == ProtocolEnum.full):
+            self.full_spectators -= 1
+        spectator.stop()
+
+    def find_spectator(self, ws: WebSocket) -> Spectator | None:
+        return self.spectators.get(ws)
+
+    def find_listener(self, ws: WebSocket) -> Listener | None:
+        listener = self.websockets.get(ws)
+        if(listener is not None):
+            return listener
+        spectator = self.spectators.get(ws)
+        return None if spectator is None else spectator.listener
+
+    def has_full_listeners(self):
+        return self.full_spectators > 0 or any(listener.protocol == ProtocolEnum.full for listener in self.websockets.values())
+
+    def is_empty(self):
+        return len(self.websockets) == 0 and len(self.spectators) == 0
+
+    # broadcast_message sends to every listener concurrently, listeners that fail or time out are dropped
+    # each frame format is serialized once, full_message is sent instead of `move` events to full protocol listeners
+    # without a viewport, it is None for sparse boards
+    async def broadcast_message(self, message: dict, full_message: dict | None = None, timeout: float = WS_SEND_TIMEOUT):
+        frames: dict[str, str | bytes] = {}
+        listeners = list(self.websockets.values())
+        with BROADCAST_SECONDS.time():
+            sent = await asyncio.gather(*(send_frame(listener.ws, self.__frame(listener, message, full_message, frames), timeout)
+                                          for listener in listeners))
+        BROADCAST_RECIPIENTS.observe(len(listeners))
+        BROADCAST_BYTES.observe(sum(len(frame) for frame in frames.values()))
+        for listener, ok in zip(listeners, sent):
+            if(not ok):
+                self.remove_listener(listener.player_id, listener.ws)
+        if(len(self.spectators) > 0):
+            # queued once the current handler yields, so the players' request does not wait for the fan-out
+            asyncio.get_running_loop().call_soon(self.__offer_spectators, message, full_message, frames)
+
+    def __offer_spectators(self, message: dict, full_message: dict | None, frames: dict[str, str | bytes]):
+        seq = message["payload"]["seq"] if message["type"] == "move" else None
+        for spectator in list(self.spectators.values()):
+            spectator.offer(seq, self.__frame(spectator.listener, message, full_message, frames))
+
+    def __frame(self, listener: Listener, message: dict, full_message: dict | None, frames: dict[str, str | bytes]):
+        key = "json"
+        if(message["type"] == "move"):
+            if(not listener.sees(message["payload"]["x"], message["payload"]["y"])):
+                key = "turn"
+            elif(listener.protocol == ProtocolEnum.full and listener.viewport is None and full_message is not None):
+                key = "full"
+            elif(listener.encoding == EncodingEnum.binary):
+                key = "binary"
+        elif(message["type"] in ("timeout", "ai_error") and listener.protocol == ProtocolEnum.full and listener.viewport is None
+             and full_message is not None):
+            key = "full"
+
+        frame = frames.get(key)
+        if(frame is None):
+            if(key == "full"):
+                frame = json.dumps(full_message)
+            elif(key == "binary"):
+                frame = encode_move_frame(message["payload"], (self.host, self.enemy))
+            elif(key == "turn"):
+                frame = json.dumps(turn_event(message["payload"]))
+            else:
+                frame = json.dumps(message)
+            frames[key] = frame
+        return frame
 
     def remove_listener(self, player_id: str, ws: WebSocket):
-        self.websockets.remove((player_id, ws))
+        self.websockets.pop(ws, None)
 
 
 class GameManager:
-    def __init__(self):
-        self.lock = asyncio.Lock()
+    """
+    Coordinates turns, AI agents and listeners of every game.
+    Turns and agents live in a GameBackend so they can be shared between workers, only the
+    websockets connected to this worker are kept in active_connections.
+    Operations that change a game are serialized by a lock striped on game_id, so games
+    never wait on each other, broadcasts are sent after the lock is released.
+    The contexts of idle and finished games and the turn clocks are handled by a GameLifecycle.
+    """
+
+    def __init__(self, backend: GameBackend, lock_stripes: int = GAME_LOCK_STRIPES):
+        self.backend = backend
+        self.locks = [asyncio.Lock() for _ in range(lock_stripes)]
         self.active_connections: dict[int, GameContext] = {}
-        self.agents: dict[int, str] = {}
+        self.cache = GameStateCache(GAME_CACHE_SIZE, GAME_CACHE_IDLE_SECONDS)
+        self.lobby = LobbyIndex()
+        self.leaderboard = Leaderboard(LEADERBOARD_SIZE, LEADERBOARD_REFRESH_SECONDS)
+        self.lobby_listeners: set[WebSocket] = set()
+        self.ai = SearchAI(AI_WORKERS, AI_TIME_BUDGET, AI_MAX_DEPTH)
+        self.scheduler = AIMoveScheduler(AI_QUEUE_SIZE, AI_SCHEDULER_WORKERS, self.__play_ai_turn, self.__give_up_ai_turn,
+                                         AI_RETRIES, AI_RETRY_DELAY)
+        self.writer: MoveWriter | None = None
+        if(MOVE_WRITE_MODE == "behind"):
+            if(GAME_BACKEND != "memory"):
+                raise ValueError("MOVE_WRITE_MODE=behind keeps unwritten moves in this worker, it needs GAME_BACKEND=memory")
+            self.writer = MoveWriter(storage, MOVE_FLUSH_INTERVAL, MOVE_FLUSH_BATCH, POSTGRES_DSN, self.cache.invalidate)
+        self.admission = Admission(
+            AdmissionGate(MOVE_MAX_IN_FLIGHT, MOVE_MAX_QUEUED, ADMISSION_QUEUE_TIMEOUT),
+            RateLimiter(MOVE_RATE_LIMIT, MOVE_RATE_BURST),
+            AdmissionGate(WS_MAX_PENDING_ACCEPTS, WS_MAX_QUEUED_ACCEPTS, ADMISSION_QUEUE_TIMEOUT),
+            RateLimiter(WS_CONNECT_RATE_LIMIT, WS_CONNECT_RATE_BURST),
+            AdmissionGate(EXPORT_MAX_IN_FLIGHT, 0, 0),
+            ADMISSION_RETRY_AFTER)
+        self.lifecycle = GameLifecycle(GAME_IDLE_SECONDS, GAME_FINISHED_SECONDS, TURN_TIMEOUT_SECONDS, TIMER_RESOLUTION,
+                                       self.__evict, self.__expire_turn)
+        self.register_metrics()
+
+    # register_metrics exposes the state of the manager, the values are only read when the metrics are scraped
+    def register_metrics(self):
+        registry.gauge("game_active_games", "Games with websockets connected to this worker",
+                       lambda: len(self.active_connections))
+        registry.gauge("game_connected_websockets", "Game websockets connected to this worker",
+                       lambda: sum(len(context.websockets) for context in self.active_connections.values()))
+        registry.gauge("game_timers", "Idle timers and turn clocks on the timer wheel", lambda: len(self.lifecycle.wheel))
+        registry.gauge("game_turn_clocks", "Turn clocks running", lambda: len(self.lifecycle.turns))
+        registry.counter("game_evictions_total", "Idle and finished games dropped from this worker", lambda: self.lifecycle.evictions)
+        registry.counter("game_turn_timeouts_total", "Turn clocks that ran out", lambda: self.lifecycle.expired_turns)
+        registry.gauge("game_lobby_websockets", "Lobby websockets connected to this worker", lambda: len(self.lobby_listeners))
+        registry.gauge("game_lobby_games", "Open games in the lobby index", lambda: len(self.lobby))
+        registry.gauge("game_leaderboard_players", "Players in the in-memory leaderboard", lambda: len(self.leaderboard))
+        registry.counter("game_leaderboard_reloads_total", "Leaderboard reloads from player_stats", lambda: self.leaderboard.reloads)
+        registry.gauge("game_cache_size", "Game states in the cache", lambda: len(self.cache.entries))
+        registry.counter("game_cache_hits_total", "Game state cache hits", lambda: self.cache.hits)
+        registry.counter("game_cache_misses_total", "Game state cache misses", lambda: self.cache.misses)
+        registry.counter("game_cache_evictions_total", "Game states evicted from the cache", lambda: self.cache.evictions)
+        registry.counter("game_snapshot_hits_total", "Reads served from an already serialized snapshot", lambda: self.cache.snapshot_hits)
+        registry.counter("game_snapshot_builds_total", "Snapshots serialized", lambda: self.cache.snapshot_builds)
+        registry.gauge("game_ai_queue_depth", "AI turns waiting for a scheduler worker", lambda: self.scheduler.queue.qsize())
+        registry.gauge("game_ai_pending", "AI turns reserved or running", lambda: self.scheduler.reserved)
+        registry.counter("game_ai_processed_total", "AI turns played", lambda: self.scheduler.processed)
+        registry.counter("game_ai_failed_total", "AI turns given back to the human after their retries failed", lambda: self.scheduler.failed)
+        registry.counter("game_ai_retried_total", "AI turns queued again after they raised", lambda: self.scheduler.retried)
+        registry.counter("game_ai_rejected_total", "Moves rejected because the AI scheduler was full", lambda: self.scheduler.rejected)
+        registry.counter("game_ai_think_seconds_total", "Time spent playing AI turns", lambda: self.scheduler.think_time_total)
+        if(self.writer is not None):
+            writer = self.writer
+            registry.gauge("game_writer_pending_moves", "Moves acknowledged but not written yet", lambda: len(writer.pending))
+            registry.counter("game_writer_flushed_moves_total", "Moves written by the write-behind writer", lambda: writer.flushed)
+            registry.counter("game_writer_failed_flushes_total", "Write-behind flushes that failed", lambda: writer.failed)
+            registry.counter("game_writer_dropped_moves_total", "Moves dropped because they could not be written", lambda: writer.dropped)
+            registry.gauge("game_writer_last_flush_seconds", "Duration of the last write-behind flush", lambda: writer.last_flush_time)
+        self.admission.register_metrics(registry)
+
+    async def start(self):
+        await self.backend.start(self.__deliver, self.__resync)
+        self.scheduler.start()
+        self.lifecycle.start()
+        if(self.writer is not None):
+            await self.writer.start()
+        async with SessionLocal() as db:
+            await storage.prepare(db)
+            await load_lobby(db)
+
+    async def stop(self):
+        await self.lifecycle.stop()
+        await self.scheduler.stop()
+        if(self.writer is not None):
+            await self.writer.stop()
+        await self.backend.stop()
+        self.ai.shutdown()
+
+    def game_lock(self, game_id: int) -> TimedLock:
+        return TimedLock(self.locks[game_id % len(self.locks)])
 
     async def register_new_ai_agent(self, game_id: int, player_id: str):
-        async with self.lock:
-            if(game_id in self.agents):
-                return
+        await self.backend.register_agent(game_id, player_id)
 
-            self.agents[game_id] = player_id
+    async def is_agent(self, player_id: str | None, game_id: int):
+        session = await self.backend.get_session(game_id)
+        return session is not None and session.agent is not None and session.agent == player_id
 
-    async def move_ai(self, db: Session, game_id: int):
-        async with self.lock:
-            if(game_id not in self.agents):
+    async def move_ai(self, db: AsyncSession, game_id: int):
+        async with self.game_lock(game_id):
+            session = await self.backend.get_session(game_id)
+            # a retried turn may have been played already
+            if(session is None or session.agent is None or session.turn != session.agent):
                 return None
-            ai_id = self.agents[game_id]
-            next_move = get_ai_move(db, game_id)
-            move = random.choice(next_move)
-            if(not self.can_move(ai_id, game_id)):
-                raise Exception("TODO")
-            res = play_move(db, move, game_id, ai_id)
-            if(res is None):
+            ai_id = session.agent
+            board = await load_board(db, game_id)
+            if(board.winner is not None):
                 return None
-            turn = self.__set_next_turn(game_id)
+            move = await self.ai.choose_move(board, ai_id)
+            if(move is None):
+                return None
+            claimed = await self.claim_turn(ai_id, game_id)
+            if(claimed is None):
+                # the turn left the bot while it was thinking, a timeout or another worker took it
+                return None
+            turn, seq = claimed
+            try:
+                res = await play_move(db, move, game_id, ai_id, seq)
+            except Exception as e:
+                await self.release_turn(ai_id, game_id)
+                raise e
             res["turn"]=turn
             return res
 
-    async def register_game(self, game_id: int, host: str):
-        async with self.lock:
-            if(game_id in self.active_connections):
-                return
-
-            self.active_connections[game_id] = GameContext(host)
-
-    async def connect(self, player_id: str, game_id: int, ws: WebSocket):
+    async def __play_ai_turn(self, game_id: int):
+        async with SessionLocal() as db:
+            res = await self.move_ai(db, game_id)
+        if(res is not None):
+            await self.broadcast_game_update(game_move_event(res), game_id)
+
+    # __give_up_ai_turn hands the turn back to the human once the bot failed to play it, the players get an ai_error event
+    async def __give_up_ai_turn(self, game_id: int):
+        async with SessionLocal() as db:
+            async with self.game_lock(game_id):
+                session = await self.backend.get_session(game_id)
+                if(session is None or session.agent is None or session.turn != session.agent):
+                    return
+                state = await get_game_state(db, game_id)
+                if(state.board.winner is not None):
+                    return
+                # the bot did not move, the turn changes hands without counting a move
+                await self.backend.set_turn(game_id, session.host)
+                state.touch()
+        await self.broadcast_game_update(ai_error_event(state.board.moves, session.agent, session.host), game_id)
+
+    async def register_game(self, game: GameInfo):
+        await self.backend.register_game(game.game_id, game.host)
+        self.lifecycle.touch(game.game_id)
+        await self.backend.publish(game.game_id, {"type": "lobby_add", "payload": game.dict()})
+
+    async def connect_lobby(self, ws: WebSocket):
         try:
-            async with self.lock:
-                if(game_id not in self.active_connections or not self.active_connections[game_id].can_join(player_id)):
-                    return False
-
-                await ws.accept()
-                self.active_connections[game_id].add_listener(player_id, ws)
-                return True
+            await ws.accept()
         except:
             return False
+        self.lobby_listeners.add(ws)
+        return True
 
-    def can_move(self, player_id: str, game_id: int):
-        return game_id in self.active_connections and self.active_connections[game_id].turn == player_id and self.active_connections[game_id].enemy is not None
-
-    def get_next_turn(self, game_id: int):
-        if(game_id not in self.active_connections):
-            return None
-
-        if(self.active_connections[game_id].turn == self.active_connections[game_id].host and self.active_connections[game_id].enemy is None):
-            return None
+    def disconnect_lobby(self, ws: WebSocket):
+        self.lobby_listeners.discard(ws)
 
-        return self.active_connections[game_id].host if self.active_connections[game_id].turn == self.active_connections[game_id].enemy else self.active_connections[game_id].enemy
+    async def connect(self, player_id: str, game_id: int, ws: WebSocket, protocol: ProtocolEnum = ProtocolEnum.full, encoding: EncodingEnum = EncodingEnum.json):
+        session = await self.backend.get_session(game_id)
+        if(session is None or not session.can_join(player_id)):
+            return False
 
-    async def set_turn(self, game_id: int):
-        async with self.lock:
-            return self.__set_next_turn(game_id)
+        try:
+            await ws.accept()
+        except:
+            return False
 
-    def __set_next_turn(self, game_id: int):
-        if(game_id not in self.active_connections):
+        context = self.active_connections.get(game_id)
+        if(context is None):
+            context = self.active_connections[game_id] = GameContext(session.host)
+        context.enemy = session.enemy
+        context.add_listener(player_id, ws, protocol, encoding)
+        self.lifecycle.touch(game_id)
+        return True
+
+    # connect_spectator subscribes anyone to the events of a game, the current snapshot is sent first
+    async def connect_spectator(self, player_id: str, game_id: int, ws: WebSocket, protocol: ProtocolEnum = ProtocolEnum.full, encoding: EncodingEnum = EncodingEnum.json) -> Spectator | None:
+        session = await self.backend.get_session(game_id)
+        if(session is None):
             return None
 
-        next_turn = self.get_next_turn(game_id)
-        if (next_turn is None):
+        try:
+            await ws.accept()
+        except:
             return None
 
-        self.active_connections[game_id].turn = next_turn
-        return next_turn
+        context = self.active_connections.get(game_id)
+        if(context is None):
+            context = self.active_connections[game_id] = GameContext(session.host)
+        context.enemy = session.enemy
+        spectator = Spectator(Listener(player_id, ws, protocol, encoding), SPECTATOR_QUEUE_SIZE,
+                              lambda listener: self.listener_snapshot(game_id, listener), WS_SEND_TIMEOUT)
+        context.add_spectator(spectator)
+        self.lifecycle.touch(game_id)
+        return spectator
+
+    # listener_snapshot returns the frame a listener (re)starts from, its viewport or the cached snapshot of its protocol
+    async def listener_snapshot(self, game_id: int, listener: Listener) -> tuple[int, str]:
+        if(listener.viewport is not None):
+            return await self.viewport_snapshot(game_id, listener.viewport)
+        async with SessionLocal() as db:
+            snapshot = await get_snapshot(db, game_id, listener.protocol.value)
+        return snapshot.seq, snapshot.body
+
+    def find_listener(self, game_id: int, ws: WebSocket) -> Listener | None:
+        context = self.active_connections.get(game_id)
+        return None if context is None else context.find_listener(ws)
+
+    # set_viewport limits the moves sent to ws to the ones inside viewport, returns False when ws or the viewport are not valid
+    def set_viewport(self, game_id: int, ws: WebSocket, viewport: Viewport) -> bool:
+        listener = self.find_listener(game_id, ws)
+        if(listener is None or viewport.width * viewport.height > VIEWPORT_MAX_CELLS):
+            return False
+        listener.viewport = viewport
+        return True
+
+    # viewport_snapshot serializes the tiles inside viewport, only the occupied cells of its rows are read
+    async def viewport_snapshot(self, game_id: int, viewport: Viewport) -> tuple[int, str]:
+        async with SessionLocal() as db:
+            async with self.game_lock(game_id):
+                board = (await get_game_state(db, game_id)).board
+                turn = await self.get_turn(game_id)
+                tiles = board.tiles(viewport.x, viewport.x + viewport.height, viewport.y, viewport.y + viewport.width)
+                return board.moves, json.dumps(viewport_event(viewport, tiles, board.moves, board.winner, turn))
+
+    # claim_turn passes the turn to the opponent if it is player_id's turn, returns the new turn and the moves
+    # played before this one, or None. callers must hold game_lock(game_id) and release_turn if the move could not be applied
+    async def claim_turn(self, player_id: str, game_id: int) -> tuple[str, int | None] | None:
+        return await self.backend.advance_turn(game_id, player_id)
+
+    async def release_turn(self, player_id: str, game_id: int):
+        await self.backend.release_turn(game_id, player_id)
 
     async def get_turn(self, game_id: int):
-        async with self.lock:
-            if(game_id not in self.active_connections):
-                return None
-            return self.active_connections[game_id].turn
+        session = await self.backend.get_session(game_id)
+        if(session is None):
+            return None
+        return session.turn
 
     async def add_enemy_to_game(self, player_id: str, game_id: int):
-        async with self.lock:
-            if(game_id in self.active_connections and self.active_connections[game_id].host != player_id and self.active_connections[game_id].enemy is None):
+        async with self.game_lock(game_id):
+            if(not await self.backend.set_enemy(game_id, player_id)):
+                raise GameFullException(game_id)
+
+            if(game_id in self.active_connections):
                 self.active_connections[game_id].enemy = player_id
-                return
+        await self.backend.publish(game_id, {"type": "lobby_remove", "payload": {"game_id": game_id}})
 
-            raise GameFullException(game_id)
+    async def active_games(self, game_ids: list[int]):
+        return await self.backend.active_games(game_ids)
 
     async def disconnect(self, player_id: str, game_id: int, ws: WebSocket):
-        async with self.lock:
-            if(game_id not in self.active_connections):
-                return
-            self.active_connections[game_id].remove_listener(player_id, ws)
+        if(game_id not in self.active_connections):
+            return
+        context = self.active_connections[game_id]
+        context.remove_listener(player_id, ws)
+        spectator = context.find_spectator(ws)
+        if(spectator is not None):
+            context.remove_spectator(spectator)
+        self.lifecycle.touch(game_id)
 
     async def broadcast_game_update(self, message: dict, game_id: int):
-        async with self.lock:
-            await self.__broadcast_game_update(message, game_id)
+        await self.backend.publish(game_id, message)
 
-    async def __broadcast_game_update(self, message: dict, game_id: int):
-        if(game_id not in self.active_connections):
+    # __deliver receives every published event, events from other workers are applied to the cached state
+    async def __deliver(self, game_id: int, message: dict, local: bool):
+        if(message["type"].startswith("lobby_")):
+            await self.__update_lobby(game_id, message)
+            return
+        if(message["type"] == "move" and message["payload"]["winner"] is not None):
+            await self.__update_lobby(game_id, {"type": "lobby_remove", "payload": {"game_id": game_id}})
+        if(not local):
+            self.__apply_remote_event(game_id, message)
+        await self.__track(game_id, message)
+        context = self.active_connections.get(game_id)
+        if(context is None):
+            return
+        if(message["type"] == "opponent"):
+            context.enemy = message["payload"]["username"]
+
+        full_message = None
+        # full listeners replace their state with every frame, events without a board are sent as the whole game
+        if(message["type"] in ("move", "timeout", "ai_error") and context.has_full_listeners()):
+            async with SessionLocal() as db:
+                board = await load_board(db, game_id)
+            payload = message["payload"]
+            if(not is_sparse(board)):
+                full_message = WSEvent(type="game", payload={
+                    "board": board.to_list(), "winner": payload["winner"], "turn": payload["turn"], "seq": payload["seq"]}).dict()
+        await context.broadcast_message(message, full_message)
+
+    # __resync drops what events missed while the LISTEN connection was down would have updated,
+    # games are read again from the database and the lobby is rebuilt
+    async def __resync(self):
+        self.cache.clear()
+        lobby = LobbyIndex()
+        async with SessionLocal() as db:
+            await load_lobby(db, lobby)
+        self.lobby = lobby
+
+    # __update_lobby applies a lobby event to the lobby index and pushes it to the lobby listeners if it changed the index
+    async def __update_lobby(self, game_id: int, message: dict):
+        if(message["type"] == "lobby_add"):
+            changed = self.lobby.add(GameInfo(**message["payload"]))
+        else:
+            changed = self.lobby.remove(game_id) is not None
+        if(not changed or len(self.lobby_listeners) == 0):
             return
-        await self.active_connections[game_id].broadcast_message(message)
-
 
-manager = GameManager()
+        frame = json.dumps(message)
+        listeners = list(self.lobby_listeners)
+        sent = await asyncio.gather(*(send_frame(ws, frame, WS_SEND_TIMEOUT) for ws in listeners))
+        for ws, ok in zip(listeners, sent):
+            if(not ok):
+                self.disconnect_lobby(ws)
+
+    # __track runs the turn clock of the player an event gave the turn to, and re-arms the idle timer of the game
+    async def __track(self, game_id: int, message: dict):
+        payload = message["payload"]
+        if(payload.get("winner") is not None):
+            await self.__record_result(game_id, payload["winner"])
+            self.lifecycle.finish(game_id)
+            return
+        if(message["type"] in ("move", "ai_error")):
+            self.lifecycle.start_turn(game_id, payload["turn"], payload["seq"])
+        elif(message["type"] == "opponent" and self.lifecycle.turn_timeout > 0):
+            # the host moves first once the enemy seat is taken
+            turn = await self.get_turn(game_id)
+            if(turn is not None):
+                self.lifecycle.start_turn(game_id, turn, 0)
+        self.lifecycle.touch(game_id)
+
+    # __evict drops the websockets context of an idle or finished game, and the session of a finished one
+    async def __evict(self, game_id: int, finished: bool) -> bool:
+        context = self.active_connections.get(game_id)
+        if(context is not None):
+            if(not context.is_empty()):
+                return False
+            del self.active_connections[game_id]
+        if(finished):
+            await self.backend.forget(game_id)
+        return True
+
+    # __expire_turn gives the game to the opponent of player_id if it still has the turn it got after `seq` moves,
+    # every worker runs the clocks of the games it gets events of, only one of them can set the winner
+    async def __expire_turn(self, game_id: int, player_id: str, seq: int):
+        async with SessionLocal() as db:
+            async with self.game_lock(game_id):
+                session = await self.backend.get_session(game_id)
+                if(session is None or session.enemy is None or session.turn != player_id):
+                    return
+                state = await get_game_state(db, game_id)
+                if(state.board.winner is not None or state.board.moves != seq):
+                    return
+                winner = session.enemy if player_id == session.host else session.host
+                if(not await forfeit(db, state, winner)):
+                    return
+        await self.broadcast_game_update(timeout_event(seq, player_id, winner), game_id)
+
+    # __record_result moves the players of a finished game on the leaderboard, player_stats is updated by its trigger
+    async def __record_result(self, game_id: int, winner: str):
+        session = await self.backend.get_session(game_id)
+        if(session is not None):
+            self.leaderboard.record_result(game_id, winner, session.enemy if winner == session.host else session.host)
+
+    # __apply_remote_event keeps the cached state in step with moves applied by other workers
+    # the state is dropped when an event is missed, it will be read again from the database
+    def __apply_remote_event(self, game_id: int, message: dict):
+        state = self.cache.peek(game_id)
+        if(state is None):
+            return
 
+        payload = message["payload"]
+        if(message["type"] == "opponent"):
+            state.info.enemy = payload["username"]
+        elif(message["type"] == "timeout"):
+            state.board.winner = payload["winner"]
+            state.info.winner = payload["winner"]
+        elif(message["type"] == "ai_error"):
+            # only the turn changed, the snapshots holding it are dropped
+            pass
+        elif(message["type"] != "move" or state.board.moves != payload["seq"] - 1
+             or state.board.place(payload["row"], payload["direction"], payload["value"]) is None):
+            self.cache.invalidate(game_id)
+            return
+        elif(payload["winner"] is not None):
+            state.board.winner = payload["winner"]
+            state.info.winner = payload["winner"]
+        state.touch()
 
-def map_move(db: Session, game_id: int, move: PlayerMove) -> dict:
-    stmt = text(get_raw_sql_query('get_all_valid_moves.sql'))
-    res = db.execute(
-        stmt, {"game_id": game_id, "row": move.row, "direction": move.direction})
-    for row, in res:
-        return row
-    return {}
 
+storage = create_storage(BOARD_STORAGE, BOARD_SNAPSHOT_INTERVAL)
+manager = GameManager(create_backend(GAME_BACKEND, POSTGRES_DSN))
 
-def get_ai_move(db: Session, game_id: int) -> list[PlayerMove]:
-    tiles, _ = get_current_board(db, game_id)
-    valid_moves = []
-    for rownum, row in enumerate(tiles):
-        if(row[0] is None):
-            valid_moves.append(PlayerMove(
-                row=rownum, direction=PlayDirectionEnum.left))
 
-        if(row[-1] is None):
-            valid_moves.append(PlayerMove(
-                row=rownum, direction=PlayDirectionEnum.right))
+# map_move lists the valid moves of the game and the cell `move` lands on, from the fill counters of the cached board
+async def map_move(db: AsyncSession, game_id: int, move: PlayerMove) -> dict:
+    state = await get_game_state(db, game_id)
+    coordinate = state.board.map_move(move.row, move.direction)
+    return {
+        "valid_moves": state.board.valid_move_cells(),
+        "mapped_move": None if coordinate is None else {"x": coordinate[0], "type": move.direction.value, "y": coordinate[1]},
+        "game": state.info.dict(),
+    }
 
-    return valid_moves
 
+# get_game falls back to game_archive, archived games have the same attributes as Game
+async def get_game(db: AsyncSession, game_id: int):
+    res = await db.execute(select(Game).where(Game.game_id == game_id))
+    game = res.scalars().first()
+    if(game is None):
+        archived = await load_archived(db, game_id)
+        return None if archived is None else archived[0]
+    return game
 
-def get_game(db: Session, game_id: int):
-    return db.query(Game).filter(Game.game_id == game_id).first()
 
+async def get_all_tiles(db: AsyncSession, game_id: int):
+    res = await db.execute(select(GameTile).where(GameTile.game_id == game_id))
+    return res.scalars().all()
 
-def get_all_tiles(db: Session, game_id: int):
-    return db.query(GameTile).filter(GameTile.game_id == game_id).all()
 
+# get_game_state returns the cached state of the game, the database is only read on a cache miss
+async def get_game_state(db: AsyncSession, game_id: int) -> GameState:
+    state = manager.cache.get(game_id)
+    if(state is not None):
+        return state
 
-def get_current_board(db: Session, game_id: int):
-    game = get_game(db, game_id)
-    if (game is None):
+    # with write-behind an evicted game can still have moves that are only in memory
+    if(manager.writer is not None and manager.writer.has_pending(game_id)):
+        await manager.writer.flush()
+    loaded = await storage.load(db, game_id)
+    if (loaded is None):
+        loaded = await load_archived(db, game_id)
+    if (loaded is None):
         raise GameNotFound(game_id)
-    tiles = [[None]*(game.height) for _ in range(game.width)]  # type: ignore
-    for tile in game.tiles:
-        tiles[tile.x][tile.y] = tile.value
-    return tiles, game
+    game, board = loaded
+    state = GameState(GameInfo.from_orm(game), board)
+    manager.cache.put(game_id, state)
+    return state
+
 
+async def load_board(db: AsyncSession, game_id: int) -> Board:
+    return (await get_game_state(db, game_id)).board
 
-async def get_current_game_status(db: Session, game_id: int):
-    tiles, game = get_current_board(db, game_id)
+
+async def get_current_game_status(db: AsyncSession, game_id: int):
+    board = await load_board(db, game_id)
     return {
-        "board": tiles,
-        "winner": game.winner,
-        "turn": await manager.get_turn(game_id)
+        **board_status(board),
+        "winner": board.winner,
+        "turn": await manager.get_turn(game_id),
+        "seq": board.moves
     }
 
 
-def check_win(db: Session, last_play: GTSchema):
-    game = get_game(db, last_play.game_id)
-    if (game is None):
-        raise GameNotFound(last_play.game_id)
-    tiles = [[None]*(game.height) for _ in range(game.width)]  # type: ignore
-    for tile in game.tiles:
-        tiles[tile.x][tile.y] = tile.value
-    return tiles, check_grid(tiles, game.line_target, last_play.value, last_play.x, last_play.y) # type: ignore
-
-# play_move checks if the current move wins the game
-# first elem in tuple is true if the player wins with the current move, the second indicates if the passed move was applied
-def play_move(db: Session, value: PlayerMove, game_id: int, player_id: str):
+# board_status has the dense `board` of small games, sparse boards send None and the list of their `tiles` instead
+def board_status(board: Board) -> dict:
+    if(is_sparse(board)):
+        return {"board": None, "tiles": board.tiles()}
+    return {"board": board.to_list()}
+
+
+# get_snapshot returns the serialized `kind` of the game, "info" or a ProtocolEnum value, built once per version
+# of its state and sent byte for byte to every read and websocket join until the game changes
+async def get_snapshot(db: AsyncSession, game_id: int, kind: str) -> Snapshot:
+    state = await get_game_state(db, game_id)
+    snapshot = state.snapshots.get(kind)
+    if(snapshot is not None):
+        manager.cache.snapshot_hits += 1
+        return snapshot
+
+    # built under the game lock so the board is never paired with the turn of a move being played
+    async with manager.game_lock(game_id):
+        state = await get_game_state(db, game_id)
+        version = state.version
+        if(kind == "info"):
+            body = state.info.json()
+        else:
+            status = {**board_status(state.board), "winner": state.board.winner,
+                      "turn": await manager.get_turn(game_id), "seq": state.board.moves}
+            body = json.dumps(game_snapshot(status, ProtocolEnum(kind)))
+        snapshot = Snapshot(state.board.moves, body)
+    manager.cache.snapshot_builds += 1
+    # remote events change the state without the lock, a snapshot of an older version is not kept
+    if(state.version == version):
+        state.snapshots[kind] = snapshot
+    return snapshot
+
+
+# play_move applies the move to the in-process board and persists the new tile, or queues it with MOVE_WRITE_MODE=behind
+# `seq` is the number of moves claim_turn counted before this one, a cached board with another count is read again,
+# it is None on a backend that is not shared between workers
+# the returned dict contains the resulting board, the winner, if the move won the game, and the placed tile
+async def play_move(db: AsyncSession, value: PlayerMove, game_id: int, player_id: str, seq: int | None = None):
+    with MOVE_STAGE_SECONDS.time("load"):
+        state = await get_game_state(db, game_id)
+        if(seq is not None and state.board.moves != seq):
+            # another worker moved and its event has not reached this one yet
+            manager.cache.invalidate(game_id)
+            state = await get_game_state(db, game_id)
+            if(state.board.moves != seq):
+                manager.cache.invalidate(game_id)
+                raise StaleGameException(game_id)
+    board = state.board
+    with MOVE_STAGE_SECONDS.time("map_move"):
+        coordinate = None if board.winner is not None else board.place(value.row, value.direction, player_id)
+    if(coordinate is None):
+        raise MoveIntegrityException(value)
+    x, y = coordinate
     try:
-        all_moves = map_move(db, game_id, value)
-        mapped_move = all_moves.get("mapped_move")
-        if(mapped_move is None):
-            raise MoveIntegrityException(value)
-        game = all_moves.get("game")
-        if(game is None):
-            raise GameNotFound(game_id)
-        gt = GTSchema(game_id=game_id, game_height=game["height"], game_width=game["width"],
-                      x=mapped_move["x"], y=mapped_move["y"], value=player_id)
-        stmt = insert(GameTile).values(
-            [gt.dict()]).on_conflict_do_nothing().returning(GameTile)
-        result = db.execute(stmt)
-        if (result.first() is None):
-            raise MoveIntegrityException(value)
-
-        board, (wins, _) = check_win(db, gt)
-        if(wins):
-            db.query(Game).filter(Game.game_id == game_id).update(
-                {'winner': player_id})
-
-        db.commit()
-        return {
-            "board": board,
-            "winner": None if not wins else gt.value
-        }
+        with MOVE_STAGE_SECONDS.time("check_win"):
+            wins, _ = board.check_win(x, y)
+        if(manager.writer is not None):
+            players = (state.info.host, state.info.enemy)
+            manager.writer.add(PendingMove(game_id, board.moves - 1, board.width, board.height, value.row, value.direction.value,
+                                           x, y, player_id, player_id if wins else None, storage.snapshot(board, players)))
+        else:
+            await save_move(db, state, value, x, y, player_id, wins)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        board.undo(value.row, value.direction)
         raise e
 
+    if(wins):
+        board.winner = player_id
+        state.info.winner = player_id
+    state.touch()
+    return {
+        "board": None if is_sparse(board) else board.to_list(),
+        "winner": None if not wins else player_id,
+        "seq": board.moves,
+        "row": value.row,
+        "direction": value.direction.value,
+        "x": x,
+        "y": y,
+        "value": player_id
+    }
 
-def get_free_games(db: Session, player_id: str):
-    games = db.query(Game).filter((Game.enemy == None) | (
-        Game.host == player_id) | (Game.enemy == player_id)).all()
-    db.close()
-    return list(filter(lambda x: x.game_id in manager.active_connections.keys(), games))
 
+# save_move writes a move placed on the cached board and commits it
+async def save_move(db: AsyncSession, state: GameState, value: PlayerMove, x: int, y: int, player_id: str, wins: bool):
+    game_id = state.info.game_id
+    with MOVE_STAGE_SECONDS.time("insert"):
+        saved = await storage.save_move(db, game_id, state.board, (state.info.host, state.info.enemy),
+                                        value, x, y, player_id, wins)
+    if (not saved):
+        # the move was stored by another worker, the cached board is stale
+        manager.cache.invalidate(game_id)
+        raise MoveIntegrityException(value)
+
+    with MOVE_STAGE_SECONDS.time("commit"):
+        await db.commit()
+
+
+# forfeit gives the game to `winner` without a move, returns False if the database already had a winner
+async def forfeit(db: AsyncSession, state: GameState, winner: str) -> bool:
+    game_id = state.info.game_id
+    if(manager.writer is not None and manager.writer.has_pending(game_id)):
+        # the moves are written first, a finished game can be archived as soon as it is committed
+        await manager.writer.flush()
+    res = await db.execute(update(Game).where(Game.game_id == game_id, Game.winner == None)
+                           .values(winner=winner).returning(Game.game_id))
+    updated = res.first() is not None
+    await db.commit()
+    if(not updated):
+        manager.cache.invalidate(game_id)
+        return False
+    state.board.winner = winner
+    state.info.winner = winner
+    state.touch()
+    return True
+
+
+# game_snapshot builds the message sent to a listener to (re)start from the current state of the game
+def game_snapshot(status: dict, protocol: ProtocolEnum) -> dict:
+    if(protocol == ProtocolEnum.delta):
+        return snapshot_event(status)
+    return WSEvent(type="game", payload=status).dict()
+
+
+# game_move_event builds the `move` event of a play_move result once its turn is set
+def game_move_event(res: dict) -> dict:
+    return move_event(res["seq"], res["row"], res["direction"], res["x"], res["y"], res["value"], res["winner"], res["turn"])
+
+
+# get_free_games returns, sorted by game_id and after the `after` cursor, the open games from the lobby index
+# merged with the active games the player takes part in
+async def get_free_games(db: AsyncSession, player_id: str, after: int = 0, limit: int = LOBBY_PAGE_SIZE):
+    games = {game.game_id: game for game in manager.lobby.page(after, limit)}
+    res = await db.execute(select(Game).where((Game.host == player_id) | (Game.enemy == player_id), Game.game_id > after)
+                           .order_by(Game.game_id).limit(limit))
+    own = res.scalars().all()
+    active = await manager.active_games([game.game_id for game in own])
+    for game in own:
+        if(game.game_id in active):
+            games[game.game_id] = GameInfo.from_orm(game)
+    return [games[game_id] for game_id in sorted(games)[:limit]]
+
+
+# get_player_stats reads the aggregates of a player, players without a game get zeros
+async def get_player_stats(db: AsyncSession, player_id: str) -> PlayerStatsSchema:
+    stats = await db.get(PlayerStats, player_id)
+    return PlayerStatsSchema(player=player_id) if stats is None else PlayerStatsSchema.from_orm(stats)
+
+
+# get_leaderboard returns the `limit` players with the most wins from the in-memory leaderboard,
+# reloaded from the wins index of player_stats once it is older than LEADERBOARD_REFRESH_SECONDS
+async def get_leaderboard(db: AsyncSession, limit: int) -> list[PlayerStatsSchema]:
+    leaderboard = manager.leaderboard
+    if(leaderboard.is_stale()):
+        async with leaderboard.lock:
+            if(leaderboard.is_stale()):
+                # the stats and the games finished recently are read from the same snapshot, the results of those
+                # games delivered after the reload are already counted, see Leaderboard.record_result
+                await db.connection(execution_options={"isolation_level": "REPEATABLE READ", "postgresql_readonly": True})
+                res = await db.execute(select(PlayerStats).order_by(PlayerStats.wins.desc(), PlayerStats.player)
+                                       .limit(leaderboard.size))
+                players = [PlayerStatsSchema.from_orm(stats) for stats in res.scalars()]
+                res = await db.execute(select(Game.game_id).where(
+                    Game.finished_at > func.now() - timedelta(seconds=leaderboard.recent_window)))
+                counted = set(res.scalars())
+                await db.rollback()
+                leaderboard.replace(players, counted)
+    return leaderboard.top(limit)
+
+
+# load_lobby fills the lobby index with the open games that are active in the backend
+async def load_lobby(db: AsyncSession, lobby: LobbyIndex | None = None, batch_size: int = 1000):
+    lobby = manager.lobby if lobby is None else lobby
+    after = 0
+    while True:
+        res = await db.execute(select(Game).where(Game.enemy == None, Game.game_id > after)
+                               .order_by(Game.game_id).limit(batch_size))
+        games = res.scalars().all()
+        if(len(games) == 0):
+            return
+        active = await manager.active_games([game.game_id for game in games])
+        for game in games:
+            if(game.game_id in active):
+                lobby.add(GameInfo.from_orm(game))
+        after = games[-1].game_id
 
-async def turn_game_into_ai(db: Session, game_id: int, player_id: str):
-    game = get_game(db, game_id)
-    if(game is None):
-        raise Exception("TODO")
+
+async def turn_game_into_ai(db: AsyncSession, game_id: int, player_id: str):
+    state = await get_game_state(db, game_id)
+    game = state.info
     if(game.host != player_id):
         raise Exception("TODO")
     if(game.enemy is not None):
         raise Exception("TODO")
+    if(is_sparse(state.board)):
+        # the search plays on a dense copy of the board
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": f"AI opponents can not play boards this large"},
+        )
 
     bot_user_name = f"bot_{int(time.time())}"
 
-    row = register_for_game(db, game_id, bot_user_name)
+    row = await register_for_game(db, game_id, bot_user_name, bot=True)
     if(row is None):
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -276,22 +818,26 @@ async def turn_game_into_ai(db: Session, game_id: int, player_id: str):
     return row
 
 
-def create_game(db: Session, game_schema: GameSchema):
+async def create_game(db: AsyncSession, game_schema: GameSchema):
     db_game = Game(host=game_schema.host, width=game_schema.width,
                    height=game_schema.height, line_target=game_schema.line_target)
     db.add(db_game)
-    db.commit()
-    db.refresh(db_game)
-    return db_game
+    await db.commit()
+    await db.refresh(db_game)
+    return GameInfo.from_orm(db_game)
 
 
-def register_for_game(db: Session, game_id: int, player_id: str) -> Game:
-    game = get_game(db, game_id)
+async def register_for_game(db: AsyncSession, game_id: int, player_id: str, bot: bool = False) -> GameInfo | None:
+    game = await get_game(db, game_id)
     if (game is None):
         raise GameNotFound(game_id)
     if (game.enemy is not None):
         raise GameFullException(game_id)
-    res = db.execute(update(Game).where(Game.game_id == game_id).values(
-        enemy=player_id).returning(Game)).first()
-    db.commit()
-    return res
+    res = (await db.execute(update(Game).where(Game.game_id == game_id).values(
+        enemy=player_id, enemy_bot=bot).returning(Game))).first()
+    await db.commit()
+    state = manager.cache.peek(game_id)
+    if(state is not None):
+        state.info.enemy = player_id
+        state.touch()
+    return GameInfo.from_orm(res) if res is not None else None
@@ -0,0 +1,68 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from services.game.protocol import Listener, send_frame
+
+# queued in place of the dropped frames of a spectator that fell behind
+RESYNC = object()
+
+
+class Spectator():
+    """
+    A viewer of a game that is not one of its players.
+    Frames are queued without waiting and sent by the spectator's own task, so a slow viewer never delays
+    the players. When the queue is full the queued frames are dropped and the latest snapshot is sent instead,
+    frames older than that snapshot are skipped.
+    """
+    __slots__ = ("listener", "queue", "snapshot", "timeout", "stale", "task")
+
+    def __init__(self, listener: Listener, queue_size: int, snapshot: Callable[[Listener], Awaitable[tuple[int, str]]], timeout: float):
+        self.listener = listener
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.snapshot = snapshot
+        self.timeout = timeout
+        self.stale = False
+        self.task: asyncio.Task | None = None
+
+    # start sends the current snapshot first, then the queued frames, on_close runs once the socket failed
+    def start(self, on_close: Callable[["Spectator"], None]):
+        self.resync()
+        self.task = asyncio.create_task(self.__run())
+        self.task.add_done_callback(lambda _: on_close(self))
+
+    def stop(self):
+        if(self.task is not None):
+            self.task.cancel()
+
+    # offer queues a frame, `seq` is the sequence number of move frames and None for any other event
+    def offer(self, seq: int | None, frame: str | bytes):
+        if(self.stale):
+            return
+        try:
+            self.queue.put_nowait((seq, frame))
+        except asyncio.QueueFull:
+            self.resync()
+
+    def resync(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.stale = True
+        self.queue.put_nowait(RESYNC)
+
+    async def __run(self):
+        snapshot_seq = -1
+        while True:
+            item = await self.queue.get()
+            if(item is RESYNC):
+                # frames queued from now on are sent after the snapshot, the ones it already includes are skipped
+                self.stale = False
+                try:
+                    snapshot_seq, frame = await self.snapshot(self.listener)
+                except Exception:
+                    return
+            else:
+                seq, frame = item
+                if(seq is not None and seq <= snapshot_seq):
+                    continue
+            if(not await send_frame(self.listener.ws, frame, self.timeout)):
+                return
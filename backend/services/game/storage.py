@@ -0,0 +1,165 @@
+from typing import Any
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, undefer
+
+from services.game.engine import Board, board_class, create_board, unpack_board
+from services.game.models import Game, GameMove, GameTile
+from services.game.schemas import PlayerMove
+from services.game.writer import PendingMove
+
+
+# run in the transaction of the session, asyncpg prepares it once per connection and caches it,
+# so a move is a single round trip plus its commit
+APPLY_MOVE = text("SELECT tile_x, tile_y, game_winner FROM apply_move(:game_id, :row, :direction, :player, :y)")
+
+
+class TileStorage():
+    """
+    Stores one game_tile row per occupied cell.
+    Moves are applied by the apply_move function installed by scripts/migrations/006_apply_move.sql.
+    """
+
+    async def prepare(self, db: AsyncSession):
+        res = await db.execute(text("SELECT to_regprocedure('apply_move(integer, integer, text, text, integer)')"))
+        if(res.scalar() is None):
+            raise RuntimeError("apply_move is missing, run scripts/migrations/006_apply_move.sql")
+        await db.rollback()
+
+    async def load(self, db: AsyncSession, game_id: int) -> tuple[Game, Board] | None:
+        res = await db.execute(select(Game).options(selectinload(Game.tiles)).where(
+            Game.game_id == game_id))
+        game = res.scalars().first()
+        if(game is None):
+            return None
+        return game, board_class(game.width, game.height).from_game(game)  # type: ignore
+
+    # load_boards builds the boards of many games with a single query
+    async def load_boards(self, db: AsyncSession, games: list[Game]) -> dict[int, Board]:
+        tiles: dict[int | None, list[tuple[int, int, str]]] = {game.game_id: [] for game in games}
+        res = await db.execute(select(GameTile.game_id, GameTile.x, GameTile.y, GameTile.value)
+                               .where(GameTile.game_id.in_(list(tiles))))
+        for game_id, x, y, value in res:
+            tiles[game_id].append((x, y, value))
+        return {game.game_id: board_class(game.width, game.height).from_tiles(game.width, game.height, game.line_target, tiles[game.game_id], game.winner)  # type: ignore
+                for game in games}
+
+    # save_move stores the move and its winner, returns False if the database maps it to another cell,
+    # which means the board it was played on is stale
+    async def save_move(self, db: AsyncSession, game_id: int, board: Board, players: tuple[str, str | None], move: PlayerMove, x: int, y: int, player_id: str, wins: bool) -> bool:
+        res = await db.execute(APPLY_MOVE, {"game_id": game_id, "row": move.row, "direction": move.direction.value,
+                                            "player": player_id, "y": y})
+        return res.first() is not None
+
+    def snapshot(self, board: Board, players: tuple[str, str | None]) -> bytes | None:
+        return None
+
+    # save_moves adds moves of many games to the session without committing, see services.game.writer
+    async def save_moves(self, db: AsyncSession, moves: list[PendingMove]):
+        await db.execute(insert(GameTile).values([
+            {"game_id": move.game_id, "game_width": move.width, "game_height": move.height,
+             "x": move.x, "y": move.y, "value": move.player_id} for move in moves]).on_conflict_do_nothing())
+        await save_winners(db, moves)
+
+
+class MoveLogStorage():
+    """
+    Stores every move in the append-only game_move log and a packed board snapshot on game
+    every `snapshot_interval` moves, a board is loaded as the snapshot plus the moves played after it.
+    """
+
+    def __init__(self, snapshot_interval: int = 16):
+        self.snapshot_interval = snapshot_interval
+
+    async def prepare(self, db: AsyncSession):
+        pass
+
+    async def load(self, db: AsyncSession, game_id: int) -> tuple[Game, Board] | None:
+        res = await db.execute(select(Game).options(undefer(Game.snapshot)).where(Game.game_id == game_id))
+        game = res.scalars().first()
+        if(game is None):
+            return None
+
+        players = (game.host, game.enemy)
+        if(game.snapshot is None):
+            board = create_board(game.width, game.height, game.line_target, game.winner)  # type: ignore
+        else:
+            board = unpack_board(game.snapshot, game.width, game.height, game.line_target,  # type: ignore
+                                 players, game.snapshot_seq, game.winner)  # type: ignore
+
+        res = await db.execute(select(GameMove).where(GameMove.game_id == game_id, GameMove.seq >= game.snapshot_seq)
+                               .order_by(GameMove.seq))
+        for move in res.scalars():
+            board.place(move.row, move.direction, move.player)  # type: ignore
+        return game, board
+
+    # load_boards builds the boards of many games with two queries, the snapshots and the moves played after them
+    async def load_boards(self, db: AsyncSession, games: list[Game]) -> dict[int, Board]:
+        info = {game.game_id: game for game in games}
+        res = await db.execute(select(Game.game_id, Game.snapshot).where(Game.game_id.in_(list(info))))
+        boards = {}
+        for game_id, snapshot in res:
+            game = info[game_id]
+            if(snapshot is None):
+                boards[game_id] = create_board(game.width, game.height, game.line_target, game.winner)  # type: ignore
+            else:
+                boards[game_id] = unpack_board(snapshot, game.width, game.height, game.line_target,  # type: ignore
+                                               (game.host, game.enemy), game.snapshot_seq, game.winner)  # type: ignore
+        res = await db.execute(select(GameMove).join(Game, Game.game_id == GameMove.game_id)
+                               .where(GameMove.game_id.in_(list(info)), GameMove.seq >= Game.snapshot_seq)
+                               .order_by(GameMove.game_id, GameMove.seq))
+        for move in res.scalars():
+            boards[move.game_id].place(move.row, move.direction, move.player)  # type: ignore
+        return boards
+
+    # save_move expects the move to be already placed on board, so board.moves - 1 is its sequence number
+    async def save_move(self, db: AsyncSession, game_id: int, board: Board, players: tuple[str, str | None], move: PlayerMove, x: int, y: int, player_id: str, wins: bool) -> bool:
+        seq = board.moves - 1
+        stmt = insert(GameMove).values(game_id=game_id, seq=seq, player=player_id, row=move.row,
+                                       direction=move.direction.value).on_conflict_do_nothing().returning(GameMove.seq)
+        result = await db.execute(stmt)
+        if(result.first() is None):
+            return False
+
+        values: dict[str, Any] = {}
+        if(wins):
+            values["winner"] = player_id
+        snapshot = self.snapshot(board, players)
+        if(snapshot is not None):
+            values["snapshot"] = snapshot
+            values["snapshot_seq"] = board.moves
+        if(values):
+            await db.execute(update(Game).where(Game.game_id == game_id).values(**values))
+        return True
+
+    # snapshot packs the board every snapshot_interval moves
+    def snapshot(self, board: Board, players: tuple[str, str | None]) -> bytes | None:
+        if(board.moves % self.snapshot_interval != 0):
+            return None
+        return board.pack(players)
+
+    # save_moves adds moves of many games to the session without committing, see services.game.writer
+    async def save_moves(self, db: AsyncSession, moves: list[PendingMove]):
+        await db.execute(insert(GameMove).values([
+            {"game_id": move.game_id, "seq": move.seq, "player": move.player_id, "row": move.row,
+             "direction": move.direction} for move in moves]).on_conflict_do_nothing())
+        await save_winners(db, moves)
+        # only the latest snapshot of each game is kept
+        snapshots = {move.game_id: move for move in moves if move.snapshot is not None}
+        for move in snapshots.values():
+            await db.execute(update(Game).where(Game.game_id == move.game_id, Game.snapshot_seq < move.seq + 1).values(
+                snapshot=move.snapshot, snapshot_seq=move.seq + 1))
+
+
+async def save_winners(db: AsyncSession, moves: list[PendingMove]):
+    for move in moves:
+        if(move.winner is not None):
+            await db.execute(update(Game).where(Game.game_id == move.game_id).values(winner=move.winner))
+
+
+def create_storage(name: str, snapshot_interval: int):
+    if(name == "moves"):
+        return MoveLogStorage(snapshot_interval)
+    return TileStorage()
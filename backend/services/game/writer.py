@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Callable
+
+import asyncpg
+from sqlalchemy.exc import DataError, IntegrityError
+
+from db.engine import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# key of the advisory lock held by the worker writing behind, a second one refuses to start,
+# it must differ from archive.PARTITION_LOCK, the writer holds it for as long as it runs
+WRITE_BEHIND_LOCK = 7_316_003
+
+
+class PendingMove():
+    """A move already applied to the in-memory board, waiting to be written"""
+    __slots__ = ("game_id", "seq", "width", "height", "row", "direction", "x", "y", "player_id", "winner", "snapshot")
+
+    def __init__(self, game_id: int, seq: int, width: int, height: int, row: int, direction: str, x: int, y: int,
+                 player_id: str, winner: str | None, snapshot: bytes | None):
+        self.game_id = game_id
+        self.seq = seq
+        self.width = width
+        self.height = height
+        self.row = row
+        self.direction = direction
+        self.x = x
+        self.y = y
+        self.player_id = player_id
+        self.winner = winner
+        self.snapshot = snapshot
+
+    def dict(self) -> dict:
+        return {"game_id": self.game_id, "seq": self.seq, "row": self.row, "direction": self.direction,
+                "x": self.x, "y": self.y, "player": self.player_id, "winner": self.winner}
+
+
+class MoveWriter():
+    """
+    Write-behind persistence of moves, used when MOVE_WRITE_MODE=behind.
+    Moves are acknowledged once applied to the cached board and written by a background task in one
+    transaction every `flush_interval` seconds, or as soon as `max_batch` moves are waiting.
+
+    Durability: a move is durable once the flush that contains it commits. A crash loses the moves
+    acknowledged during the last flush_interval (plus the time of a failing flush), the games are then
+    read back from the database as of the last committed flush. A clean shutdown flushes everything.
+    Flushes failing on the database or the connection keep their moves, in order, and are retried.
+    A flush failing on a constraint, as a move of a game archived meanwhile, is split in halves until the
+    moves that can not be written are found, those and the later moves of their games are dropped to
+    `dead_letters` and logged, and `on_drop(game_id)` lets the game be read again from the database.
+    The cached board is the authoritative state until its moves are flushed, a game is flushed
+    before it is read again from the database, which is why this mode needs a single worker: start
+    takes an advisory lock on `dsn` and refuses to run while another worker holds it.
+    """
+
+    def __init__(self, storage, flush_interval: float, max_batch: int, dsn: str, on_drop: Callable[[int], None],
+                 max_dead_letters: int = 1000):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.dsn = dsn
+        self.on_drop = on_drop
+        self.pending: list[PendingMove] = []
+        # game_id -> moves of the game in `pending` or in the flush running
+        self.games: dict[int, int] = {}
+        self.dead_letters: deque[PendingMove] = deque(maxlen=max_dead_letters)
+        self.lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        # holds WRITE_BEHIND_LOCK while the writer runs
+        self.owner: asyncpg.Connection | None = None
+        self.flushed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_flush_time = 0.0
+
+    async def start(self):
+        if(self.task is not None):
+            return
+        self.owner = await asyncpg.connect(self.dsn)
+        if(not await self.owner.fetchval("SELECT pg_try_advisory_lock($1)", WRITE_BEHIND_LOCK)):
+            await self.owner.close()
+            self.owner = None
+            raise RuntimeError("MOVE_WRITE_MODE=behind needs a single worker, another worker already writes moves behind")
+        self.task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if(self.task is not None):
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        try:
+            await self.flush()
+        finally:
+            if(self.owner is not None):
+                await self.owner.close()
+                self.owner = None
+
+    def add(self, move: PendingMove):
+        self.pending.append(move)
+        self.games[move.game_id] = self.games.get(move.game_id, 0) + 1
+        if(len(self.pending) >= self.max_batch):
+            self.wakeup.set()
+
+    def has_pending(self, game_id: int):
+        return game_id in self.games
+
+    async def flush(self):
+        async with self.lock:
+            if(len(self.pending) == 0):
+                return
+            batch = self.pending
+            self.pending = []
+            start = time.perf_counter()
+            try:
+                dropped = await self.__write(batch, set())
+            except BaseException:
+                # the inserts ignore conflicts, so moves of a flush interrupted while committing can be written again
+                self.pending = batch + self.pending
+                raise
+            self.last_flush_time = time.perf_counter() - start
+            self.flushed += len(batch) - len(dropped)
+            for move in batch:
+                self.__written(move.game_id)
+            if(len(dropped) > 0):
+                games = {move.game_id for move in dropped}
+                # the moves played on those games since the flush started follow the dropped ones
+                later = [move for move in self.pending if move.game_id in games]
+                self.pending = [move for move in self.pending if move.game_id not in games]
+                for move in later:
+                    self.__written(move.game_id)
+                self.__drop(dropped + later, games)
+
+    # __write writes `moves` in one transaction, a batch failing on a constraint is split in halves until the moves
+    # that fail alone are found, the moves not written are returned, with the later moves of the games in `dropped`
+    async def __write(self, moves: list[PendingMove], dropped: set[int]) -> list[PendingMove]:
+        skipped = [move for move in moves if move.game_id in dropped]
+        moves = [move for move in moves if move.game_id not in dropped]
+        if(len(moves) == 0):
+            return skipped
+        try:
+            async with SessionLocal() as db:
+                for i in range(0, len(moves), self.max_batch):
+                    await self.storage.save_moves(db, moves[i:i + self.max_batch])
+                await db.commit()
+            return skipped
+        except (IntegrityError, DataError):
+            if(len(moves) == 1):
+                logger.exception("move %s can not be written, it is dropped", json.dumps(moves[0].dict()))
+                dropped.add(moves[0].game_id)
+                return skipped + moves
+        middle = len(moves) // 2
+        return skipped + await self.__write(moves[:middle], dropped) + await self.__write(moves[middle:], dropped)
+
+    def __drop(self, moves: list[PendingMove], games: set[int]):
+        self.dropped += len(moves)
+        self.dead_letters.extend(moves)
+        for game_id in games:
+            logger.error("game %s lost %s moves that could not be written", game_id,
+                         sum(1 for move in moves if move.game_id == game_id))
+            self.on_drop(game_id)
+
+    def __written(self, game_id: int):
+        count = self.games.get(game_id, 0) - 1
+        if(count <= 0):
+            self.games.pop(game_id, None)
+        else:
+            self.games[game_id] = count
+
+    async def __run(self):
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+                failures = 0
+            except Exception:
+                self.failed += 1
+                failures += 1
+                logger.exception("flushing %s moves failed", len(self.pending))
+                # retried with a backoff capped to 5 seconds while the database is failing
+                await asyncio.sleep(min(self.flush_interval * 2 ** min(failures, 10), 5))
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+# the tests run against the database of env.py, scripts/docker_postgres_init.sql must have been applied to it
+requires_database = pytest.mark.skipif(os.environ.get("DB_HOST") is None, reason="DB_HOST is not set")
+
+
+# every async test shares one event loop, the game manager and its locks are bound to the loop that started them
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+# game_manager starts the manager of services.game.service once for the tests calling the services directly
+@pytest.fixture(scope="session")
+async def game_manager(anyio_backend):
+    from db.engine import engine
+    from services.game.service import manager
+
+    await manager.start()
+    yield manager
+    await manager.stop()
+    await engine.dispose()
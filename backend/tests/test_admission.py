@@ -0,0 +1,173 @@
+import asyncio
+
+import pytest
+
+from services.game import admission
+from services.game.admission import Admission, AdmissionGate, RateLimiter
+from services.game.exceptions import AdmissionRejected
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+# waiting starts acquire and lets it reach the queue of the gate
+async def waiting(gate: AdmissionGate) -> asyncio.Task:
+    task = asyncio.create_task(gate.acquire())
+    await asyncio.sleep(0)
+    return task
+
+
+@pytest.mark.anyio
+async def test_gate_admits_up_to_limit_then_hands_slots_in_arrival_order():
+    gate = AdmissionGate(2, 10, 5)
+    assert await gate.acquire() and await gate.acquire()
+    first, second = await waiting(gate), await waiting(gate)
+    assert (gate.in_flight, len(gate.waiters), gate.queued) == (2, 2, 2)
+
+    gate.release()
+    assert await first is True
+    assert not second.done()
+    # the slot was handed over, not given back
+    assert gate.in_flight == 2
+
+    gate.release()
+    assert await second is True
+    gate.release()
+    gate.release()
+    assert (gate.in_flight, len(gate.waiters), gate.admitted) == (0, 0, 4)
+
+
+@pytest.mark.anyio
+async def test_gate_rejects_when_queue_is_full():
+    gate = AdmissionGate(1, 1, 5)
+    assert await gate.acquire()
+    queued = await waiting(gate)
+    assert await gate.acquire() is False
+    assert gate.rejected == 1
+
+    gate.release()
+    assert await queued is True
+
+
+@pytest.mark.anyio
+async def test_gate_without_queue_timeout_rejects_right_away():
+    gate = AdmissionGate(1, 10, 0)
+    assert await gate.acquire()
+    assert await gate.acquire() is False
+    assert (gate.queued, gate.rejected) == (0, 1)
+
+
+@pytest.mark.anyio
+async def test_gate_rejects_after_queue_timeout():
+    gate = AdmissionGate(1, 10, 0.01)
+    assert await gate.acquire()
+    assert await gate.acquire() is False
+    assert (len(gate.waiters), gate.rejected, gate.in_flight) == (0, 1, 1)
+
+    gate.release()
+    assert gate.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_gate_skips_cancelled_waiters():
+    gate = AdmissionGate(1, 10, 5)
+    assert await gate.acquire()
+    cancelled, queued = await waiting(gate), await waiting(gate)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert len(gate.waiters) == 1
+
+    gate.release()
+    assert await queued is True
+    gate.release()
+    assert gate.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_gate_gives_back_slot_handed_to_cancelled_waiter():
+    gate = AdmissionGate(1, 10, 5)
+    assert await gate.acquire()
+    task = await waiting(gate)
+    # the slot is handed over and the request is cancelled before it runs again,
+    # it is either admitted and released by its caller or given back by acquire, never lost
+    gate.release()
+    task.cancel()
+    try:
+        admitted = await task
+    except asyncio.CancelledError:
+        admitted = False
+    if(admitted):
+        gate.release()
+    assert (gate.in_flight, len(gate.waiters)) == (0, 0)
+
+
+@pytest.mark.anyio
+async def test_gate_with_zero_limit_admits_everything():
+    gate = AdmissionGate(0, 0, 0)
+    assert all([await gate.acquire() for _ in range(100)])
+    assert gate.rejected == 0
+
+
+@pytest.mark.anyio
+async def test_export_release_gives_the_slot_back_once():
+    gate = AdmissionGate(1, 0, 0)
+    control = Admission(AdmissionGate(0, 0, 0), RateLimiter(0, 0), AdmissionGate(0, 0, 0), RateLimiter(0, 0), gate, 1.5)
+    release = await control.acquire_export()
+    with pytest.raises(AdmissionRejected) as rejected:
+        await control.acquire_export()
+    assert (rejected.value.status_code, rejected.value.retry_after) == (503, 2)
+
+    release()
+    release()
+    assert gate.in_flight == 0
+
+
+def test_rate_limiter_allows_burst_then_asks_to_wait(clock):
+    limiter = RateLimiter(2, 3)
+    assert [limiter.check("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.check("a") == pytest.approx(0.5)
+    assert limiter.limited == 1
+    # other keys have their own bucket
+    assert limiter.check("b") == 0
+
+
+def test_rate_limiter_refills_over_time(clock):
+    limiter = RateLimiter(2, 3)
+    for _ in range(3):
+        limiter.check("a")
+    clock.now += 0.5
+    assert limiter.check("a") == 0
+    assert limiter.check("a") == pytest.approx(0.5)
+    # the bucket never holds more than the burst
+    clock.now += 60
+    assert [limiter.check("a") for _ in range(4)][-1] > 0
+
+
+def test_rate_limiter_forgets_least_recently_seen_keys(clock):
+    limiter = RateLimiter(1, 1, max_keys=2)
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("a")
+    limiter.check("c")
+    assert list(limiter.buckets) == ["a", "c"]
+    # a forgotten key starts again with a full bucket
+    assert limiter.check("b") == 0
+
+
+def test_rate_limiter_with_zero_rate_is_disabled(clock):
+    limiter = RateLimiter(0, 1)
+    assert all(limiter.check("a") == 0 for _ in range(100))
+    assert len(limiter.buckets) == 0
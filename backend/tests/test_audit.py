@@ -0,0 +1,88 @@
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from services.game.audit import AuditGame, VerdictEnum, audit_games, board_codes, has_line, packed_codes
+from services.game.engine import Board, SparseBoard
+from services.game.utils import check_grid
+
+PLAYERS = ("host", "enemy")
+
+
+def random_grid(rand: random.Random, width: int, height: int, fill: float) -> list[list[str | None]]:
+    return [[rand.choice(PLAYERS) if rand.random() < fill else None for _ in range(width)] for _ in range(height)]
+
+
+# grid_has_line checks every cell of `value` with utils.check_grid
+def grid_has_line(grid: list[list[str | None]], target: int, value: str) -> bool:
+    return any(check_grid(grid, target, value, x, y)[0]
+               for x, row in enumerate(grid) for y, cell in enumerate(row) if cell == value)
+
+
+def audit_game(tiles: list[tuple[int, int, str]], winner: str | None, moves: int, enemy: str | None = "enemy",
+               board_type: type[Board] = Board) -> AuditGame:
+    game = SimpleNamespace(game_id=1, width=4, height=4, line_target=3, host="host", enemy=enemy, winner=winner)
+    return AuditGame(game, moves, board=board_type.from_tiles(4, 4, 3, tiles))
+
+
+@pytest.mark.parametrize("target", [1, 2, 3, 4, 6])
+def test_has_line_matches_check_grid(target):
+    rand = random.Random(target)
+    grids = [random_grid(rand, 5, 4, 0.6) for _ in range(200)]
+    codes = np.array([[[1 if cell == "host" else 0 for cell in row] for row in grid] for grid in grids], dtype=bool)
+    assert has_line(codes, target).tolist() == [grid_has_line(grid, target, "host") for grid in grids]
+
+
+@pytest.mark.parametrize("board_type", [Board, SparseBoard])
+def test_packed_codes_match_board_codes(board_type):
+    rand = random.Random(3)
+    for width, height in ((1, 1), (3, 5), (7, 6), (9, 9)):
+        grid = random_grid(rand, width, height, 0.5)
+        tiles = [(x, y, cell) for x, row in enumerate(grid) for y, cell in enumerate(row) if cell is not None]
+        board = board_type.from_tiles(width, height, 4, tiles)
+        codes = board_codes(board, PLAYERS)
+        assert codes.tolist() == [0 if cell is None else PLAYERS.index(cell) + 1 for row in grid for cell in row]
+        assert packed_codes(board.pack(PLAYERS), width, height).tolist() == codes.tolist()
+
+
+def test_packed_codes_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        packed_codes(b"\x07\x00", 2, 2)
+
+
+HOST_LINE = [(0, 0, "host"), (1, 1, "host"), (2, 2, "host")]
+ENEMY_LINE = [(3, 0, "enemy"), (3, 1, "enemy"), (3, 2, "enemy")]
+NO_LINE = [(0, 0, "host"), (0, 3, "enemy")]
+
+
+@pytest.mark.parametrize("tiles, winner, moves, verdict", [
+    (HOST_LINE, "host", 5, VerdictEnum.ok),
+    (ENEMY_LINE, "enemy", 6, VerdictEnum.ok),
+    (NO_LINE, None, 2, VerdictEnum.ok),
+    (HOST_LINE, None, 5, VerdictEnum.missed_win),
+    (HOST_LINE, "enemy", 6, VerdictEnum.wrong_winner),
+    (HOST_LINE, "somebody", 5, VerdictEnum.wrong_winner),
+    (HOST_LINE + ENEMY_LINE, "host", 6, VerdictEnum.both_lines),
+    # the enemy had the turn and let the clock run out
+    (NO_LINE, "host", 3, VerdictEnum.forfeit),
+    (NO_LINE, "host", 2, VerdictEnum.no_line),
+    (NO_LINE, "enemy", 2, VerdictEnum.forfeit),
+    (NO_LINE, "enemy", 3, VerdictEnum.no_line),
+])
+def test_verdicts(tiles, winner, moves, verdict):
+    for board_type in (Board, SparseBoard):
+        game = audit_game(tiles, winner, moves, board_type=board_type)
+        assert audit_games([game]) == [(game, verdict)]
+
+
+def test_audit_games_keeps_the_order_across_stacks():
+    games = [audit_game(HOST_LINE, "host", 5), audit_game(HOST_LINE, None, 5), audit_game(NO_LINE, "host", 2)]
+    # a 6x2 game with no enemy yet, scanned in its own stack
+    open_game = SimpleNamespace(game_id=2, width=6, height=2, line_target=3, host="host", enemy=None, winner=None)
+    games.insert(1, AuditGame(open_game, 1, packed=Board.from_tiles(6, 2, 3, [(0, 5, "host")]).pack(("host", None))))
+    expected = [VerdictEnum.ok, VerdictEnum.ok, VerdictEnum.missed_win, VerdictEnum.no_line]
+    # a stack of a single game at a time gives the same verdicts
+    for max_cells in (1 << 24, 1):
+        assert audit_games(games, max_cells) == list(zip(games, expected))
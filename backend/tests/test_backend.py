@@ -0,0 +1,43 @@
+import pytest
+
+from services.game.backend import InMemoryGameBackend
+
+
+@pytest.mark.anyio
+async def test_publish_delivers_in_order_and_survives_failing_listeners():
+    delivered = []
+
+    async def on_message(game_id: int, message: dict, local: bool):
+        delivered.append((game_id, message["type"], local))
+        if(message["type"] == "move"):
+            raise RuntimeError("socket broke")
+
+    backend = InMemoryGameBackend()
+    await backend.start(on_message)
+    await backend.publish(1, {"type": "move"})
+    await backend.publish(1, {"type": "timeout"})
+    assert delivered == [(1, "move", True), (1, "timeout", True)]
+
+    await backend.stop()
+    await backend.publish(1, {"type": "move"})
+    assert len(delivered) == 2
+
+
+@pytest.mark.anyio
+async def test_turns_pass_between_the_seated_players():
+    backend = InMemoryGameBackend()
+    await backend.register_game(1, "host")
+    # nobody moves before the enemy sits down
+    assert await backend.advance_turn(1, "host") is None
+    assert not await backend.set_enemy(1, "host")
+    assert await backend.set_enemy(1, "enemy")
+    assert not await backend.set_enemy(1, "other")
+
+    assert await backend.advance_turn(1, "enemy") is None
+    assert await backend.advance_turn(1, "host") == ("enemy", None)
+    await backend.release_turn(1, "host")
+    assert (await backend.get_session(1)).turn == "host"
+
+    assert await backend.active_games([1, 2]) == {1}
+    await backend.forget(1)
+    assert await backend.get_session(1) is None
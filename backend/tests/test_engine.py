@@ -0,0 +1,145 @@
+import random
+
+import pytest
+
+from services.game.engine import DENSE_FORMAT, SPARSE_FORMAT, Board, SparseBoard, unpack_board
+from services.game.schemas import PlayDirectionEnum
+from services.game.utils import check_grid
+
+LEFT = PlayDirectionEnum.left
+RIGHT = PlayDirectionEnum.right
+PLAYERS = ("host", "enemy")
+
+
+# slide places a tile on a grid like the old valid moves query mapped it, without fill counters:
+# a move from the left takes the last empty cell of the row, a move from the right the first one
+def slide(grid: list[list[str | None]], row: int, direction: PlayDirectionEnum, value: str) -> tuple[int, int] | None:
+    empty = [y for y, cell in enumerate(grid[row]) if cell is None]
+    if(len(empty) == 0):
+        return None
+    y = empty[-1] if direction == LEFT else empty[0]
+    grid[row][y] = value
+    return row, y
+
+
+# fills returns the fill counters of the rows with room left, a full row is recounted as filled from one side
+def fills(board: Board) -> list[tuple[int, int] | None]:
+    return [None if board.is_row_full(row) else (board.left_fill[row], board.right_fill[row]) for row in range(board.height)]
+
+
+# random_game plays random moves on a fresh board of `board_type` and on a plain grid, checking every move against the grid
+def random_game(board_type: type[Board], width: int, height: int, target: int, seed: int) -> tuple[Board, list]:
+    rand = random.Random(seed)
+    board = board_type(width, height, target)
+    grid: list[list[str | None]] = [[None] * width for _ in range(height)]
+    played = []
+    for turn in range(width * height + 5):
+        row = rand.randrange(height)
+        direction = rand.choice((LEFT, RIGHT))
+        value = PLAYERS[turn % 2]
+        expected = slide(grid, row, direction, value)
+        assert board.map_move(row, direction) == expected
+        assert board.place(row, direction, value) == expected
+        if(expected is None):
+            continue
+        played.append((row, direction, expected))
+        won, count = board.check_win(*expected)
+        expected_won, expected_count = check_grid(grid, target, value, *expected)
+        assert won == expected_won
+        if(not won):
+            assert count == expected_count
+        assert board.to_list() == grid
+    assert board.moves == len(played)
+    return board, played
+
+
+@pytest.mark.parametrize("board_type", [Board, SparseBoard])
+@pytest.mark.parametrize("seed", range(20))
+def test_moves_and_wins_match_the_grid_rules(board_type, seed):
+    random_game(board_type, 4 + seed % 5, 3 + seed % 4, 3 + seed % 3, seed)
+
+
+def test_map_move_fills_rows_from_both_sides():
+    board = Board(4, 2, 3)
+    assert board.place(0, LEFT, "host") == (0, 3)
+    assert board.place(0, RIGHT, "enemy") == (0, 0)
+    assert board.place(0, LEFT, "host") == (0, 2)
+    assert board.place(0, RIGHT, "enemy") == (0, 1)
+    assert board.is_row_full(0)
+    assert board.map_move(0, LEFT) is None
+    assert board.place(0, RIGHT, "host") is None
+    assert board.map_move(-1, LEFT) is None
+    assert board.map_move(2, RIGHT) is None
+    assert board.valid_move_cells() == [{"x": 1, "type": "left", "y": 3}, {"x": 1, "type": "right", "y": 0}]
+    assert [(move.row, move.direction) for move in board.valid_moves()] == [(1, LEFT), (1, RIGHT)]
+
+
+@pytest.mark.parametrize("board_type", [Board, SparseBoard])
+def test_undo_reverts_place(board_type):
+    board, played = random_game(board_type, 6, 5, 4, 7)
+    for row, direction, _ in reversed(played):
+        before = board.to_list()
+        coordinate = board.place(row, direction, "host")
+        if(coordinate is None):
+            continue
+        board.undo(row, direction)
+        assert board.to_list() == before
+        assert board.map_move(row, direction) == coordinate
+    assert board.moves == len(played)
+
+    for row, direction, _ in reversed(played):
+        board.undo(row, direction)
+    assert board.moves == 0
+    assert board.tiles() == []
+    assert all(value is None for row in board.to_list() for value in row)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_sparse_and_dense_boards_agree(seed):
+    dense, played = random_game(Board, 7, 6, 4, seed)
+    sparse, _ = random_game(SparseBoard, 7, 6, 4, seed)
+    assert sparse.tiles() == dense.tiles()
+    assert sparse.valid_move_cells() == dense.valid_move_cells()
+    assert (fills(sparse), sparse.moves) == (fills(dense), dense.moves)
+    for _, _, (x, y) in played:
+        assert sparse.check_win(x, y) == dense.check_win(x, y)
+    # only the tiles are stored
+    assert len(sparse.cells) == len(played)
+
+
+@pytest.mark.parametrize("board_type", [Board, SparseBoard])
+def test_from_tiles_rebuilds_the_fill_counters(board_type):
+    board, _ = random_game(board_type, 6, 6, 4, 3)
+    rebuilt = board_type.from_tiles(6, 6, 4, board.tiles())
+    assert rebuilt.to_list() == board.to_list()
+    assert (fills(rebuilt), rebuilt.moves) == (fills(board), board.moves)
+
+
+@pytest.mark.parametrize("board_type, packed_format", [(Board, DENSE_FORMAT), (SparseBoard, SPARSE_FORMAT)])
+@pytest.mark.parametrize("seed", range(5))
+def test_pack_round_trip(board_type, packed_format, seed):
+    width, height = 5 + seed, 4 + seed
+    board, _ = random_game(board_type, width, height, 4, seed)
+    data = board.pack(PLAYERS)
+    assert data[0] == packed_format
+
+    unpacked = unpack_board(data, width, height, 4, PLAYERS, board.moves, "host")
+    assert type(unpacked) is board_type
+    assert unpacked.to_list() == board.to_list()
+    assert fills(unpacked) == fills(board)
+    assert (unpacked.moves, unpacked.winner) == (board.moves, "host")
+    assert unpacked.pack(PLAYERS) == data
+
+
+def test_pack_of_an_empty_board():
+    for board_type in (Board, SparseBoard):
+        unpacked = unpack_board(board_type(3, 3, 3).pack(PLAYERS), 3, 3, 3, PLAYERS, 0)
+        assert unpacked.tiles() == []
+        assert unpacked.valid_move_cells() == Board(3, 3, 3).valid_move_cells()
+
+
+def test_unpack_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        unpack_board(b"\x07\x00", 2, 2, 2, PLAYERS, 0)
+    with pytest.raises(ValueError):
+        unpack_board(b"", 2, 2, 2, PLAYERS, 0)
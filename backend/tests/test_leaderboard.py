@@ -0,0 +1,49 @@
+from services.game.leaderboard import Leaderboard
+from services.game.schemas import PlayerStats
+
+
+def loaded(size: int, wins: dict[str, int], counted: set[int] | None = None) -> Leaderboard:
+    board = Leaderboard(size, 60)
+    board.replace([PlayerStats(player=player, games=count, wins=count) for player, count in wins.items()], counted or set())
+    return board
+
+
+def ranking(board: Leaderboard) -> list[tuple[str, int]]:
+    return [(stats.player, stats.wins) for stats in board.top(len(board))]
+
+
+def test_top_sorts_by_wins_then_player():
+    board = loaded(3, {"carol": 2, "bob": 5, "alice": 2})
+    assert ranking(board) == [("bob", 5), ("alice", 2), ("carol", 2)]
+    assert [stats.player for stats in board.top(1)] == ["bob"]
+    assert not board.is_stale()
+
+
+def test_results_move_players_on_the_board():
+    board = loaded(3, {"alice": 3, "bob": 2, "carol": 1})
+    board.record_result(1, "carol", "alice")
+    board.record_result(2, "carol", "bob")
+    assert ranking(board) == [("alice", 3), ("carol", 3), ("bob", 2)]
+    board.record_result(3, "carol", None)
+    assert ranking(board) == [("carol", 4), ("alice", 3), ("bob", 2)]
+    assert [stats.losses for stats in board.top(3)] == [0, 1, 1]
+
+
+def test_results_counted_by_the_load_are_skipped():
+    board = loaded(3, {"alice": 3, "bob": 2}, counted={7})
+    board.record_result(7, "bob", "alice")
+    assert ranking(board) == [("alice", 3), ("bob", 2)]
+    assert board.top(2)[0].losses == 0
+
+
+def test_new_winner_reloads_a_board_with_room_only():
+    board = loaded(3, {"alice": 3, "bob": 2})
+    board.record_result(1, "dave", "alice")
+    assert board.is_stale()
+    assert board.top(1)[0].losses == 1
+
+    # a full board keeps its players, the new winner climbs in on the next periodic reload
+    board = loaded(2, {"alice": 3, "bob": 2})
+    board.record_result(1, "dave", "bob")
+    assert not board.is_stale()
+    assert ranking(board) == [("alice", 3), ("bob", 2)]
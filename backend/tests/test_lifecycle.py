@@ -0,0 +1,90 @@
+import random
+
+from services.game.lifecycle import TimerWheel
+
+
+# wheel returns a wheel ticking every second from time 0, small enough for the timers to cross every level
+def wheel(bits: int = 2, levels: int = 3) -> TimerWheel:
+    timers = TimerWheel(1, bits, levels)
+    timers.origin = 0
+    return timers
+
+
+# run advances the wheel a tick at a time and returns the tick each key expired at
+def run(timers: TimerWheel, ticks: int) -> dict:
+    expired_at = {}
+    for tick in range(1, ticks + 1):
+        for key in timers.advance(tick):
+            assert key not in expired_at
+            expired_at[key] = tick
+    return expired_at
+
+
+def test_timer_expires_on_its_tick():
+    timers = wheel()
+    timers.schedule("a", 3)
+    assert timers.advance(2.9) == []
+    assert "a" in timers
+    assert timers.advance(3) == ["a"]
+    assert "a" not in timers and len(timers) == 0
+
+
+def test_delays_round_up_to_at_least_a_tick():
+    timers = wheel()
+    timers.schedule("now", 0)
+    timers.schedule("half", 1.5)
+    assert run(timers, 3) == {"now": 1, "half": 2}
+
+
+def test_reschedule_and_cancel():
+    timers = wheel()
+    timers.schedule("a", 2)
+    timers.schedule("b", 2)
+    timers.schedule("a", 20)
+    timers.cancel("b")
+    timers.cancel("missing")
+    assert len(timers) == 1
+    assert run(timers, 30) == {"a": 20}
+
+
+def test_advance_catches_up_in_order():
+    timers = wheel()
+    for delay in (9, 1, 40, 4):
+        timers.schedule(delay, delay)
+    assert timers.advance(50) == [1, 4, 9, 40]
+
+
+def test_timers_beyond_the_range_of_the_wheel():
+    # 2 bits and 2 levels cover 16 ticks
+    timers = wheel(2, 2)
+    timers.schedule("far", 100)
+    timers.schedule("near", 5)
+    assert run(timers, 120) == {"near": 5, "far": 100}
+
+
+def test_schedule_after_an_idle_wheel_counts_from_now():
+    timers = wheel()
+    assert timers.advance(1000) == []
+    timers.schedule("a", 10)
+    assert timers.advance(1009) == []
+    assert timers.advance(1010) == ["a"]
+
+
+def test_random_timers_expire_on_their_deadline():
+    rand = random.Random(5)
+    timers = wheel()
+    deadlines = {}
+    for tick in range(1, 400):
+        for _ in range(rand.randrange(3)):
+            key = rand.randrange(50)
+            if(rand.random() < 0.2):
+                timers.cancel(key)
+                deadlines.pop(key, None)
+            else:
+                delay = rand.randrange(1, 150)
+                timers.schedule(key, delay)
+                deadlines[key] = tick - 1 + delay
+        for key in timers.advance(tick):
+            assert deadlines.pop(key) == tick
+    assert all(deadline >= 400 for deadline in deadlines.values())
+    assert len(timers) == len(deadlines)
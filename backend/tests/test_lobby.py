@@ -0,0 +1,40 @@
+from services.game.lobby import LobbyIndex
+from services.game.schemas import GameInfo
+
+
+def game(game_id: int, enemy: str | None = None, winner: str | None = None) -> GameInfo:
+    return GameInfo(game_id=game_id, width=7, height=7, line_target=4, host="host", enemy=enemy, winner=winner)
+
+
+def test_add_keeps_only_open_games():
+    lobby = LobbyIndex()
+    assert lobby.add(game(1))
+    assert not lobby.add(game(1))
+    assert not lobby.add(game(2, enemy="enemy"))
+    assert not lobby.add(game(3, winner="host"))
+    assert len(lobby) == 1
+
+
+def test_page_walks_the_games_by_id():
+    lobby = LobbyIndex()
+    for game_id in (8, 3, 5, 1, 13):
+        lobby.add(game(game_id))
+    assert [info.game_id for info in lobby.page(0, 2)] == [1, 3]
+    assert [info.game_id for info in lobby.page(3, 2)] == [5, 8]
+    assert [info.game_id for info in lobby.page(8, 2)] == [13]
+    assert lobby.page(13, 2) == []
+    # `after` does not have to be a game of the lobby
+    assert [info.game_id for info in lobby.page(6, 10)] == [8, 13]
+
+
+def test_remove():
+    lobby = LobbyIndex()
+    for game_id in (1, 2, 3):
+        lobby.add(game(game_id))
+    assert lobby.remove(2).game_id == 2
+    assert lobby.remove(2) is None
+    assert [info.game_id for info in lobby.page(0, 10)] == [1, 3]
+    assert len(lobby) == 2
+    # a removed game can come back
+    assert lobby.add(game(2))
+    assert [info.game_id for info in lobby.page(1, 1)] == [2]
@@ -0,0 +1,60 @@
+import pytest
+
+from db.query_stats import assert_max_queries
+from services.game.schemas import Game, PlayDirectionEnum, PlayerMove
+
+from tests.conftest import requires_database
+
+# the services must not send more queries than these budgets, an N+1 load fails the test with the statements it sent
+# db.engine builds its engine from DB_* when imported, the services are imported by the tests so they can be skipped
+pytestmark = [requires_database, pytest.mark.anyio]
+
+HOST = "budget-host"
+ENEMY = "budget-enemy"
+
+
+@pytest.fixture
+async def game_id(game_manager):
+    from db.engine import SessionLocal
+    from services.game.service import create_game, register_for_game
+
+    async with SessionLocal() as db:
+        game = await create_game(db, Game(width=7, height=7, line_target=4, host=HOST))
+        await game_manager.register_game(game)
+        await register_for_game(db, game.game_id, ENEMY)
+        await game_manager.add_enemy_to_game(ENEMY, game.game_id)
+    game_manager.cache.invalidate(game.game_id)
+    return game.game_id
+
+
+async def test_play_move(game_id):
+    from db.engine import SessionLocal
+    from services.game.service import play_move
+
+    # the game row, its tiles and the move
+    async with SessionLocal() as db:
+        with assert_max_queries(3):
+            await play_move(db, PlayerMove(row=0, direction=PlayDirectionEnum.left), game_id, HOST)
+
+    async with SessionLocal() as db:
+        with assert_max_queries(1):
+            await play_move(db, PlayerMove(row=1, direction=PlayDirectionEnum.left), game_id, ENEMY)
+
+
+async def test_get_current_game_status(game_id):
+    from db.engine import SessionLocal
+    from services.game.service import get_current_game_status
+
+    async with SessionLocal() as db:
+        await get_current_game_status(db, game_id)
+        with assert_max_queries(0):
+            await get_current_game_status(db, game_id)
+
+
+async def test_get_free_games(game_manager):
+    from db.engine import SessionLocal
+    from services.game.service import get_free_games
+
+    async with SessionLocal() as db:
+        with assert_max_queries(1):
+            await get_free_games(db, HOST)
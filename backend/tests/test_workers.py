@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+import websockets
+
+from tests.conftest import requires_database
+
+pytestmark = [requires_database, pytest.mark.anyio]
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# start_worker runs the app in its own uvicorn process and waits until it answers
+def start_worker(port: int) -> subprocess.Popen:
+    env = {**os.environ, "GAME_BACKEND": "postgres", "MOVE_WRITE_MODE": "sync"}
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+                               cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if(process.poll() is not None):
+            raise RuntimeError(f"worker on port {port} exited with {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/games", params={"token": "probe"}, timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"worker on port {port} did not start")
+
+
+@pytest.fixture(scope="module")
+def workers():
+    ports = [free_port(), free_port()]
+    processes = []
+    try:
+        for port in ports:
+            processes.append(start_worker(port))
+        yield [f"127.0.0.1:{port}" for port in ports]
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(10)
+
+
+async def receive(ws, event_type: str) -> dict:
+    while True:
+        message = json.loads(await asyncio.wait_for(ws.recv(), 10))
+        if(message["type"] == event_type):
+            return message["payload"]
+
+
+async def test_move_on_one_worker_reaches_socket_on_other(workers):
+    a, b = workers
+    async with httpx.AsyncClient() as client:
+        game = (await client.post(f"http://{a}/games", params={"token": "wk_host"},
+                                  json={"width": 7, "height": 6, "line_target": 4})).json()
+        game_id = game["game_id"]
+        res = await client.post(f"http://{b}/games/{game_id}/membership", params={"token": "wk_enemy"})
+        assert res.status_code == 200
+
+        async with websockets.connect(f"ws://{b}/ws/{game_id}?token=wk_enemy&protocol=delta") as ws:
+            await ws.recv()
+            res = await client.post(f"http://{a}/games/{game_id}/moves", params={"token": "wk_host"},
+                                    json={"row": 2, "direction": "left"})
+            assert res.status_code == 200
+            payload = await receive(ws, "move")
+            assert (payload["seq"], payload["value"], payload["turn"]) == (1, "wk_host", "wk_enemy")
+
+            # worker B cached the board before the move, it plays the next one on the board worker A left
+            res = await client.post(f"http://{b}/games/{game_id}/moves", params={"token": "wk_enemy"},
+                                    json={"row": 2, "direction": "left"})
+            assert res.status_code == 200
+            assert res.json()["seq"] == 2
+            assert (res.json()["x"], res.json()["y"]) != (payload["x"], payload["y"])
+            assert (await receive(ws, "move"))["seq"] == 2